@@ -21,11 +21,68 @@ def create_app():
     app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get(
         'DATABASE_URL', 'sqlite:///security_ops.db')
     app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    app.config['RETENTION_BATCH_SIZE'] = int(os.environ.get('RETENTION_BATCH_SIZE', 500))
+    app.config['RETENTION_POLICIES'] = {}
+    app.config['STORAGE_BACKEND'] = os.environ.get('STORAGE_BACKEND', 'local')
+    app.config['STORAGE_ROOT'] = os.environ.get(
+        'STORAGE_ROOT', os.path.join(app.instance_path, 'uploads'))
+    app.config['MAX_CONTENT_LENGTH'] = int(os.environ.get('MAX_UPLOAD_MB', 50)) * 1024 * 1024
+    app.config['USE_X_SENDFILE'] = os.environ.get('USE_X_SENDFILE', '').lower() == 'true'
+    app.config['IMAGE_CACHE_ROOT'] = os.environ.get(
+        'IMAGE_CACHE_ROOT', os.path.join(app.instance_path, 'derivatives'))
+    app.config['IMAGE_CACHE_MAX_MB'] = int(os.environ.get('IMAGE_CACHE_MAX_MB', 512))
+    app.config['IMAGE_WORKERS'] = int(os.environ.get('IMAGE_WORKERS', 2))
+    app.config['IMAGE_DERIVATIVES_EAGER'] = os.environ.get('IMAGE_DERIVATIVES_EAGER', 'true').lower() == 'true'
+    app.config['AUDITED_TABLES'] = [
+        name.strip() for name in os.environ.get('AUDITED_TABLES', 'payrolls,attendances,shifts').split(',')
+        if name.strip()
+    ]
+    app.config['AUDIT_BATCH_SIZE'] = int(os.environ.get('AUDIT_BATCH_SIZE', 200))
+    app.config['AUDIT_FLUSH_INTERVAL_SECONDS'] = float(os.environ.get('AUDIT_FLUSH_INTERVAL_SECONDS', 1.0))
+    app.config['METRICS_TOKEN'] = os.environ.get('METRICS_TOKEN')
+    app.config['METRICS_PUBLIC'] = os.environ.get('METRICS_PUBLIC', '').lower() == 'true'
+    app.config['N_PLUS_ONE_THRESHOLD'] = int(os.environ.get('N_PLUS_ONE_THRESHOLD', 10))
+    app.config['SLOW_QUERY_THRESHOLD_MS'] = float(os.environ.get('SLOW_QUERY_THRESHOLD_MS', 100))
+    app.config['PROFILING_ENABLED'] = os.environ.get('PROFILING_ENABLED', '').lower() == 'true'
+    app.config['PROFILE_SAMPLE_RATE'] = float(os.environ.get('PROFILE_SAMPLE_RATE', 0))
+    app.config['PROFILE_DIR'] = os.environ.get(
+        'PROFILE_DIR', os.path.join(app.instance_path, 'profiles'))
+    app.config['PROFILE_MAX_FILES'] = int(os.environ.get('PROFILE_MAX_FILES', 200))
+    app.config['TRACING_ENABLED'] = os.environ.get('TRACING_ENABLED', '').lower() == 'true'
+    app.config['TRACE_SAMPLE_RATE'] = float(os.environ.get('TRACE_SAMPLE_RATE', 1.0))
+    app.config['TRACE_EXPORT_PATH'] = os.environ.get(
+        'TRACE_EXPORT_PATH', os.path.join(app.instance_path, 'traces.jsonl'))
+    app.config['TRACE_COLLECTOR_URL'] = os.environ.get('TRACE_COLLECTOR_URL')
+    app.config['AGENT_OVERVIEW_CACHE_SECONDS'] = int(os.environ.get('AGENT_OVERVIEW_CACHE_SECONDS', 300))
+    app.config['REPORT_CACHE_SECONDS'] = int(os.environ.get('REPORT_CACHE_SECONDS', 300))
+    app.config['COMPANY_NAME'] = os.environ.get('COMPANY_NAME', 'Dashflow')
+    app.config['INVOICE_PDF_CACHE_ROOT'] = os.environ.get(
+        'INVOICE_PDF_CACHE_ROOT', os.path.join(app.instance_path, 'invoice_pdfs'))
+    app.config['INVOICE_PDF_CACHE_MAX_MB'] = int(os.environ.get('INVOICE_PDF_CACHE_MAX_MB', 256))
+    app.config['INVOICE_PDF_WORKERS'] = int(os.environ.get('INVOICE_PDF_WORKERS', 2))
+    app.config['IDEMPOTENCY_TTL_HOURS'] = int(os.environ.get('IDEMPOTENCY_TTL_HOURS', 24))
+    app.config['IDEMPOTENCY_WAIT_SECONDS'] = float(os.environ.get('IDEMPOTENCY_WAIT_SECONDS', 10))
+    app.config['IDEMPOTENCY_LOCK_SECONDS'] = int(os.environ.get('IDEMPOTENCY_LOCK_SECONDS', 300))
+    app.config['EXPORT_WATERMARK_LAG_SECONDS'] = int(os.environ.get('EXPORT_WATERMARK_LAG_SECONDS', 300))
+    app.config['JOB_POLL_SECONDS'] = float(os.environ.get('JOB_POLL_SECONDS', 1.0))
+    app.config['JOB_STALE_SECONDS'] = int(os.environ.get('JOB_STALE_SECONDS', 300))
+    app.config['JOB_RETRY_BASE_SECONDS'] = int(os.environ.get('JOB_RETRY_BASE_SECONDS', 30))
+    app.config['SCHEDULER_ENABLED'] = os.environ.get('SCHEDULER_ENABLED', '').lower() == 'true'
+    app.config['SCHEDULER_POLL_SECONDS'] = float(os.environ.get('SCHEDULER_POLL_SECONDS', 30))
+    app.config['SCHEDULER_LEASE_SECONDS'] = int(os.environ.get('SCHEDULER_LEASE_SECONDS', 90))
+    app.config['SCHEDULER_MISSED_GRACE_SECONDS'] = int(os.environ.get('SCHEDULER_MISSED_GRACE_SECONDS', 300))
+    app.config['SCHEDULES'] = {}
+    app.config['EXPIRY_ALERT_DAYS'] = [
+        int(days) for days in os.environ.get('EXPIRY_ALERT_DAYS', '30,7,0').split(',') if days.strip()
+    ]
 
     # Enable CORS for frontend
     # Allow Authorization header so JWT auth works from the browser
     CORS(app, origins=['http://localhost:5173', 'http://localhost:3000'], supports_credentials=True,
-         allow_headers=['Content-Type', 'Authorization'])
+         allow_headers=['Content-Type', 'Authorization', 'X-Profile', 'X-Profile-Memory', 'traceparent',
+                        'Idempotency-Key'],
+         expose_headers=['X-Profile-Id', 'X-Trace-Id', 'traceparent', 'X-Export-Watermark',
+                         'Idempotent-Replayed'])
 
     # Initialize extensions
     db.init_app(app)
@@ -89,6 +146,19 @@ def create_app():
         trainings,
         documents,
         notifications,
+        retention,
+        search,
+        files,
+        audit,
+        metrics,
+        slow_queries,
+        profiles,
+        ledger,
+        reports,
+        exports,
+        analytics,
+        jobs,
+        scheduler,
     )
     app.register_blueprint(auth.bp)
     app.register_blueprint(agents.bp)
@@ -105,5 +175,57 @@ def create_app():
     app.register_blueprint(trainings.bp)
     app.register_blueprint(documents.bp)
     app.register_blueprint(notifications.bp)
+    app.register_blueprint(retention.bp)
+    app.register_blueprint(search.bp)
+    app.register_blueprint(files.bp)
+    app.register_blueprint(audit.bp)
+    app.register_blueprint(metrics.bp)
+    app.register_blueprint(slow_queries.bp)
+    app.register_blueprint(profiles.bp)
+    app.register_blueprint(ledger.bp)
+    app.register_blueprint(reports.bp)
+    app.register_blueprint(exports.bp)
+    app.register_blueprint(analytics.bp)
+    app.register_blueprint(jobs.bp)
+    app.register_blueprint(scheduler.bp)
+
+    from app import search as search_index
+    search_index.init_app(app)
+
+    from app import storage, imaging
+    storage.init_app(app)
+    imaging.init_app(app)
+    from app import invoice_pdf
+    invoice_pdf.init_app(app)
+
+    from app import audit as audit_log
+    audit_log.init_app(app)
+
+    from app import agent_overview
+    agent_overview.init_app(app)
+
+    from app import ledger as client_ledger
+    client_ledger.init_app(app)
+
+    from app import analytics as punctuality_analytics
+    punctuality_analytics.init_app(app)
+
+    from app import metrics as request_metrics
+    request_metrics.init_app(app)
+
+    from app import slow_queries as slow_query_log
+    slow_query_log.init_app(app)
+
+    from app import profiling
+    profiling.init_app(app)
+
+    from app import tracing
+    tracing.init_app(app)
+
+    from app import idempotency
+    idempotency.init_app(app)
+
+    from app import scheduler as periodic_tasks
+    periodic_tasks.init_app(app)
 
     return app
@@ -0,0 +1,370 @@
+"""Bulk import of agents from CSV or XLSX files.
+
+Rows are read one at a time and validated in chunks of ``CHUNK_SIZE``
+against the types and lengths of the ``agents`` columns. Uniqueness of
+``employee_code``, ``national_id`` and ``badge_number`` is checked against
+sets holding the values already stored (one query per key) and those seen
+earlier in the file. No query is made per row. Valid rows of each chunk
+are written with a single multi-row INSERT and added to the search index.
+
+The import is all or nothing by default: a file with any invalid row
+inserts nothing. With ``skip_invalid`` the valid rows are imported
+anyway. A dry run only validates. Every mode returns a report listing
+each invalid row with its line number, field and error.
+
+XLSX files are read by a minimal streaming reader that takes the cell
+values of the first worksheet. Dates may be ISO text or Excel serial
+numbers.
+"""
+import codecs
+import csv
+import re
+import zipfile
+from datetime import date, datetime, timedelta
+from decimal import Decimal, InvalidOperation
+from xml.etree.ElementTree import iterparse
+
+from sqlalchemy import insert, select
+from sqlalchemy.exc import IntegrityError
+
+from app import db, search
+from app.models import Agent
+
+CHUNK_SIZE = 1000
+MAX_REPORTED_ERRORS = 1000
+
+REQUIRED = ('employee_code', 'first_name', 'last_name', 'date_of_birth', 'phone_primary', 'hire_date',
+            'hourly_rate')
+UNIQUE = ('employee_code', 'national_id', 'badge_number')
+ALIASES = {
+    'cin': 'national_id',
+    'name': 'first_name',
+    'surname': 'last_name',
+    'phone': 'phone_primary',
+}
+
+_SYSTEM_COLUMNS = ('id', 'created_by', 'created_at', 'updated_at')
+_COLUMNS = {column.name: column for column in Agent.__table__.columns if column.name not in _SYSTEM_COLUMNS}
+
+_EXCEL_EPOCH = date(1899, 12, 30)
+_SERIAL = re.compile(r'^\d+(\.\d+)?$')
+_MAX_SERIAL = (date.max - _EXCEL_EPOCH).days + 1
+_TRUE = ('true', 'yes', 'y', '1')
+_FALSE = ('false', 'no', 'n', '0')
+_NS = '{http://schemas.openxmlformats.org/spreadsheetml/2006/main}'
+
+
+def _field(header):
+    name = re.sub(r'[\s\-]+', '_', (header or '').strip().lower())
+    return ALIASES.get(name, name)
+
+
+def _default(column):
+    default = column.default
+    return default.arg if default is not None and not default.is_callable else None
+
+
+def _parse_date(value):
+    # Serials stop at 9999-12-31; longer digit runs are compact ISO dates like 20240101
+    if _SERIAL.match(value) and float(value) < _MAX_SERIAL:
+        return _EXCEL_EPOCH + timedelta(days=int(float(value)))
+    try:
+        return datetime.fromisoformat(value).date()
+    except (ValueError, OverflowError) as exc:
+        raise ValueError('must be a date (YYYY-MM-DD)') from exc
+
+
+def _parse_decimal(value, column):
+    try:
+        number = Decimal(value.replace(',', ''))
+    except InvalidOperation as exc:
+        raise ValueError('must be a number') from exc
+    if not number.is_finite() or number < 0:
+        raise ValueError('must be a positive number')
+    precision, scale = column.type.precision, column.type.scale or 0
+    if precision and abs(number) >= Decimal(10) ** (precision - scale):
+        raise ValueError(f'must be less than {10 ** (precision - scale)}')
+    return number.quantize(Decimal(1).scaleb(-scale))
+
+
+def _parse_integer(value):
+    try:
+        number = Decimal(value)
+    except InvalidOperation as exc:
+        raise ValueError('must be a whole number') from exc
+    if number != number.to_integral_value():
+        raise ValueError('must be a whole number')
+    return int(number)
+
+
+def _parse_boolean(value):
+    lowered = value.lower()
+    if lowered in _TRUE:
+        return True
+    if lowered in _FALSE:
+        return False
+    raise ValueError('must be true or false')
+
+
+def parse_value(name, value):
+    """Typed value of ``value`` for the agents column ``name``; raises ``ValueError``."""
+    column = _COLUMNS[name]
+    column_type = column.type
+    if isinstance(column_type, db.Date):
+        return _parse_date(value)
+    if isinstance(column_type, db.Numeric):
+        return _parse_decimal(value, column)
+    if isinstance(column_type, db.Boolean):
+        return _parse_boolean(value)
+    if isinstance(column_type, db.Integer):
+        return _parse_integer(value)
+    if isinstance(column_type, db.JSON):
+        return [item.strip() for item in re.split(r'[;,]', value) if item.strip()]
+    length = getattr(column_type, 'length', None)
+    if length and len(value) > length:
+        raise ValueError(f'must be at most {length} characters')
+    return value
+
+
+def csv_records(stream, encoding='utf-8-sig'):
+    """``(line, header, values)`` for each row of a CSV byte stream."""
+    reader = csv.reader(codecs.iterdecode(stream, encoding))
+    header = next(reader, None)
+    if header is None:
+        return
+    yield 1, header, None
+    for values in reader:
+        if any(value.strip() for value in values):
+            yield reader.line_num, header, values
+
+
+def _column_index(reference):
+    index = 0
+    for char in reference:
+        if not char.isalpha():
+            break
+        index = index * 26 + ord(char.upper()) - 64
+    return index - 1
+
+
+def _shared_strings(archive):
+    if 'xl/sharedStrings.xml' not in archive.namelist():
+        return []
+    strings = []
+    with archive.open('xl/sharedStrings.xml') as handle:
+        for _, element in iterparse(handle):
+            if element.tag == f'{_NS}si':
+                strings.append(''.join(text.text or '' for text in element.iter(f'{_NS}t')))
+                element.clear()
+    return strings
+
+
+def _first_sheet(archive):
+    names = sorted(name for name in archive.namelist()
+                   if name.startswith('xl/worksheets/') and name.endswith('.xml'))
+    if 'xl/worksheets/sheet1.xml' in names:
+        return 'xl/worksheets/sheet1.xml'
+    if not names:
+        raise ValueError('The workbook has no worksheet')
+    return names[0]
+
+
+def xlsx_records(fileobj):
+    """``(line, header, values)`` for each row of the first worksheet of an XLSX file."""
+    try:
+        archive = zipfile.ZipFile(fileobj)
+    except zipfile.BadZipFile as exc:
+        raise ValueError('The file is not a valid XLSX workbook') from exc
+    with archive:
+        strings = _shared_strings(archive)
+        header = None
+        with archive.open(_first_sheet(archive)) as handle:
+            for _, element in iterparse(handle):
+                if element.tag != f'{_NS}row':
+                    continue
+                values = []
+                for cell in element.iter(f'{_NS}c'):
+                    index = _column_index(cell.get('r', '')) if cell.get('r') else len(values)
+                    kind = cell.get('t')
+                    if kind == 'inlineStr':
+                        value = ''.join(text.text or '' for text in cell.iter(f'{_NS}t'))
+                    else:
+                        raw = cell.find(f'{_NS}v')
+                        value = raw.text if raw is not None and raw.text is not None else ''
+                        if kind == 's' and value:
+                            value = strings[int(value)]
+                        elif kind == 'b':
+                            value = 'true' if value == '1' else 'false'
+                        elif not kind and value.endswith('.0'):
+                            value = value[:-2]
+                    values.extend([''] * (index - len(values)))
+                    values.append(value)
+                line = int(element.get('r') or 0)
+                element.clear()
+                if header is None:
+                    header = values
+                    yield line, header, None
+                elif any(value.strip() for value in values):
+                    yield line, header, values
+
+
+def records(fileobj, filename=None):
+    """Pick the reader from the file name, or from the ZIP signature when there is none."""
+    if filename and filename.lower().endswith(('.xlsx', '.xlsm')):
+        return xlsx_records(fileobj)
+    if filename and filename.lower().endswith(('.csv', '.txt')):
+        return csv_records(fileobj)
+    head = fileobj.read(4)
+    fileobj.seek(0)
+    return xlsx_records(fileobj) if head == b'PK\x03\x04' else csv_records(fileobj)
+
+
+def _columns(header):
+    """Map header positions to agent columns; raises ``ValueError`` for missing required columns."""
+    fields = [_field(name) for name in header]
+    missing = [name for name in REQUIRED if name not in fields]
+    if missing:
+        raise ValueError(f"Missing required columns: {', '.join(missing)}")
+    duplicated = sorted({name for name in fields if name in _COLUMNS and fields.count(name) > 1})
+    if duplicated:
+        raise ValueError(f"Duplicated columns: {', '.join(duplicated)}")
+    known = [(position, name) for position, name in enumerate(fields) if name in _COLUMNS]
+    unknown = [header[position] for position, name in enumerate(fields) if name not in _COLUMNS and name]
+    return known, unknown
+
+
+class _Report:
+    def __init__(self, dry_run, skip_invalid):
+        self.dry_run = dry_run
+        self.skip_invalid = skip_invalid
+        self.rows = 0
+        self.valid = 0
+        self.invalid = 0
+        self.inserted = 0
+        self.errors = []
+        self.unknown_columns = []
+
+    def error(self, line, field, message, value=None):
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({'row': line, 'field': field, 'error': message, 'value': value})
+
+    def to_dict(self):
+        return {
+            'dry_run': self.dry_run,
+            'skip_invalid': self.skip_invalid,
+            'rows': self.rows,
+            'valid': self.valid,
+            'invalid': self.invalid,
+            'inserted': self.inserted,
+            'unknown_columns': self.unknown_columns,
+            'errors': self.errors,
+            'errors_truncated': len(self.errors) >= MAX_REPORTED_ERRORS and self.invalid > len(self.errors),
+        }
+
+
+def _existing_values():
+    """Values already stored for each unique column, one query per column."""
+    return {
+        name: set(db.session.scalars(select(_COLUMNS[name]).where(_COLUMNS[name].isnot(None))))
+        for name in UNIQUE
+    }
+
+
+def _validate(chunk, columns, seen, report):
+    """Typed rows of ``chunk`` that passed validation; failures go to ``report``."""
+    valid = []
+    for line, values in chunk:
+        row, row_errors = {}, []
+        for position, name in columns:
+            raw = values[position].strip() if position < len(values) else ''
+            if not raw:
+                continue
+            try:
+                row[name] = parse_value(name, raw)
+            except ValueError as exc:
+                row_errors.append((name, str(exc), raw))
+        for name in REQUIRED:
+            if row.get(name) is None and not any(error[0] == name for error in row_errors):
+                row_errors.append((name, 'is required', None))
+        for name in UNIQUE:
+            value = row.get(name)
+            if value is None:
+                continue
+            if value in seen[name]:
+                first = seen[name][value]
+                message = 'already exists' if first is None else f'duplicates row {first}'
+                row_errors.append((name, message, value))
+
+        if row_errors:
+            report.invalid += 1
+            for name, message, value in row_errors:
+                report.error(line, name, message, value)
+            continue
+        for name in UNIQUE:
+            if row.get(name) is not None:
+                seen[name][row[name]] = line
+        report.valid += 1
+        valid.append(row)
+    return valid
+
+
+def _insert(rows, user_id):
+    now = datetime.utcnow()
+    # Every row carries every column so the INSERT can run as one multi-row statement
+    params = [
+        {
+            **{name: row.get(name, _default(column)) for name, column in _COLUMNS.items()},
+            'created_by': user_id,
+            'created_at': now,
+            'updated_at': now,
+        }
+        for row in rows
+    ]
+    return list(db.session.scalars(insert(Agent).returning(Agent.id), params))
+
+
+def run(rows, dry_run=False, skip_invalid=False, user_id=None, chunk_size=CHUNK_SIZE):
+    """Validate and import ``(line, header, values)`` rows; returns the report as a dict.
+
+    Raises ``ValueError`` for a file without the required columns, and when
+    a concurrent write takes one of the file's unique values.
+    """
+    report = _Report(dry_run, skip_invalid)
+    rows = iter(rows)
+    first = next(rows, None)
+    if first is None:
+        raise ValueError('The file is empty')
+    columns, report.unknown_columns = _columns(first[1])
+
+    seen = {name: dict.fromkeys(values) for name, values in _existing_values().items()}
+    inserted_ids = []
+    chunk = []
+
+    def flush():
+        valid = _validate(chunk, columns, seen, report)
+        chunk.clear()
+        # Once a row failed an all-or-nothing import, the rest is only validated
+        if valid and not dry_run and (skip_invalid or not report.invalid):
+            inserted_ids.extend(_insert(valid, user_id))
+
+    try:
+        for line, _, values in rows:
+            report.rows += 1
+            chunk.append((line, values))
+            if len(chunk) >= chunk_size:
+                flush()
+        flush()
+
+        if dry_run or (report.invalid and not skip_invalid):
+            db.session.rollback()
+            return report.to_dict()
+        search.reindex(Agent, inserted_ids)
+        db.session.commit()
+    except IntegrityError as exc:
+        db.session.rollback()
+        raise ValueError('Agents were added while importing; run the import again') from exc
+    except Exception:
+        db.session.rollback()
+        raise
+    report.inserted = len(inserted_ids)
+    return report.to_dict()
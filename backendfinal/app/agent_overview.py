@@ -0,0 +1,175 @@
+"""Agent profile overview built from a fixed set of queries.
+
+``build(agent)`` runs one query per section: recent shifts, 30-day
+attendance aggregates, latest payrolls, current leaves, trainings and held
+equipment. The cost is the same however long the agent's history is.
+
+Results are cached in process per agent with an ETag. Commits that touch
+the agent, or any row carrying its ``agent_id``, drop the entry. Other
+workers do not see that invalidation, so entries also expire after
+``AGENT_OVERVIEW_CACHE_SECONDS``.
+"""
+import hashlib
+import json
+import threading
+import time
+from datetime import date, timedelta
+
+from sqlalchemy import case, event, func
+from sqlalchemy.orm import joinedload
+
+from app import db
+from app.models import (
+    Agent,
+    AgentTraining,
+    Attendance,
+    Equipment,
+    EquipmentAssignment,
+    Leave,
+    Payroll,
+    Shift,
+    Training,
+    decimal_to_float,
+)
+
+_PENDING_KEY = 'agent_overview_dirty'
+
+_lock = threading.Lock()
+_cache = {}
+_settings = {'ttl': 300}
+
+
+def _attendance_stats(agent_id, since):
+    row = db.session.query(
+        func.count(Attendance.id),
+        func.coalesce(func.sum(Attendance.total_hours), 0),
+        func.coalesce(func.sum(Attendance.overtime_hours), 0),
+        func.sum(case((Attendance.is_late.is_(True), 1), else_=0)),
+        func.coalesce(func.sum(Attendance.late_minutes), 0),
+        func.sum(case((Attendance.attendance_status == 'absent', 1), else_=0)),
+        func.max(Attendance.attendance_date),
+    ).filter(
+        Attendance.agent_id == agent_id,
+        Attendance.attendance_date >= since
+    ).one()
+    days, hours, overtime, late, late_minutes, absent, last = row
+    return {
+        'since': since.isoformat(),
+        'days_recorded': days,
+        'total_hours': decimal_to_float(hours),
+        'overtime_hours': decimal_to_float(overtime),
+        'late_count': late or 0,
+        'late_minutes': late_minutes or 0,
+        'absent_count': absent or 0,
+        'last_attendance_date': last.isoformat() if last else None,
+    }
+
+
+def build(agent, today=None):
+    today = today or date.today()
+
+    shifts = Shift.query.filter(Shift.agent_id == agent.id).order_by(
+        Shift.shift_date.desc(), Shift.scheduled_start_time.desc()
+    ).limit(10).all()
+
+    payrolls = Payroll.query.filter(Payroll.agent_id == agent.id).order_by(
+        Payroll.pay_period_end.desc()
+    ).limit(3).all()
+
+    leaves = Leave.query.filter(
+        Leave.agent_id == agent.id,
+        Leave.end_date >= today,
+        Leave.leave_status.in_(('pending', 'approved'))
+    ).order_by(Leave.start_date).all()
+
+    trainings = AgentTraining.query.filter(AgentTraining.agent_id == agent.id).options(
+        joinedload(AgentTraining.training).load_only(Training.id, Training.training_name)
+    ).order_by(AgentTraining.expiry_date).all()
+
+    equipment = EquipmentAssignment.query.filter(
+        EquipmentAssignment.agent_id == agent.id,
+        EquipmentAssignment.assignment_status == 'active'
+    ).options(
+        joinedload(EquipmentAssignment.equipment).load_only(Equipment.id, Equipment.equipment_name)
+    ).order_by(EquipmentAssignment.assigned_date.desc()).all()
+
+    def training_entry(assignment):
+        data = assignment.to_dict()
+        data.pop('agent')
+        expiry = assignment.expiry_date
+        data['days_to_expiry'] = (expiry - today).days if expiry else None
+        data['expired'] = bool(expiry and expiry < today)
+        return data
+
+    def equipment_entry(assignment):
+        data = assignment.to_dict()
+        data.pop('agent')
+        return data
+
+    return {
+        'agent': agent.to_dict(),
+        'recent_shifts': [shift.to_dict() for shift in shifts],
+        'attendance': _attendance_stats(agent.id, today - timedelta(days=30)),
+        'latest_payrolls': [payroll.to_dict() for payroll in payrolls],
+        'current_leaves': [leave.to_dict() for leave in leaves],
+        'trainings': [training_entry(assignment) for assignment in trainings],
+        'equipment': [equipment_entry(assignment) for assignment in equipment],
+        'generated_on': today.isoformat(),
+    }
+
+
+def get(agent):
+    """Return ``(payload, etag)``, from the cache when still valid."""
+    today = date.today()
+    now = time.monotonic()
+    with _lock:
+        entry = _cache.get(agent.id)
+        if entry and entry[2] > now and entry[3] == today:
+            return entry[0], entry[1]
+
+    payload = build(agent, today)
+    etag = hashlib.sha1(json.dumps(payload, sort_keys=True).encode()).hexdigest()
+    with _lock:
+        _cache[agent.id] = (payload, etag, now + _settings['ttl'], today)
+    return payload, etag
+
+
+def invalidate(*agent_ids):
+    with _lock:
+        if not agent_ids:
+            _cache.clear()
+        for agent_id in agent_ids:
+            _cache.pop(agent_id, None)
+
+
+def _after_flush(session, flush_context):
+    agent_ids = set()
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(obj, Agent):
+            agent_ids.add(obj.id)
+        elif getattr(obj, 'agent_id', None) is not None:
+            agent_ids.add(obj.agent_id)
+            # An assignment moved to another agent stales the previous one too
+            history = db.inspect(obj).attrs.agent_id.history
+            agent_ids.update(value for value in history.deleted if value is not None)
+    if agent_ids:
+        session.info.setdefault(_PENDING_KEY, set()).update(agent_ids)
+
+
+def _after_commit(session):
+    agent_ids = session.info.pop(_PENDING_KEY, None)
+    if agent_ids:
+        invalidate(*agent_ids)
+
+
+def _after_rollback(session):
+    session.info.pop(_PENDING_KEY, None)
+
+
+def init_app(app):
+    _settings['ttl'] = app.config.get('AGENT_OVERVIEW_CACHE_SECONDS', 300)
+    for name, listener in (('after_flush', _after_flush),
+                           ('after_commit', _after_commit),
+                           ('after_rollback', _after_rollback)):
+        if not event.contains(db.session, name, listener):
+            event.listen(db.session, name, listener)
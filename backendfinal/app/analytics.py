@@ -0,0 +1,224 @@
+"""Punctuality analytics over attendances.
+
+Lateness, absence and early departures are rolled up per day, site and
+clock-in hour into ``punctuality_rollups``. Site, weekday, hour and daily
+trend reports then read a few hundred rows per site and quarter instead of
+every attendance. Per-agent reports aggregate ``attendances`` directly over
+the ``(agent_id, attendance_date)`` index.
+
+Every flush that adds, changes or deletes an attendance also records its
+day and site in ``punctuality_dirty_days``, in the same transaction.
+``refresh`` recomputes just those cells with one INSERT .. SELECT per batch
+of days and runs before each report. It locks the dirty rows it works on
+with SELECT .. FOR UPDATE, so refreshes in other processes wait rather than
+write the same cells twice. ``rebuild`` marks every cell dirty and refreshes;
+it is needed once for existing data. Bulk SQL writes to ``attendances``
+bypass the flush hook and need a rebuild.
+"""
+from datetime import date
+
+from sqlalchemy import case, event, extract, func, insert, select, union
+
+from app import db
+from app.models import Agent, Attendance, PunctualityDirtyDay, PunctualityRollup, Shift, Site
+
+GROUPINGS = ('site', 'agent', 'weekday', 'hour', 'day')
+COLUMNS = ['key', 'label', 'attendances', 'absent', 'late', 'late_rate', 'avg_late_minutes',
+           'early_departures', 'early_departure_rate', 'avg_early_departure_minutes']
+WEEKDAYS = ('Sunday', 'Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday')
+
+_REFRESH_DAYS = 100
+
+
+def _raw_measures():
+    """Aggregates over ``attendances`` in the order of the rollup's measure columns."""
+    return (
+        func.count(Attendance.id),
+        func.coalesce(func.sum(case((Attendance.attendance_status == 'absent', 1), else_=0)), 0),
+        func.coalesce(func.sum(case((Attendance.is_late.is_(True), 1), else_=0)), 0),
+        func.coalesce(func.sum(case((Attendance.is_late.is_(True), Attendance.late_minutes), else_=0)), 0),
+        func.coalesce(func.sum(case((Attendance.early_departure.is_(True), 1), else_=0)), 0),
+        func.coalesce(func.sum(case((Attendance.early_departure.is_(True),
+                                     Attendance.early_departure_minutes), else_=0)), 0),
+    )
+
+
+def _rollup_measures():
+    return tuple(func.coalesce(func.sum(column), 0) for column in (
+        PunctualityRollup.attendances, PunctualityRollup.absent_count, PunctualityRollup.late_count,
+        PunctualityRollup.late_minutes, PunctualityRollup.early_departure_count,
+        PunctualityRollup.early_departure_minutes,
+    ))
+
+
+def _rollup_select(dates=None, site_ids=None):
+    hour = func.coalesce(extract('hour', Attendance.clock_in_time), extract('hour', Shift.scheduled_start_time))
+    weekday = extract('dow', Attendance.attendance_date)
+    query = select(Attendance.attendance_date, Attendance.site_id, weekday, hour, *_raw_measures()).outerjoin(
+        Shift, Shift.id == Attendance.shift_id
+    )
+    if dates is not None:
+        query = query.where(Attendance.attendance_date.in_(dates), Attendance.site_id.in_(site_ids))
+    return query.group_by(Attendance.attendance_date, Attendance.site_id, weekday, hour)
+
+
+def _store(dates=None, site_ids=None):
+    delete = db.delete(PunctualityRollup)
+    if dates is not None:
+        delete = delete.where(PunctualityRollup.attendance_date.in_(dates), PunctualityRollup.site_id.in_(site_ids))
+    db.session.execute(delete)
+    db.session.execute(insert(PunctualityRollup).from_select([
+        'attendance_date', 'site_id', 'weekday', 'hour', 'attendances', 'absent_count', 'late_count',
+        'late_minutes', 'early_departure_count', 'early_departure_minutes',
+    ], _rollup_select(dates, site_ids)))
+
+
+def refresh():
+    """Recompute the rollup cells of attendances changed since the last refresh."""
+    # FOR UPDATE cannot be combined with DISTINCT, so duplicates are dropped here
+    dirty = db.session.execute(
+        select(PunctualityDirtyDay.id, PunctualityDirtyDay.attendance_date, PunctualityDirtyDay.site_id)
+        .order_by(PunctualityDirtyDay.id).with_for_update()
+    ).all()
+    if not dirty:
+        db.session.commit()
+        return 0
+    last_id = dirty[-1].id
+
+    by_date = {}
+    for _, attendance_date, site_id in dirty:
+        by_date.setdefault(attendance_date, set()).add(site_id)
+    dates = sorted(by_date)
+    # Cells are recomputed per batch of days for the union of their sites; extra cells are harmless
+    for index in range(0, len(dates), _REFRESH_DAYS):
+        batch = dates[index:index + _REFRESH_DAYS]
+        _store(batch, sorted(set().union(*(by_date[day] for day in batch))))
+
+    db.session.execute(db.delete(PunctualityDirtyDay).where(PunctualityDirtyDay.id <= last_id))
+    db.session.commit()
+    return sum(len(sites) for sites in by_date.values())
+
+
+def rebuild():
+    # Cells that still have attendances, and rollup cells whose attendances are gone
+    cells = union(
+        select(Attendance.attendance_date, Attendance.site_id).where(
+            Attendance.attendance_date.isnot(None), Attendance.site_id.isnot(None)
+        ),
+        select(PunctualityRollup.attendance_date, PunctualityRollup.site_id)
+    )
+    db.session.execute(insert(PunctualityDirtyDay).from_select(['attendance_date', 'site_id'], cells))
+    db.session.commit()
+    refresh()
+    return db.session.query(func.count(PunctualityRollup.id)).scalar()
+
+
+def _row(key, label, attendances, absent, late, late_minutes, early, early_minutes):
+    present = attendances - absent
+    return [
+        key, label, attendances, absent, late,
+        round(late / present, 4) if present else 0.0,
+        round(late_minutes / late, 1) if late else 0.0,
+        early,
+        round(early / present, 4) if present else 0.0,
+        round(early_minutes / early, 1) if early else 0.0,
+    ]
+
+
+def punctuality(start, end, group_by='site', site_id=None, agent_id=None, limit=None):
+    """Compact table of punctuality measures per group between ``start`` and ``end``.
+
+    Sites and agents are ordered worst first (highest late rate); weekdays,
+    hours and days in their natural order.
+    """
+    refresh()
+
+    if group_by == 'agent' or agent_id:
+        source, date_column, site_column = Attendance, Attendance.attendance_date, Attendance.site_id
+        measures = _raw_measures()
+    else:
+        source, date_column, site_column = PunctualityRollup, PunctualityRollup.attendance_date, \
+            PunctualityRollup.site_id
+        measures = _rollup_measures()
+
+    keys = {
+        'site': (site_column, Site.site_name),
+        'agent': (Attendance.agent_id, Agent.employee_code, Agent.first_name, Agent.last_name),
+        'weekday': (PunctualityRollup.weekday if source is PunctualityRollup
+                    else extract('dow', Attendance.attendance_date),),
+        'hour': (PunctualityRollup.hour,),
+        'day': (date_column,),
+    }[group_by]
+    if group_by == 'hour' and source is Attendance:
+        keys = (func.coalesce(extract('hour', Attendance.clock_in_time),
+                              extract('hour', Shift.scheduled_start_time)),)
+
+    query = db.session.query(*keys, *measures).select_from(source).filter(date_column >= start, date_column <= end)
+    if group_by == 'site':
+        query = query.join(Site, Site.id == site_column)
+    elif group_by == 'agent':
+        query = query.join(Agent, Agent.id == Attendance.agent_id)
+    elif group_by == 'hour' and source is Attendance:
+        query = query.outerjoin(Shift, Shift.id == Attendance.shift_id)
+    if site_id:
+        query = query.filter(site_column == site_id)
+    if agent_id:
+        query = query.filter(Attendance.agent_id == agent_id)
+    results = query.group_by(*keys).all()
+
+    rows = []
+    totals = [0] * 6
+    for result in results:
+        key_values, values = result[:len(keys)], [int(value or 0) for value in result[len(keys):]]
+        totals = [total + value for total, value in zip(totals, values)]
+        if group_by == 'site':
+            key, label = key_values
+        elif group_by == 'agent':
+            key, label = key_values[0], f'{key_values[2]} {key_values[3]} ({key_values[1]})'
+        elif group_by == 'weekday':
+            key = int(key_values[0])
+            label = WEEKDAYS[key]
+        elif group_by == 'hour':
+            key = int(key_values[0]) if key_values[0] is not None else None
+            label = f'{key:02d}:00' if key is not None else 'unknown'
+        else:
+            key = key_values[0].isoformat() if isinstance(key_values[0], date) else key_values[0]
+            label = key
+        rows.append(_row(key, label, *values))
+
+    if group_by in ('site', 'agent'):
+        rows.sort(key=lambda row: (row[5], row[6]), reverse=True)
+        if limit:
+            rows = rows[:limit]
+    else:
+        rows.sort(key=lambda row: (row[0] is None, row[0] if row[0] is not None else 0))
+
+    return {
+        'start_date': start.isoformat(),
+        'end_date': end.isoformat(),
+        'group_by': group_by,
+        'columns': COLUMNS,
+        'rows': rows,
+        'totals': dict(zip(COLUMNS[2:], _row(None, None, *totals)[2:])),
+    }
+
+
+def _before_flush(session, flush_context, instances):
+    cells = set()
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if not isinstance(obj, Attendance) or (obj in session.dirty and not session.is_modified(obj)):
+            continue
+        state = db.inspect(obj)
+        cells.add((obj.attendance_date, obj.site_id))
+        # A row moved to another day or site also changes the cell it left
+        dates = state.attrs.attendance_date.history.deleted or [obj.attendance_date]
+        sites = state.attrs.site_id.history.deleted or [obj.site_id]
+        cells.update((old_date, old_site) for old_date in dates for old_site in sites)
+    for attendance_date, site_id in cells:
+        if attendance_date is not None and site_id is not None:
+            session.add(PunctualityDirtyDay(attendance_date=attendance_date, site_id=site_id))
+
+
+def init_app(app):
+    if not event.contains(db.session, 'before_flush', _before_flush):
+        event.listen(db.session, 'before_flush', _before_flush)
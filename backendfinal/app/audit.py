@@ -0,0 +1,252 @@
+"""Asynchronous, batched audit trail for selected models.
+
+Column-level diffs are captured in ``after_flush`` while attribute history
+is still available, parked on the session until the transaction commits
+and then handed to an in-memory queue. A background writer drains the
+queue into the append-only ``audit_log`` table in batches, on its own
+connection, so requests never wait on audit INSERTs. Rolled back work is
+discarded without ever reaching the queue.
+"""
+import atexit
+import queue
+import threading
+import time
+from datetime import date, datetime, time as dt_time
+from decimal import Decimal
+
+from flask import has_request_context, request
+from sqlalchemy import event
+
+from app import db
+from app.models import AuditLog
+
+_PENDING_KEY = 'audit_pending'
+
+_stats_lock = threading.Lock()
+_stats = {
+    'captured': 0,
+    'written': 0,
+    'batches': 0,
+    'dropped': 0,
+    'capture_seconds': 0.0,
+    'write_seconds': 0.0,
+}
+
+_writer = None
+_audited_tables = set()
+
+
+def _bump(**values):
+    with _stats_lock:
+        for key, value in values.items():
+            _stats[key] += value
+
+
+def _jsonable(value):
+    if isinstance(value, Decimal):
+        return str(value)
+    if isinstance(value, (datetime, date, dt_time)):
+        return value.isoformat()
+    return value
+
+
+def _actor():
+    """Best-effort (user_id, endpoint) of the request that caused the change."""
+    if not has_request_context():
+        return None, None
+    user_id = None
+    try:
+        from flask_jwt_extended import get_jwt_identity
+        user_id = get_jwt_identity()
+    except Exception:
+        user_id = None
+    return user_id, f'{request.method} {request.path}'
+
+
+def _columns(obj):
+    return db.inspect(obj).mapper.column_attrs
+
+
+def _diff(obj):
+    state = db.inspect(obj)
+    changes = {}
+    for attr in _columns(obj):
+        history = state.attrs[attr.key].history
+        if not history.has_changes():
+            continue
+        old = history.deleted[0] if history.deleted else None
+        new = history.added[0] if history.added else None
+        if old != new:
+            changes[attr.key] = [_jsonable(old), _jsonable(new)]
+    return changes
+
+
+def _snapshot(obj):
+    return {
+        attr.key: [None, _jsonable(getattr(obj, attr.key))]
+        for attr in _columns(obj)
+        if getattr(obj, attr.key) is not None
+    }
+
+
+def _after_flush(session, flush_context):
+    if not _audited_tables:
+        return
+    started = time.perf_counter()
+    user_id, endpoint = _actor()
+    now = datetime.utcnow()
+    entries = []
+
+    def add(obj, action, changes):
+        entries.append({
+            'entity_type': obj.__tablename__,
+            'entity_id': obj.id,
+            'action': action,
+            'changes': changes,
+            'user_id': user_id,
+            'endpoint': endpoint,
+            'created_at': now,
+        })
+
+    for obj in session.new:
+        if getattr(obj, '__tablename__', None) in _audited_tables:
+            add(obj, 'insert', _snapshot(obj))
+    for obj in session.dirty:
+        if getattr(obj, '__tablename__', None) in _audited_tables:
+            changes = _diff(obj)
+            if changes:
+                add(obj, 'update', changes)
+    for obj in session.deleted:
+        if getattr(obj, '__tablename__', None) in _audited_tables:
+            add(obj, 'delete', {})
+
+    if entries:
+        session.info.setdefault(_PENDING_KEY, []).extend(entries)
+    _bump(capture_seconds=time.perf_counter() - started)
+
+
+def is_audited(table_name):
+    return table_name in _audited_tables
+
+
+def record_updates(session, table_name, changes_by_id):
+    """Park ``{id: {column: [old, new]}}`` written with bulk SQL, which ``after_flush`` never sees."""
+    user_id, endpoint = _actor()
+    now = datetime.utcnow()
+    entries = [{
+        'entity_type': table_name,
+        'entity_id': entity_id,
+        'action': 'update',
+        'changes': {key: [_jsonable(old), _jsonable(new)] for key, (old, new) in changes.items()},
+        'user_id': user_id,
+        'endpoint': endpoint,
+        'created_at': now,
+    } for entity_id, changes in changes_by_id.items() if changes]
+    if entries:
+        session.info.setdefault(_PENDING_KEY, []).extend(entries)
+
+
+def _after_commit(session):
+    entries = session.info.pop(_PENDING_KEY, None)
+    if entries and _writer is not None:
+        _writer.enqueue(entries)
+
+
+def _after_rollback(session):
+    session.info.pop(_PENDING_KEY, None)
+
+
+class AuditWriter:
+    """Background thread that writes queued audit entries in batches."""
+
+    def __init__(self, app, batch_size=200, interval=1.0, max_queue=50000):
+        self.app = app
+        self.batch_size = batch_size
+        self.interval = interval
+        self.queue = queue.Queue(maxsize=max_queue)
+        self._thread = threading.Thread(target=self._run, name='audit-writer', daemon=True)
+        self._thread.start()
+
+    def enqueue(self, entries):
+        for entry in entries:
+            try:
+                self.queue.put_nowait(entry)
+            except queue.Full:
+                _bump(dropped=1)
+                self.app.logger.error('Audit queue full, dropping entry for %s %s',
+                                      entry['entity_type'], entry['entity_id'])
+                continue
+            _bump(captured=1)
+
+    def _drain(self, first=None):
+        batch = [first] if first is not None else []
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _write(self, batch):
+        if not batch:
+            return
+        started = time.perf_counter()
+        try:
+            with self.app.app_context():
+                with db.engine.begin() as connection:
+                    connection.execute(AuditLog.__table__.insert(), batch)
+        except Exception:  # pragma: no cover - never let the writer die
+            self.app.logger.exception('Failed to write %s audit entries', len(batch))
+            _bump(dropped=len(batch))
+            return
+        _bump(written=len(batch), batches=1, write_seconds=time.perf_counter() - started)
+
+    def _run(self):
+        while True:
+            try:
+                first = self.queue.get(timeout=self.interval)
+            except queue.Empty:
+                continue
+            self._write(self._drain(first))
+
+    def flush(self):
+        """Synchronously write everything queued so far."""
+        while not self.queue.empty():
+            self._write(self._drain())
+
+
+def get_stats():
+    with _stats_lock:
+        stats = dict(_stats)
+    captured = stats['captured'] or 1
+    stats['queued'] = _writer.queue.qsize() if _writer else 0
+    stats['avg_capture_ms'] = round(stats.pop('capture_seconds') * 1000 / captured, 4)
+    stats['avg_batch_write_ms'] = round(stats.pop('write_seconds') * 1000 / (stats['batches'] or 1), 4)
+    stats['audited_tables'] = sorted(_audited_tables)
+    return stats
+
+
+def flush():
+    if _writer is not None:
+        _writer.flush()
+
+
+def init_app(app):
+    global _writer
+    _audited_tables.clear()
+    _audited_tables.update(app.config.get('AUDITED_TABLES', ()))
+    if _writer is None:
+        _writer = AuditWriter(
+            app,
+            batch_size=app.config.get('AUDIT_BATCH_SIZE', 200),
+            interval=app.config.get('AUDIT_FLUSH_INTERVAL_SECONDS', 1.0)
+        )
+        atexit.register(flush)
+    else:
+        _writer.app = app
+
+    for name, listener in (('after_flush', _after_flush),
+                           ('after_commit', _after_commit),
+                           ('after_rollback', _after_rollback)):
+        if not event.contains(db.session, name, listener):
+            event.listen(db.session, name, listener)
@@ -0,0 +1,134 @@
+"""Draft invoices generated on each client's billing day.
+
+A client billed monthly with ``billing_day`` N gets a draft invoice on day
+N of each month, or on the last day of shorter months. The invoice covers
+the period since the previous billing day, with one line per site: the
+hours worked there (from attendances) at the site's ``billing_rate``.
+Sites without a billing rate are skipped.
+
+Invoice numbers are derived from the client and the billing date, so
+running the same day again creates nothing new. Clients billed at other
+frequencies are still invoiced by hand.
+"""
+import calendar
+import re
+from collections import defaultdict
+from datetime import timedelta
+
+from flask import current_app
+from sqlalchemy import func, or_
+
+from app import db
+from app.models import Attendance, Client, Invoice, InvoiceLineItem, Site, to_money
+
+DEFAULT_TERMS_DAYS = 30
+
+
+def invoice_number(client_id, day):
+    return f'AUTO-{client_id}-{day:%Y%m%d}'
+
+
+def _billing_day(year, month, billing_day):
+    """Day of the month billed on; the month's last day when ``billing_day`` does not exist in it."""
+    return min(billing_day, calendar.monthrange(year, month)[1])
+
+
+def period(day, billing_day):
+    """``(start, end)`` of the period billed on ``day``: from the previous billing date to yesterday."""
+    year, month = (day.year, day.month - 1) if day.month > 1 else (day.year - 1, 12)
+    start = day.replace(year=year, month=month, day=_billing_day(year, month, billing_day))
+    return start, day - timedelta(days=1)
+
+
+def _terms_days(payment_terms):
+    match = re.search(r'\d+', payment_terms or '')
+    return int(match.group()) if match else DEFAULT_TERMS_DAYS
+
+
+def clients_due(day):
+    """Active monthly clients whose billing date is ``day``."""
+    last_day = calendar.monthrange(day.year, day.month)[1]
+    matches = Client.billing_day == day.day
+    if day.day == last_day:
+        matches = or_(matches, Client.billing_day > last_day)
+    return Client.query.filter(
+        Client.is_active.is_(True),
+        Client.contract_status == 'active',
+        Client.billing_frequency == 'monthly',
+        Client.billing_day.isnot(None),
+        matches
+    ).order_by(Client.id).all()
+
+
+def generate(day):
+    """Create the draft invoices due on ``day``; returns the new invoice numbers."""
+    clients = clients_due(day)
+    existing = {number for (number,) in db.session.query(Invoice.invoice_number).filter(
+        Invoice.invoice_number.in_([invoice_number(client.id, day) for client in clients])
+    )}
+    clients = [client for client in clients if invoice_number(client.id, day) not in existing]
+
+    by_period = defaultdict(list)
+    for client in clients:
+        by_period[period(day, client.billing_day)].append(client)
+
+    created = []
+    for (start, end), group in by_period.items():
+        # One grouped query per billing period, usually a single one per day
+        hours = db.session.query(
+            Site.client_id, Site.id, Site.site_name, Site.billing_rate, func.sum(Attendance.total_hours)
+        ).join(Attendance, Attendance.site_id == Site.id).filter(
+            Site.client_id.in_([client.id for client in group]),
+            Attendance.attendance_date >= start,
+            Attendance.attendance_date <= end
+        ).group_by(Site.client_id, Site.id, Site.site_name, Site.billing_rate).order_by(Site.id).all()
+
+        lines = defaultdict(list)
+        for client_id, site_id, site_name, rate, total_hours in hours:
+            if rate is None:
+                current_app.logger.warning('Site %s has no billing rate, left off the billing run', site_id)
+                continue
+            if not total_hours:
+                continue
+            quantity = to_money(total_hours)
+            lines[client_id].append(InvoiceLineItem(
+                site_id=site_id,
+                description=f'{site_name}: security services {start.isoformat()} to {end.isoformat()}',
+                quantity=quantity,
+                unit_price=rate,
+                line_total=to_money(quantity * to_money(rate))
+            ))
+
+        for client in group:
+            if not lines[client.id]:
+                continue
+            invoice = Invoice(
+                client_id=client.id,
+                invoice_number=invoice_number(client.id, day),
+                invoice_date=day,
+                due_date=day + timedelta(days=_terms_days(client.payment_terms)),
+                billing_period_start=start,
+                billing_period_end=end,
+                tax_rate=0,
+                discount_percentage=client.discount_percentage or 0,
+                payment_terms=client.payment_terms,
+                notes='Generated on billing day',
+                invoice_status='draft'
+            )
+            invoice.line_items = lines[client.id]
+            invoice.calculate_totals(lines[client.id])
+            db.session.add(invoice)
+            created.append(invoice.invoice_number)
+
+    db.session.commit()
+    return created
+
+
+def run(since, until):
+    """Generate invoices for every billing date in ``(since, until]``; returns the new numbers."""
+    created = []
+    day = since + timedelta(days=1)
+    while day <= until:
+        created.extend(generate(day))
+        day += timedelta(days=1)
+    return created
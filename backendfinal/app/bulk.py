@@ -0,0 +1,261 @@
+"""Set-based bulk updates of agents, sites and shifts.
+
+A request picks its rows by ``ids``, by a ``filter`` of column values, or
+by both, and gives a ``patch`` of new values. The patch is checked against
+the columns each model allows and their types. It is then applied with a
+single ``UPDATE ... WHERE`` that also sets ``updated_at``. Numeric columns
+also accept ``{"add": n}`` or ``{"multiply": n}``, so a rate increase for
+thousands of agents is still one statement.
+
+Bulk SQL skips the session flush hooks, so their side effects are
+applied here. Search documents are rewritten when an indexed column
+changes, and cached agent overviews are dropped. Audited tables get one
+entry per changed row, which costs one SELECT of the previous values.
+"""
+from datetime import datetime, time
+from decimal import Decimal, InvalidOperation
+
+from sqlalchemy import func, select, update
+from sqlalchemy.exc import DataError, IntegrityError
+
+from app import agent_overview, audit, db, search
+from app.models import Agent, Shift, Site
+
+MAX_IDS = 10000
+
+SPECS = {
+    Agent: {
+        # Unique columns are left out: one value cannot be set on many rows
+        'fields': (
+            'first_name', 'last_name', 'gender', 'phone_primary', 'phone_secondary', 'email', 'address',
+            'city', 'postal_code', 'emergency_contact_name', 'emergency_contact_phone',
+            'emergency_contact_relationship', 'hire_date', 'contract_type', 'contract_end_date',
+            'employment_status', 'termination_date', 'termination_reason', 'hourly_rate', 'bank_name',
+            'tax_id', 'uniform_size', 'security_clearance_level', 'has_firearm_license',
+            'firearm_license_expiry', 'blood_type', 'has_drivers_license', 'languages_spoken',
+            'medical_conditions', 'training_level', 'notes', 'is_active',
+        ),
+        'filters': (
+            'employment_status', 'is_active', 'contract_type', 'city', 'training_level',
+            'security_clearance_level', 'has_firearm_license', 'has_drivers_license',
+        ),
+    },
+    Site: {
+        'fields': (
+            'site_name', 'site_type', 'address', 'city', 'postal_code', 'geofence_radius_meters',
+            'site_contact_name', 'site_contact_phone', 'site_contact_email', 'required_agents',
+            'shift_pattern', 'access_instructions', 'emergency_procedures', 'special_equipment_required',
+            'requires_armed_guard', 'requires_dog_unit', 'requires_vehicle', 'minimum_clearance_level',
+            'hourly_rate_override', 'billing_rate', 'contract_start_date', 'contract_end_date',
+            'site_status', 'patrol_checkpoints', 'restricted_areas', 'key_holder_contacts', 'notes',
+        ),
+        'filters': ('client_id', 'site_status', 'site_type', 'city', 'requires_armed_guard'),
+    },
+    Shift: {
+        'fields': (
+            'agent_id', 'site_id', 'shift_date', 'shift_type', 'scheduled_start_time',
+            'scheduled_end_time', 'scheduled_hours', 'shift_status', 'special_instructions',
+            'required_equipment',
+        ),
+        'filters': ('agent_id', 'site_id', 'shift_date', 'shift_type', 'shift_status'),
+        # Same range parameters as GET /api/shifts
+        'date_range': 'shift_date',
+    },
+}
+
+_RELATIVE = ('add', 'multiply')
+
+
+def _number(value, name):
+    if isinstance(value, bool) or not isinstance(value, (int, float, str)):
+        raise ValueError(f'{name} must be a number')
+    try:
+        number = Decimal(str(value).strip())
+    except InvalidOperation as exc:
+        raise ValueError(f'{name} must be a number') from exc
+    if not number.is_finite():
+        raise ValueError(f'{name} must be a number')
+    return number
+
+
+def _coerce(column, value):
+    """Typed value of JSON ``value`` for ``column``; raises ``ValueError``."""
+    name = column.name
+    if value is None:
+        if not column.nullable:
+            raise ValueError(f'{name} cannot be null')
+        return None
+    column_type = column.type
+    if isinstance(column_type, db.Boolean):
+        if not isinstance(value, bool):
+            raise ValueError(f'{name} must be true or false')
+        return value
+    if isinstance(column_type, (db.Date, db.Time)):
+        if not isinstance(value, str):
+            raise ValueError(f'{name} must be an ISO string')
+        try:
+            if isinstance(column_type, db.Date):
+                return datetime.fromisoformat(value).date()
+            return time.fromisoformat(value)
+        except ValueError as exc:
+            raise ValueError(f'Invalid format for {name}, expected an ISO string') from exc
+    if isinstance(column_type, db.Numeric):
+        number = _number(value, name)
+        precision, scale = column_type.precision, column_type.scale or 0
+        if precision and abs(number) >= Decimal(10) ** (precision - scale):
+            raise ValueError(f'{name} must be less than {10 ** (precision - scale)}')
+        return number.quantize(Decimal(1).scaleb(-scale))
+    if isinstance(column_type, db.Integer):
+        number = _number(value, name)
+        if number != number.to_integral_value():
+            raise ValueError(f'{name} must be a whole number')
+        return int(number)
+    if isinstance(column_type, db.JSON):
+        return value
+    if not isinstance(value, str):
+        raise ValueError(f'{name} must be a string')
+    length = getattr(column_type, 'length', None)
+    if length and len(value) > length:
+        raise ValueError(f'{name} must be at most {length} characters')
+    return value
+
+
+def _relative(model, column, change):
+    """SQL expression for ``{"add": n}`` or ``{"multiply": n}`` on a numeric column."""
+    name = column.name
+    if column.foreign_keys or not isinstance(column.type, (db.Numeric, db.Integer)):
+        raise ValueError(f'{name} only takes a value')
+    if len(change) != 1 or next(iter(change)) not in _RELATIVE:
+        raise ValueError(f'{name} takes one of {", ".join(_RELATIVE)}')
+    operation, value = next(iter(change.items()))
+    number = _number(value, name)
+    attribute = getattr(model, name)
+    if isinstance(column.type, db.Integer):
+        if operation != 'add' or number != number.to_integral_value():
+            raise ValueError(f'{name} only takes a whole number to add')
+        return attribute + int(number)
+    if operation == 'multiply' and number < 0:
+        raise ValueError(f'{name} cannot be multiplied by a negative number')
+    result = attribute + number if operation == 'add' else attribute * number
+    return func.round(result, column.type.scale or 0)
+
+
+def _check_references(model, values):
+    """One lookup per foreign key in the patch, rather than one per row updated."""
+    for name, value in values.items():
+        for key in model.__table__.c[name].foreign_keys:
+            if value is not None and db.session.scalar(select(key.column).where(key.column == value)) is None:
+                raise ValueError(f'{name} {value} does not exist')
+
+
+def patch_values(model, patch):
+    """Validated ``{column: value or expression}`` for ``patch``; raises ``ValueError``."""
+    spec = SPECS[model]
+    if not isinstance(patch, dict) or not patch:
+        raise ValueError('patch must be a non-empty object')
+    values = {}
+    for name, value in patch.items():
+        if name not in spec['fields']:
+            raise ValueError(f'{name} cannot be bulk updated')
+        column = model.__table__.c[name]
+        if isinstance(value, dict) and not isinstance(column.type, db.JSON):
+            values[name] = _relative(model, column, value)
+        else:
+            values[name] = _coerce(column, value)
+    _check_references(model, values)
+    return values
+
+
+def conditions(model, ids=None, filters=None):
+    """WHERE clauses selecting ``ids`` and rows matching ``filters``; raises ``ValueError``."""
+    spec = SPECS[model]
+    clauses = []
+    if ids is not None:
+        if not isinstance(ids, list) or not ids:
+            raise ValueError('ids must be a non-empty list')
+        if len(ids) > MAX_IDS:
+            raise ValueError(f'At most {MAX_IDS} ids per request; use a filter for more')
+        if any(isinstance(item, bool) or not isinstance(item, int) for item in ids):
+            raise ValueError('ids must be integers')
+        clauses.append(model.id.in_(ids))
+
+    if filters is not None:
+        if not isinstance(filters, dict) or not filters:
+            raise ValueError('filter must be a non-empty object')
+        range_column = spec.get('date_range')
+        for name, value in filters.items():
+            if range_column and name in ('start_date', 'end_date'):
+                bound = _coerce(model.__table__.c[range_column], value)
+                attribute = getattr(model, range_column)
+                clauses.append(attribute >= bound if name == 'start_date' else attribute <= bound)
+                continue
+            if name not in spec['filters']:
+                raise ValueError(f'Cannot filter {model.__tablename__} on {name}')
+            column, attribute = model.__table__.c[name], getattr(model, name)
+            if isinstance(value, list):
+                if not value:
+                    raise ValueError(f'filter {name} must not be an empty list')
+                clauses.append(attribute.in_([_coerce(column, item) for item in value]))
+            elif value is None:
+                clauses.append(attribute.is_(None))
+            else:
+                clauses.append(attribute == _coerce(column, value))
+
+    if not clauses:
+        raise ValueError('Either ids or filter is required')
+    return clauses
+
+
+def run(model, patch, ids=None, filters=None):
+    """Apply ``patch`` to the matching rows in one UPDATE and commit; returns the updated ids.
+
+    Raises ``ValueError`` for an invalid request or one the database rejects.
+    """
+    values = patch_values(model, patch)
+    where = conditions(model, ids, filters)
+    names = list(values)
+    table_name = model.__tablename__
+    session = db.session
+
+    try:
+        before = {}
+        if audit.is_audited(table_name):
+            rows = session.execute(
+                select(model.id, *[getattr(model, name) for name in names]).where(*where).with_for_update()
+            )
+            before = {row[0]: row[1:] for row in rows}
+
+        returning = [model.id] + [getattr(model, name) for name in names]
+        if model is Shift and 'agent_id' not in names:
+            returning.append(Shift.agent_id)
+        statement = update(model).where(*where).values(
+            **values, updated_at=datetime.utcnow()
+        ).returning(*returning).execution_options(synchronize_session='fetch')
+        rows = session.execute(statement).all()
+    except (DataError, IntegrityError) as exc:
+        session.rollback()
+        raise ValueError(f'The database rejected the update: {exc.orig}') from exc
+
+    updated_ids = [row[0] for row in rows]
+    if updated_ids and set(names) & search.indexed_fields(model):
+        search.reindex(model, updated_ids)
+    if before:
+        audit.record_updates(session, table_name, {
+            row[0]: {
+                name: (old, new)
+                for name, old, new in zip(names, before.get(row[0], (None,) * len(names)), row[1:])
+                if old != new
+            }
+            for row in rows
+        })
+    session.commit()
+
+    if model is Agent:
+        agent_overview.invalidate(*updated_ids)
+    elif model is Shift and updated_ids:
+        if 'agent_id' in names:
+            # The agents the shifts moved away from are unknown here
+            agent_overview.invalidate()
+        else:
+            agent_overview.invalidate(*{row[-1] for row in rows})
+    return updated_ids
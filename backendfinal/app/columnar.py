@@ -0,0 +1,216 @@
+"""Typed Parquet and Arrow exports of operational tables for BI tools.
+
+Tables are read with ``yield_per`` and converted batch by batch into Arrow
+record batches whose schema follows the column types. Numerics become
+``decimal128(p, s)`` (or float64 on request), dates ``date32``, datetimes
+``timestamp[us]`` and times ``time64[us]``. A year of attendances then
+loads straight into pandas or DuckDB with the right dtypes.
+
+Exports are incremental on ``updated_at``. The watermark is the latest
+``updated_at`` older than ``EXPORT_WATERMARK_LAG_SECONDS``. Only rows
+changed after the previous watermark, up to that one, are exported.
+``updated_at`` is set at flush time, not at commit, so the lag leaves
+time for slow transactions to commit before their rows are passed by.
+``export_directory`` keeps watermarks in ``_manifest.json`` next to the
+files and writes each run as new ``part-*.parquet`` files,
+optionally partitioned by month or day of the dataset's date column.
+A row updated twice therefore appears in two parts; readers keep the copy
+with the latest ``updated_at`` per ``id``. Deleted rows are not tracked.
+
+pyarrow is optional; without it ``available()`` is False.
+"""
+import json
+import os
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import func, select
+
+from app import db
+from app.exports import DATASETS
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # pragma: no cover - pyarrow is optional
+    pa = None
+    pq = None
+
+BATCH_SIZE = 10000
+MANIFEST = '_manifest.json'
+PARTITIONS = {'month': '%Y-%m', 'day': '%Y-%m-%d'}
+DEFAULT_WATERMARK_LAG_SECONDS = 300
+
+
+def available():
+    return pa is not None
+
+
+def _arrow_type(column, decimals):
+    sql_type = column.type
+    if isinstance(sql_type, db.Boolean):
+        return pa.bool_()
+    if isinstance(sql_type, db.Integer):
+        return pa.int64()
+    if isinstance(sql_type, db.Numeric):
+        if decimals == 'float' or sql_type.precision is None:
+            return pa.float64()
+        return pa.decimal128(sql_type.precision, sql_type.scale or 0)
+    if isinstance(sql_type, db.DateTime):
+        return pa.timestamp('us')
+    if isinstance(sql_type, db.Date):
+        return pa.date32()
+    if isinstance(sql_type, db.Time):
+        return pa.time64('us')
+    return pa.string()
+
+
+def schema(name, decimals='decimal'):
+    model = DATASETS[name][0]
+    return pa.schema([pa.field(column.name, _arrow_type(column, decimals), nullable=column.nullable)
+                      for column in model.__table__.columns])
+
+
+def query(name, since=None, until=None, start=None, end=None):
+    """Rows of table ``name`` changed in ``(since, until]``, in ``(date, id)`` order."""
+    model, date_column = DATASETS[name][:2]
+    statement = select(*model.__table__.columns)
+    if since is not None:
+        statement = statement.where(model.updated_at > since)
+    if until is not None:
+        statement = statement.where(model.updated_at <= until)
+    if start is not None:
+        statement = statement.where(date_column >= start)
+    if end is not None:
+        statement = statement.where(date_column <= end)
+    return statement.order_by(date_column, model.id).execution_options(yield_per=BATCH_SIZE)
+
+
+def watermark(name, since=None):
+    """Latest ``updated_at`` older than the lag, or ``since`` when nothing changed after it.
+
+    Taken before reading so rows committed during an export land in the next one.
+    A row flushed before this read but committed after it carries an older
+    ``updated_at``; the lag keeps the watermark behind it.
+    """
+    model = DATASETS[name][0]
+    lag = current_app.config.get('EXPORT_WATERMARK_LAG_SECONDS', DEFAULT_WATERMARK_LAG_SECONDS)
+    cutoff = datetime.utcnow() - timedelta(seconds=lag)
+    latest = db.session.query(func.max(model.updated_at)).filter(model.updated_at <= cutoff).scalar()
+    if latest is None or (since is not None and latest <= since):
+        return since
+    return latest
+
+
+def _convert(value, field):
+    if value is None:
+        return None
+    if pa.types.is_floating(field.type):
+        return float(value)
+    if pa.types.is_string(field.type) and not isinstance(value, str):
+        return str(value)
+    return value
+
+
+def batches(name, since=None, until=None, start=None, end=None, decimals='decimal'):
+    arrow_schema = schema(name, decimals)
+    for partition in db.session.execute(query(name, since, until, start, end)).partitions():
+        columns = list(zip(*partition))
+        yield pa.RecordBatch.from_arrays(
+            [pa.array([_convert(value, field) for value in values], type=field.type)
+             for values, field in zip(columns, arrow_schema)],
+            schema=arrow_schema
+        )
+
+
+def stream(name, sink, file_format='parquet', since=None, until=None, start=None, end=None,
+           decimals='decimal'):
+    """Write the export to ``sink``, yielding after each batch so the caller can drain it.
+
+    Arrow output is an IPC stream. Parquet needs a sink with ``tell``.
+    """
+    arrow_schema = schema(name, decimals)
+    output = pa.PythonFile(sink, mode='w')
+    if file_format == 'parquet':
+        writer = pq.ParquetWriter(output, arrow_schema, compression='zstd')
+    else:
+        writer = pa.ipc.new_stream(output, arrow_schema)
+    with writer:
+        for batch in batches(name, since, until, start, end, decimals):
+            writer.write_batch(batch)
+            yield
+    yield
+
+
+def _runs(batch, date_index, partition):
+    """Split a date-ordered batch into ``(partition_key, slice)`` runs."""
+    keys = [value.strftime(PARTITIONS[partition]) if value else 'unknown'
+            for value in batch.column(date_index).to_pylist()]
+    offset = 0
+    for index in range(1, len(keys) + 1):
+        if index == len(keys) or keys[index] != keys[offset]:
+            yield keys[offset], batch.slice(offset, index - offset)
+            offset = index
+
+
+def _read_manifest(directory):
+    path = os.path.join(directory, MANIFEST)
+    if not os.path.exists(path):
+        return {}
+    with open(path) as handle:
+        return json.load(handle)
+
+
+def _write_manifest(directory, manifest):
+    path = os.path.join(directory, MANIFEST)
+    with open(f'{path}.tmp', 'w') as handle:
+        json.dump(manifest, handle, indent=2, sort_keys=True)
+    os.replace(f'{path}.tmp', path)
+
+
+def export_directory(directory, names=None, partition=None, full=False, decimals='decimal'):
+    """Write new Parquet parts for each table and advance its watermark.
+
+    Returns ``{table: {'rows': n, 'files': [...], 'watermark': iso}}``.
+    """
+    os.makedirs(directory, exist_ok=True)
+    manifest = _read_manifest(directory)
+    run_id = datetime.utcnow().strftime('%Y%m%dT%H%M%S%f')
+    summary = {}
+    for name in names or list(DATASETS):
+        previous = manifest.get(name, {}).get('watermark')
+        since = None if full or not previous else datetime.fromisoformat(previous)
+        until = watermark(name, since)
+        arrow_schema = schema(name, decimals)
+        date_field = DATASETS[name][1].key
+        date_index = arrow_schema.get_field_index(date_field)
+
+        files = []
+        rows = 0
+        current_key, writer = None, None
+        try:
+            if until is not None and until != since:
+                for batch in batches(name, since, until, decimals=decimals):
+                    rows += batch.num_rows
+                    runs = _runs(batch, date_index, partition) if partition else [(None, batch)]
+                    for key, run in runs:
+                        # Rows come in date order, so a finished partition is never reopened
+                        if writer is None or key != current_key:
+                            if writer is not None:
+                                writer.close()
+                            folder = os.path.join(directory, name, *([f'{partition}={key}'] if key else []))
+                            os.makedirs(folder, exist_ok=True)
+                            path = os.path.join(folder, f'part-{run_id}.parquet')
+                            writer = pq.ParquetWriter(path, arrow_schema, compression='zstd')
+                            current_key = key
+                            files.append(os.path.relpath(path, directory))
+                        writer.write_batch(run)
+        finally:
+            if writer is not None:
+                writer.close()
+
+        if until is not None:
+            manifest[name] = {'watermark': until.isoformat(), 'last_run': run_id}
+            _write_manifest(directory, manifest)
+        summary[name] = {'rows': rows, 'files': files, 'watermark': until.isoformat() if until else None}
+    return summary
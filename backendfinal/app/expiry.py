@@ -0,0 +1,110 @@
+"""Expiry alerts for agent trainings and documents.
+
+Run daily by the scheduler. An alert is a broadcast notification raised
+when an expiry date comes within one of ``EXPIRY_ALERT_DAYS`` (30, 7 and 0
+days by default). Each run covers the days since the previous successful
+run, so alerts are neither repeated nor lost when a day is missed. Gaps
+longer than ``MAX_CATCH_UP_DAYS`` are cut short.
+"""
+from datetime import datetime, time, timedelta
+
+from flask import current_app
+from sqlalchemy import and_, insert, or_
+
+from app import db
+from app.models import Agent, AgentTraining, Document, Notification, NotificationState, Training
+
+MAX_CATCH_UP_DAYS = 31
+ALERT_TTL_DAYS = 7
+
+
+def _window(run):
+    """``(since, today)``: alerts are due for thresholds crossed in ``(since, today]``."""
+    today = run.scheduled_for.date()
+    since = run.previous.date() if run.previous else today - timedelta(days=1)
+    return max(since, today - timedelta(days=MAX_CATCH_UP_DAYS)), today
+
+
+def _due(column, since, today):
+    days = current_app.config.get('EXPIRY_ALERT_DAYS', [30, 7, 0])
+    return or_(*[and_(column > since + timedelta(days=d), column <= today + timedelta(days=d)) for d in days])
+
+
+def _when(expiry_date, today):
+    days = (expiry_date - today).days
+    if days > 1:
+        return f'expires on {expiry_date.isoformat()} (in {days} days)'
+    if days == 1:
+        return f'expires tomorrow ({expiry_date.isoformat()})'
+    if days == 0:
+        return 'expires today'
+    return f'expired on {expiry_date.isoformat()}'
+
+
+def _notify(rows):
+    if rows:
+        db.session.execute(insert(Notification), rows)
+        NotificationState.adjust(len(rows))
+    db.session.commit()
+    return len(rows)
+
+
+def _alert(agent_id, notification_type, title, message, expiry_date, today):
+    return {
+        'agent_id': agent_id,
+        'notification_type': notification_type,
+        'title': title,
+        'message': message,
+        'priority': 'high' if expiry_date <= today else 'normal',
+        'is_read': False,
+        'created_at': datetime.utcnow(),
+        'expires_at': datetime.combine(max(expiry_date, today), time()) + timedelta(days=ALERT_TTL_DAYS),
+    }
+
+
+def training_alerts(run):
+    """Raise alerts for agent trainings reaching an alert threshold; returns how many."""
+    since, today = _window(run)
+    if since >= today:
+        return 0
+    rows = db.session.query(
+        AgentTraining.agent_id, AgentTraining.expiry_date, Training.training_name,
+        Agent.employee_code, Agent.first_name, Agent.last_name
+    ).join(Training, Training.id == AgentTraining.training_id).join(
+        Agent, Agent.id == AgentTraining.agent_id
+    ).filter(
+        _due(AgentTraining.expiry_date, since, today),
+        Agent.employment_status == 'active'
+    ).order_by(AgentTraining.expiry_date).all()
+
+    return _notify([
+        _alert(agent_id, 'training_expiry', f'Training expiring: {training_name}',
+               f'{first_name} {last_name} ({code}): {training_name} {_when(expiry_date, today)}',
+               expiry_date, today)
+        for agent_id, expiry_date, training_name, code, first_name, last_name in rows
+    ])
+
+
+def document_alerts(run):
+    """Raise alerts for documents reaching an alert threshold; returns how many."""
+    since, today = _window(run)
+    if since >= today:
+        return 0
+    rows = db.session.query(
+        Document.entity_type, Document.entity_id, Document.document_type, Document.document_name,
+        Document.expiry_date, Agent.employee_code, Agent.first_name, Agent.last_name
+    ).outerjoin(
+        Agent, and_(Document.entity_type == 'agent', Agent.id == Document.entity_id)
+    ).filter(
+        _due(Document.expiry_date, since, today)
+    ).order_by(Document.expiry_date).all()
+
+    alerts = []
+    for entity_type, entity_id, document_type, name, expiry_date, code, first_name, last_name in rows:
+        label = name or document_type
+        owner = f'{first_name} {last_name} ({code})' if code else f'{entity_type} #{entity_id}'
+        alerts.append(_alert(
+            entity_id if code else None, 'document_expiry', f'Document expiring: {label}',
+            f'{owner}: {label} {_when(expiry_date, today)}', expiry_date, today
+        ))
+    return _notify(alerts)
@@ -0,0 +1,251 @@
+"""Streaming CSV and XLSX exports of operational tables.
+
+Each dataset is one SELECT of plain columns (the table's own, plus the
+agent and site names a report reader needs), streamed with ``yield_per``
+so rows are fetched from a server-side cursor in batches. Rows are
+encoded as they arrive and sent in chunks of ``FLUSH_ROWS``, so memory
+stays flat however many rows are exported. CSV output can be gzipped.
+XLSX is written by a minimal pure-Python writer that streams the zip
+container as it goes, so no spreadsheet library or temporary file is
+needed.
+"""
+import csv
+import io
+import zipfile
+import zlib
+from datetime import date, datetime, time
+from decimal import Decimal
+from xml.sax.saxutils import escape
+
+from sqlalchemy import select
+
+from app import db
+from app.models import Agent, Attendance, Payroll, Shift, Site
+
+FETCH_SIZE = 1000
+FLUSH_ROWS = 500
+
+_AGENT_COLUMNS = (
+    Agent.employee_code.label('agent_code'),
+    (Agent.first_name + ' ' + Agent.last_name).label('agent_name'),
+)
+
+# name: (model, date column for start_date/end_date, request arg -> column, joined columns)
+DATASETS = {
+    'attendances': (Attendance, Attendance.attendance_date, {
+        'agent_id': Attendance.agent_id,
+        'site_id': Attendance.site_id,
+        'shift_id': Attendance.shift_id,
+        'status': Attendance.attendance_status,
+    }, _AGENT_COLUMNS + (Site.site_name,)),
+    'shifts': (Shift, Shift.shift_date, {
+        'agent_id': Shift.agent_id,
+        'site_id': Shift.site_id,
+    }, _AGENT_COLUMNS + (Site.site_name,)),
+    'payrolls': (Payroll, Payroll.pay_period_start, {
+        'agent_id': Payroll.agent_id,
+        'status': Payroll.payment_status,
+    }, _AGENT_COLUMNS),
+}
+
+
+def query(name, args):
+    """``(header, statement)`` for dataset ``name`` filtered like its list route.
+
+    Raises ``ValueError`` for malformed dates.
+    """
+    model, date_column, filters, extra = DATASETS[name]
+    columns = list(model.__table__.columns) + list(extra)
+    statement = select(*columns).join(Agent, Agent.id == model.agent_id)
+    if any(column.table is Site.__table__ for column in extra):
+        statement = statement.join(Site, Site.id == model.site_id)
+
+    for arg, column in filters.items():
+        if args.get(arg):
+            statement = statement.where(column == args.get(arg))
+    for arg, compare in (('start_date', date_column.__ge__), ('end_date', date_column.__le__)):
+        if args.get(arg):
+            try:
+                statement = statement.where(compare(datetime.fromisoformat(args.get(arg)).date()))
+            except ValueError as exc:
+                raise ValueError(f'Invalid date for {arg}') from exc
+
+    statement = statement.order_by(date_column, model.id).execution_options(yield_per=FETCH_SIZE)
+    return [column.key for column in columns], statement
+
+
+def rows(statement):
+    for partition in db.session.execute(statement).partitions():
+        yield from partition
+
+
+def _text(value):
+    if value is None:
+        return ''
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    if isinstance(value, (date, time)):
+        return value.isoformat()
+    return value
+
+
+def csv_chunks(header, records):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(header)
+    for count, record in enumerate(records, start=1):
+        writer.writerow([_text(value) for value in record])
+        if count % FLUSH_ROWS == 0:
+            yield buffer.getvalue().encode()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue().encode()
+
+
+def gzipped(chunks):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+class Sink:
+    """Write-only, unseekable file that hands written bytes back on ``drain``.
+
+    ``zipfile`` falls back to streaming mode (data descriptors after each
+    member) when its file cannot ``seek``.
+    """
+
+    def __init__(self):
+        self._chunks = []
+        self.position = 0
+        self.closed = False
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        # Writers close their sink when done; what was written can still be drained
+        self.closed = True
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+_EPOCH = datetime(1899, 12, 30)
+
+# cellXfs indexes in _STYLES
+_DATE_STYLE, _DATETIME_STYLE, _TIME_STYLE = 1, 2, 3
+
+_CONTENT_TYPES = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+    '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+    '<Default Extension="xml" ContentType="application/xml"/>'
+    '<Override PartName="/xl/workbook.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+    '<Override PartName="/xl/worksheets/sheet1.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+    '<Override PartName="/xl/styles.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.styles+xml"/>'
+    '</Types>'
+)
+_ROOT_RELS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/'
+    'officeDocument" Target="xl/workbook.xml"/>'
+    '</Relationships>'
+)
+_WORKBOOK_RELS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/'
+    'worksheet" Target="worksheets/sheet1.xml"/>'
+    '<Relationship Id="rId2" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/'
+    'styles" Target="styles.xml"/>'
+    '</Relationships>'
+)
+_STYLES = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<styleSheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+    '<numFmts count="1"><numFmt numFmtId="164" formatCode="yyyy-mm-dd hh:mm:ss"/></numFmts>'
+    '<fonts count="1"><font><sz val="11"/><name val="Calibri"/></font></fonts>'
+    '<fills count="2"><fill><patternFill patternType="none"/></fill>'
+    '<fill><patternFill patternType="gray125"/></fill></fills>'
+    '<borders count="1"><border><left/><right/><top/><bottom/><diagonal/></border></borders>'
+    '<cellStyleXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" borderId="0"/></cellStyleXfs>'
+    '<cellXfs count="4"><xf numFmtId="0" fontId="0" fillId="0" borderId="0" xfId="0"/>'
+    '<xf numFmtId="14" fontId="0" fillId="0" borderId="0" xfId="0" applyNumberFormat="1"/>'
+    '<xf numFmtId="164" fontId="0" fillId="0" borderId="0" xfId="0" applyNumberFormat="1"/>'
+    '<xf numFmtId="21" fontId="0" fillId="0" borderId="0" xfId="0" applyNumberFormat="1"/></cellXfs>'
+    '</styleSheet>'
+)
+
+
+def _workbook(sheet_name):
+    return (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+        'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+        f'<sheets><sheet name="{escape(sheet_name[:31])}" sheetId="1" r:id="rId1"/></sheets>'
+        '</workbook>'
+    )
+
+
+def _cell(value):
+    if value is None:
+        return '<c/>'
+    if isinstance(value, bool):
+        return f'<c t="b"><v>{int(value)}</v></c>'
+    if isinstance(value, (int, float, Decimal)):
+        return f'<c><v>{value}</v></c>'
+    if isinstance(value, datetime):
+        serial = (value - _EPOCH).total_seconds() / 86400
+        return f'<c s="{_DATETIME_STYLE}"><v>{serial}</v></c>'
+    if isinstance(value, date):
+        return f'<c s="{_DATE_STYLE}"><v>{(value - _EPOCH.date()).days}</v></c>'
+    if isinstance(value, time):
+        serial = (value.hour * 3600 + value.minute * 60 + value.second) / 86400
+        return f'<c s="{_TIME_STYLE}"><v>{serial}</v></c>'
+    return f'<c t="inlineStr"><is><t xml:space="preserve">{escape(str(value))}</t></is></c>'
+
+
+def _row(values):
+    return '<row>' + ''.join(_cell(value) for value in values) + '</row>'
+
+
+def xlsx_chunks(header, records, sheet_name='Export'):
+    sink = Sink()
+    with zipfile.ZipFile(sink, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr('[Content_Types].xml', _CONTENT_TYPES)
+        archive.writestr('_rels/.rels', _ROOT_RELS)
+        archive.writestr('xl/workbook.xml', _workbook(sheet_name))
+        archive.writestr('xl/_rels/workbook.xml.rels', _WORKBOOK_RELS)
+        archive.writestr('xl/styles.xml', _STYLES)
+        yield sink.drain()
+
+        with archive.open('xl/worksheets/sheet1.xml', 'w', force_zip64=True) as sheet:
+            sheet.write(
+                b'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                b'<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData>'
+            )
+            sheet.write(_row(header).encode())
+            for count, record in enumerate(records, start=1):
+                sheet.write(_row(record).encode())
+                if count % FLUSH_ROWS == 0:
+                    yield sink.drain()
+            sheet.write(b'</sheetData></worksheet>')
+    yield sink.drain()
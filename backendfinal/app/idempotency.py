@@ -0,0 +1,181 @@
+"""Idempotency-Key support for mutating requests.
+
+An authenticated POST, PUT or PATCH that carries an ``Idempotency-Key``
+header first claims ``(user, key)`` in ``idempotency_keys``, in its own
+short transaction, along with a SHA-256 fingerprint of the method, path,
+query and body. The view then runs as usual, and its response (status,
+body and a few headers) is stored on the claim. A retry with the same key
+and fingerprint gets the stored response back, marked with
+``Idempotent-Replayed: true``, without running the view or touching any
+business table.
+
+Concurrent duplicates are serialized by the unique constraint. Whoever
+loses the insert waits up to ``IDEMPOTENCY_WAIT_SECONDS`` for the winner to
+finish and then replays its response, or gets a 409 with ``Retry-After``.
+Reusing a key for a different request is a 422. 5xx and streamed responses
+are not kept, so they can be retried. Claims expire after
+``IDEMPOTENCY_TTL_HOURS`` and are purged by a retention policy.
+"""
+import hashlib
+import time
+from datetime import datetime, timedelta
+
+from flask import current_app, g, jsonify, request
+from flask_jwt_extended import get_jwt_identity, verify_jwt_in_request
+from sqlalchemy import delete, insert, select, update
+from sqlalchemy.exc import IntegrityError
+
+from app import db
+from app.models import IdempotencyKey
+from app.retention import RetentionPolicy, register_policy
+
+HEADER = 'Idempotency-Key'
+REPLAYED_HEADER = 'Idempotent-Replayed'
+METHODS = ('POST', 'PUT', 'PATCH')
+
+_STORED_HEADERS = ('Content-Type', 'Location', 'ETag')
+_MAX_HASHED_BODY = 1024 * 1024
+_MAX_STORED_BODY = 1024 * 1024
+_POLL_SECONDS = 0.05
+
+_table = IdempotencyKey.__table__
+
+
+def _identity():
+    try:
+        verify_jwt_in_request(optional=True)
+        return get_jwt_identity()
+    except Exception:
+        return None
+
+
+def _fingerprint():
+    digest = hashlib.sha256(f'{request.method} {request.full_path}'.encode())
+    if request.mimetype == 'multipart/form-data' or (request.content_length or 0) > _MAX_HASHED_BODY:
+        # Reading the body here would buffer the whole upload; its shape stands in for it
+        digest.update(f'{request.content_type} {request.content_length} '
+                      f'{request.headers.get("X-Filename")}'.encode())
+    else:
+        digest.update(request.get_data(cache=True))
+    return digest.hexdigest()
+
+
+def _claim(scope, key, fingerprint, now):
+    """Id of a new claim on ``(scope, key)``, or None when it is already taken."""
+    try:
+        with db.engine.begin() as conn:
+            return conn.execute(insert(_table).values(
+                scope=scope, key=key, fingerprint=fingerprint, method=request.method, path=request.path[:255],
+                status='processing', created_at=now,
+                expires_at=now + timedelta(hours=current_app.config.get('IDEMPOTENCY_TTL_HOURS', 24))
+            )).inserted_primary_key[0]
+    except IntegrityError:
+        return None
+
+
+def _existing(scope, key):
+    with db.engine.connect() as conn:
+        return conn.execute(select(_table).where(_table.c.scope == scope, _table.c.key == key)).first()
+
+
+def _release(claim_id):
+    with db.engine.begin() as conn:
+        conn.execute(delete(_table).where(_table.c.id == claim_id))
+
+
+def _replay(row):
+    response = current_app.response_class(row.response_body, status=row.response_status)
+    for name, value in (row.response_headers or {}).items():
+        response.headers[name] = value
+    response.headers[REPLAYED_HEADER] = 'true'
+    return response
+
+
+def _before_request():
+    key = request.headers.get(HEADER)
+    if not key or request.method not in METHODS:
+        return None
+    if len(key) > 255:
+        return jsonify({'error': f'{HEADER} must be at most 255 characters'}), 400
+    identity = _identity()
+    if identity is None:
+        return None
+
+    scope = f'user:{identity}'
+    fingerprint = _fingerprint()
+    lock_timeout = timedelta(seconds=current_app.config.get('IDEMPOTENCY_LOCK_SECONDS', 300))
+    deadline = time.monotonic() + current_app.config.get('IDEMPOTENCY_WAIT_SECONDS', 10)
+    while True:
+        now = datetime.utcnow()
+        claim_id = _claim(scope, key, fingerprint, now)
+        if claim_id is not None:
+            g._idempotency_claim = claim_id
+            return None
+
+        row = _existing(scope, key)
+        if row is None:
+            continue
+        if row.expires_at <= now or (row.status == 'processing' and row.created_at < now - lock_timeout):
+            # Expired, or left behind by a worker that died mid-request
+            _release(row.id)
+            continue
+        if row.fingerprint != fingerprint:
+            return jsonify({'error': f'{HEADER} was already used for a different request'}), 422
+        if row.status == 'completed':
+            return _replay(row)
+        if time.monotonic() >= deadline:
+            response = jsonify({'error': f'A request with this {HEADER} is still in progress'})
+            response.headers['Retry-After'] = '1'
+            return response, 409
+        time.sleep(_POLL_SECONDS)
+
+
+def _end_view_transaction():
+    # Work the view left uncommitted is discarded at teardown anyway. Its locks
+    # must go first, or the claim's own connection waits on them until it times out.
+    db.session.rollback()
+
+
+def _after_request(response):
+    claim_id = g.pop('_idempotency_claim', None)
+    if claim_id is None:
+        return response
+    _end_view_transaction()
+    if response.status_code >= 500 or response.is_streamed or response.direct_passthrough:
+        _release(claim_id)
+        return response
+    body = response.get_data()
+    if len(body) > _MAX_STORED_BODY:
+        _release(claim_id)
+        return response
+    with db.engine.begin() as conn:
+        conn.execute(update(_table).where(_table.c.id == claim_id).values(
+            status='completed',
+            response_status=response.status_code,
+            response_headers={name: response.headers[name] for name in _STORED_HEADERS if name in response.headers},
+            response_body=body
+        ))
+    return response
+
+
+def _teardown_request(exc):
+    # after_request did not run (an after_request hook raised); let the client retry
+    claim_id = g.pop('_idempotency_claim', None)
+    if claim_id is not None:
+        _end_view_transaction()
+        _release(claim_id)
+
+
+register_policy(RetentionPolicy(
+    'expired_idempotency_keys',
+    IdempotencyKey,
+    lambda now, cutoff: IdempotencyKey.expires_at <= now,
+    batch_size=5000,
+    description='Idempotency keys past their expires_at'
+))
+
+
+def init_app(app):
+    app.before_request(_before_request)
+    app.after_request(_after_request)
+    app.teardown_request(_teardown_request)
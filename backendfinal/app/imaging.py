@@ -0,0 +1,178 @@
+"""Thumbnail and web-size derivatives of stored images.
+
+Derivatives are rendered in a process pool, eagerly when an image is
+uploaded and lazily on first request otherwise. They are cached on disk as
+``<sha256>-<variant>.jpg``. Entries are keyed by the source digest, so they
+never go stale and can be served with immutable cache headers. The cache is
+bounded by ``IMAGE_CACHE_MAX_MB``, and the least recently used entries
+are evicted first. Pillow is optional; without it the originals are served.
+"""
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from flask import current_app
+
+from app import storage
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # pragma: no cover - Pillow is optional
+    Image = None
+    ImageOps = None
+
+VARIANTS = {
+    'thumb': (320, 320),
+    'web': (1280, 1280),
+}
+
+_lock = threading.RLock()
+_pool = None
+_pending = {}
+
+
+def _render(source_path, target_path, max_size, quality):
+    """Write one JPEG derivative; runs inside a pool worker."""
+    with Image.open(source_path) as image:
+        image = ImageOps.exif_transpose(image)
+        image.thumbnail(max_size, Image.LANCZOS)
+        if image.mode not in ('RGB', 'L'):
+            image = image.convert('RGB')
+        tmp_path = f'{target_path}.{os.getpid()}.tmp'
+        image.save(tmp_path, 'JPEG', quality=quality, optimize=True, progressive=True)
+    os.replace(tmp_path, target_path)
+    return os.path.getsize(target_path)
+
+
+class DerivativeCache:
+    """Size-bounded directory of rendered derivatives."""
+
+    def __init__(self, root, max_bytes, suffix='.jpg'):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.suffix = suffix
+        os.makedirs(root, exist_ok=True)
+        self.total_bytes = sum(entry.stat().st_size for entry in os.scandir(root) if entry.is_file())
+
+    def path(self, sha256, variant):
+        return os.path.join(self.root, f'{sha256}-{variant}{self.suffix}')
+
+    def get(self, sha256, variant, touch=False):
+        path = self.path(sha256, variant)
+        if not os.path.exists(path):
+            return None
+        if touch:
+            # Bump the mtime so eviction drops the least recently used entries
+            os.utime(path)
+        return path
+
+    def added(self, size):
+        with _lock:
+            self.total_bytes += size
+            if self.total_bytes <= self.max_bytes:
+                return
+        self.evict()
+
+    def evict(self):
+        """Drop the oldest derivatives until the cache is back under 90% of its budget."""
+        entries = sorted(
+            (entry for entry in os.scandir(self.root) if entry.is_file() and entry.name.endswith(self.suffix)),
+            key=lambda entry: entry.stat().st_mtime
+        )
+        target = self.max_bytes * 0.9
+        with _lock:
+            for entry in entries:
+                if self.total_bytes <= target:
+                    break
+                try:
+                    size = entry.stat().st_size
+                    os.remove(entry.path)
+                except FileNotFoundError:
+                    continue
+                self.total_bytes -= size
+
+
+def available():
+    return Image is not None
+
+
+def _get_pool(app):
+    global _pool
+    with _lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=app.config.get('IMAGE_WORKERS') or None)
+        return _pool
+
+
+def _submit(app, sha256, variant):
+    """Queue one derivative, reusing an in-flight render for the same key."""
+    cache = app.extensions['image_cache']
+    key = (sha256, variant)
+    with _lock:
+        future = _pending.get(key)
+        if future is not None:
+            return future
+        source = storage.get_storage().local_path(sha256)
+        if source is None:
+            return None
+        future = _get_pool(app).submit(
+            _render, source, cache.path(sha256, variant), VARIANTS[variant],
+            app.config.get('IMAGE_JPEG_QUALITY', 82)
+        )
+        _pending[key] = future
+
+    def done(finished):
+        with _lock:
+            _pending.pop(key, None)
+        if finished.exception() is None:
+            cache.added(finished.result())
+        else:
+            app.logger.warning('Rendering %s of %s failed: %s', variant, sha256, finished.exception())
+
+    future.add_done_callback(done)
+    return future
+
+
+def schedule(stored):
+    """Render every variant of a freshly stored image in the background."""
+    app = current_app._get_current_object()
+    if not available() or not (stored.mime_type or '').startswith('image/'):
+        return
+    if not app.config.get('IMAGE_DERIVATIVES_EAGER', True):
+        return
+    cache = app.extensions['image_cache']
+    for variant in VARIANTS:
+        if cache.get(stored.sha256, variant) is None:
+            _submit(app, stored.sha256, variant)
+
+
+def get_derivative(stored, variant, timeout=30):
+    """Return the path of a rendered derivative, rendering it if needed.
+
+    Returns None when the derivative cannot be produced (Pillow missing, not
+    an image, or a remote backend without a local path).
+    """
+    app = current_app._get_current_object()
+    if not available() or not (stored.mime_type or '').startswith('image/'):
+        return None
+    cache = app.extensions['image_cache']
+    path = cache.get(stored.sha256, variant, touch=True)
+    if path:
+        return path
+    future = _submit(app, stored.sha256, variant)
+    if future is None:
+        return None
+    try:
+        future.result(timeout=timeout)
+    except Exception as exc:
+        app.logger.warning('Derivative %s of %s unavailable: %s', variant, stored.sha256, exc)
+        return None
+    return cache.get(stored.sha256, variant)
+
+
+def init_app(app):
+    app.extensions['image_cache'] = DerivativeCache(
+        app.config['IMAGE_CACHE_ROOT'],
+        app.config.get('IMAGE_CACHE_MAX_MB', 512) * 1024 * 1024
+    )
+    storage.on_store(schedule)
@@ -0,0 +1,199 @@
+"""Invoice PDF rendering.
+
+The invoice, its line items and the client's billing details are reduced to
+a plain document, and its SHA-256 becomes the cache key. An unchanged invoice
+is always served from the same file, and any edit produces a new key. PDFs
+are written in a process pool, outside the request workers, into a
+size-bounded ``DerivativeCache``. ``schedule`` queues a render without
+waiting; it is called when invoices are marked as sent so the PDF is ready
+before anyone asks for it. Layout is written with ``app.pdf``.
+"""
+import hashlib
+import json
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from flask import current_app
+
+from app import pdf
+from app.imaging import DerivativeCache
+from app.models import Client, InvoiceLineItem, to_iso, to_money
+from app.pdf import MARGIN
+
+# Bump when the layout changes so cached PDFs are re-rendered
+LAYOUT_VERSION = 1
+VARIANT = 'invoice'
+
+_lock = threading.RLock()
+_pool = None
+_pending = {}
+
+
+def document(invoice):
+    """Everything printed on the invoice, as plain JSON-able data."""
+    client = invoice.client or Client.query.get(invoice.client_id)
+    return {
+        'layout': LAYOUT_VERSION,
+        'company': current_app.config.get('COMPANY_NAME', 'Dashflow'),
+        'invoice_number': invoice.invoice_number,
+        'invoice_date': to_iso(invoice.invoice_date),
+        'due_date': to_iso(invoice.due_date),
+        'billing_period_start': to_iso(invoice.billing_period_start),
+        'billing_period_end': to_iso(invoice.billing_period_end),
+        'payment_terms': invoice.payment_terms,
+        'notes': invoice.notes,
+        'currency': client.currency if client else None,
+        'client': {
+            'name': client.company_name,
+            'contact': client.billing_contact_name or client.primary_contact_name,
+            'email': client.billing_contact_email or client.primary_contact_email,
+            'address': client.address,
+            'city': client.city,
+            'country': client.country,
+            'tax_id': client.tax_id,
+        } if client else {},
+        'items': [
+            {
+                'description': item.description,
+                'quantity': str(to_money(item.quantity)),
+                'unit_price': str(to_money(item.unit_price)),
+                'line_total': str(to_money(item.line_total)),
+            }
+            for item in invoice.line_items.order_by(InvoiceLineItem.id)
+        ],
+        'subtotal': str(to_money(invoice.subtotal)),
+        'tax_rate': str(to_money(invoice.tax_rate)),
+        'tax_amount': str(to_money(invoice.tax_amount)),
+        'discount_amount': str(to_money(invoice.discount_amount)),
+        'total_amount': str(to_money(invoice.total_amount)),
+        'amount_paid': str(to_money(invoice.amount_paid)),
+        'balance_due': str(to_money(invoice.balance_due)),
+    }
+
+
+def content_hash(doc):
+    return hashlib.sha256(json.dumps(doc, sort_keys=True).encode()).hexdigest()
+
+
+def _lines(doc):
+    """(font, size, x, text) rows top to bottom; None starts a blank line."""
+    currency = doc['currency'] or ''
+    rows = [('F2', 18, MARGIN, doc['company']), None,
+            ('F2', 14, MARGIN, f"Invoice {doc['invoice_number']}"),
+            ('F1', 10, MARGIN, f"Date: {doc['invoice_date']}    Due: {doc['due_date']}")]
+    if doc['billing_period_start'] or doc['billing_period_end']:
+        rows.append(('F1', 10, MARGIN, f"Period: {doc['billing_period_start'] or ''} - {doc['billing_period_end'] or ''}"))
+    if doc['payment_terms']:
+        rows.append(('F1', 10, MARGIN, f"Terms: {doc['payment_terms']}"))
+    rows.append(None)
+
+    client = doc['client']
+    rows.append(('F2', 11, MARGIN, 'Bill to'))
+    for value in (client.get('name'), client.get('contact'), client.get('email'), client.get('address'),
+                  ', '.join(part for part in (client.get('city'), client.get('country')) if part),
+                  f"Tax ID: {client['tax_id']}" if client.get('tax_id') else None):
+        if value:
+            rows.append(('F1', 10, MARGIN, value))
+    rows.append(None)
+
+    rows.append(('F4', 9, MARGIN, f"{'Description':<48}{'Qty':>8}{'Unit price':>14}{'Total':>14}"))
+    for item in doc['items']:
+        description = item['description'] or ''
+        chunks = [description[i:i + 46] for i in range(0, len(description), 46)] or ['']
+        rows.append(('F3', 9, MARGIN, f"{chunks[0]:<48}{item['quantity']:>8}{item['unit_price']:>14}{item['line_total']:>14}"))
+        rows.extend(('F3', 9, MARGIN, f'  {chunk}') for chunk in chunks[1:])
+    rows.append(None)
+
+    for label, value in (('Subtotal', doc['subtotal']),
+                         (f"Tax ({doc['tax_rate']}%)", doc['tax_amount']),
+                         ('Discount', doc['discount_amount']),
+                         ('Total', doc['total_amount']),
+                         ('Paid', doc['amount_paid']),
+                         ('Balance due', doc['balance_due'])):
+        font = 'F4' if label in ('Total', 'Balance due') else 'F3'
+        rows.append((font, 10, MARGIN, f'{label:>66}{value:>12} {currency}'))
+
+    if doc['notes']:
+        rows.append(None)
+        rows.append(('F2', 10, MARGIN, 'Notes'))
+        for paragraph in str(doc['notes']).splitlines():
+            rows.extend(('F1', 9, MARGIN, paragraph[i:i + 100]) for i in range(0, max(len(paragraph), 1), 100))
+    return rows
+
+
+def build_pdf(doc):
+    return pdf.build(_lines(doc))
+
+
+def _render(doc, target_path):
+    """Write one invoice PDF; runs inside a pool worker."""
+    tmp_path = f'{target_path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'wb') as handle:
+        handle.write(build_pdf(doc))
+    os.replace(tmp_path, target_path)
+    return os.path.getsize(target_path)
+
+
+def _get_pool(app):
+    global _pool
+    with _lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=app.config.get('INVOICE_PDF_WORKERS') or None)
+        return _pool
+
+
+def _submit(app, doc, key):
+    cache = app.extensions['invoice_pdf_cache']
+    with _lock:
+        future = _pending.get(key)
+        if future is not None:
+            return future
+        future = _get_pool(app).submit(_render, doc, cache.path(key, VARIANT))
+        _pending[key] = future
+
+    def done(finished):
+        with _lock:
+            _pending.pop(key, None)
+        if finished.exception() is None:
+            cache.added(finished.result())
+        else:
+            app.logger.warning('Rendering invoice %s failed: %s', doc['invoice_number'], finished.exception())
+
+    future.add_done_callback(done)
+    return future
+
+
+def schedule(invoice):
+    """Queue a render of ``invoice`` unless its current content is already cached."""
+    app = current_app._get_current_object()
+    doc = document(invoice)
+    key = content_hash(doc)
+    if app.extensions['invoice_pdf_cache'].get(key, VARIANT) is None:
+        _submit(app, doc, key)
+    return key
+
+
+def get_pdf(invoice, timeout=30):
+    """Return ``(path, content_hash)``, rendering if needed; path is None on failure."""
+    app = current_app._get_current_object()
+    cache = app.extensions['invoice_pdf_cache']
+    doc = document(invoice)
+    key = content_hash(doc)
+    path = cache.get(key, VARIANT, touch=True)
+    if path:
+        return path, key
+    try:
+        _submit(app, doc, key).result(timeout=timeout)
+    except Exception as exc:
+        app.logger.warning('Invoice %s PDF unavailable: %s', invoice.invoice_number, exc)
+        return None, key
+    return cache.get(key, VARIANT), key
+
+
+def init_app(app):
+    app.extensions['invoice_pdf_cache'] = DerivativeCache(
+        app.config['INVOICE_PDF_CACHE_ROOT'],
+        app.config.get('INVOICE_PDF_CACHE_MAX_MB', 256) * 1024 * 1024,
+        suffix='.pdf'
+    )
@@ -0,0 +1,308 @@
+"""Database-backed background job queue.
+
+Heavy work is enqueued as a ``jobs`` row and executed by separate worker
+processes started with ``flask jobs worker``, never by the web workers.
+No broker is involved. Blueprints register the job types they own::
+
+    @jobs.job_type('payrolls.payslips')
+    def payslips_job(job):
+        job.progress(0, message='Rendering')
+        ...
+        return {'generated': count}
+
+The function receives a ``JobContext``. Its return value is stored as the
+job's ``result``. ``job.progress`` records progress and a heartbeat, and
+raises ``JobCancelled`` once cancellation was requested. It writes through
+its own connection, so the job's own transaction is never committed early.
+
+Failed jobs are retried with exponential backoff until ``max_attempts``.
+Running jobs whose heartbeat is older than ``JOB_STALE_SECONDS`` are
+requeued, which covers workers that crashed or were killed.
+"""
+import multiprocessing
+import os
+import random
+import signal
+import socket
+import threading
+import time
+import traceback
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import and_, select, update
+
+from app import db
+from app.models import Job
+
+ACTIVE_STATUSES = ('queued', 'running')
+
+_job_types = {}
+_table = Job.__table__
+
+
+class JobCancelled(Exception):
+    """Raised inside a job when its cancellation was requested."""
+
+
+class JobType:
+    def __init__(self, name, func, max_attempts=3, priority=0, description=None):
+        self.name = name
+        self.func = func
+        self.max_attempts = max_attempts
+        self.priority = priority
+        self.description = description or (func.__doc__ or '').strip().split('\n')[0] or None
+
+    def to_dict(self):
+        return {
+            'name': self.name,
+            'max_attempts': self.max_attempts,
+            'priority': self.priority,
+            'description': self.description,
+        }
+
+
+def job_type(name, max_attempts=3, priority=0):
+    """Register the decorated function as the handler of jobs of type ``name``."""
+    def decorator(func):
+        _job_types[name] = JobType(name, func, max_attempts, priority)
+        return func
+    return decorator
+
+
+def get_job_types():
+    return dict(_job_types)
+
+
+def enqueue(name, payload=None, user_id=None, run_after=None, max_attempts=None, priority=None):
+    """Queue a job of a registered type and commit; returns the ``Job``."""
+    kind = _job_types.get(name)
+    if kind is None:
+        raise ValueError(f'Unknown job type: {name}')
+    job = Job(
+        job_type=name,
+        payload=payload or {},
+        created_by=user_id,
+        run_after=run_after or datetime.utcnow(),
+        max_attempts=max_attempts or kind.max_attempts,
+        priority=kind.priority if priority is None else priority
+    )
+    db.session.add(job)
+    db.session.commit()
+    return job
+
+
+def cancel(job):
+    """Cancel a queued job now, or ask a running one to stop at its next progress report.
+
+    Both updates are guarded on the status, so a job claimed by a worker in
+    the meantime gets the request rather than being marked cancelled.
+    """
+    row = _table.c.id == job.id
+    cancelled = db.session.execute(update(_table).where(row, _table.c.status == 'queued').values(
+        status='cancelled', finished_at=datetime.utcnow()
+    )).rowcount
+    if not cancelled:
+        requested = db.session.execute(update(_table).where(row, _table.c.status == 'running').values(
+            cancel_requested=True
+        )).rowcount
+        if not requested:
+            db.session.rollback()
+            return False
+    db.session.commit()
+    return True
+
+
+class JobContext:
+    """What a job function sees of its job."""
+
+    def __init__(self, job_id, payload, attempt, worker_id, report_interval=0.5):
+        self.id = job_id
+        self.payload = payload or {}
+        self.attempt = attempt
+        self.worker_id = worker_id
+        self.report_interval = report_interval
+        self._last_report = 0.0
+
+    def progress(self, current, total=None, message=None, force=False):
+        """Record progress; raises ``JobCancelled`` when cancellation was requested.
+
+        Writes are throttled to one per ``report_interval`` unless ``force``.
+        """
+        now = time.monotonic()
+        if not force and now - self._last_report < self.report_interval:
+            return
+        self._last_report = now
+        values = {'progress_current': current, 'heartbeat_at': datetime.utcnow()}
+        if total is not None:
+            values['progress_total'] = total
+        if message is not None:
+            values['progress_message'] = message[:255]
+        with db.engine.begin() as conn:
+            conn.execute(update(_table).where(_table.c.id == self.id).values(**values))
+            cancelled = conn.execute(select(_table.c.cancel_requested).where(_table.c.id == self.id)).scalar()
+        if cancelled:
+            raise JobCancelled()
+
+    def heartbeat(self):
+        with db.engine.begin() as conn:
+            conn.execute(update(_table).where(_table.c.id == self.id).values(heartbeat_at=datetime.utcnow()))
+
+
+def _attempt(context):
+    """WHERE clause matching only the attempt ``context`` runs, not a later one of the same job."""
+    return and_(_table.c.id == context.id, _table.c.status == 'running',
+                _table.c.worker_id == context.worker_id, _table.c.attempts == context.attempt)
+
+
+def _finish(context, **values):
+    """Record the outcome of ``context``'s attempt; False when the job was requeued as stale meanwhile."""
+    values.setdefault('finished_at', datetime.utcnow())
+    with db.engine.begin() as conn:
+        updated = conn.execute(update(_table).where(_attempt(context)).values(**values)).rowcount
+    if not updated:
+        current_app.logger.warning('Job %s attempt %s was taken over, its outcome is discarded',
+                                   context.id, context.attempt)
+    return bool(updated)
+
+
+def _backoff(attempt):
+    base = current_app.config.get('JOB_RETRY_BASE_SECONDS', 30)
+    return base * 2 ** (attempt - 1) * random.uniform(0.8, 1.2)
+
+
+def requeue_stale(now=None):
+    """Put running jobs whose worker stopped reporting back in the queue."""
+    now = now or datetime.utcnow()
+    cutoff = now - timedelta(seconds=current_app.config.get('JOB_STALE_SECONDS', 300))
+    with db.engine.begin() as conn:
+        stale = _table.c.status == 'running'
+        stale &= _table.c.heartbeat_at < cutoff
+        failed = conn.execute(update(_table).where(stale, _table.c.attempts >= _table.c.max_attempts).values(
+            status='failed', error='Worker stopped responding', finished_at=now
+        )).rowcount
+        requeued = conn.execute(update(_table).where(stale).values(
+            status='queued', worker_id=None, run_after=now
+        )).rowcount
+    return requeued + failed
+
+
+def claim(worker_id, types=None):
+    """Take the next due job for this worker; returns ``(id, type, payload, attempt)`` or None."""
+    now = datetime.utcnow()
+    with db.engine.begin() as conn:
+        query = select(_table.c.id).where(_table.c.status == 'queued', _table.c.run_after <= now)
+        if types:
+            query = query.where(_table.c.job_type.in_(types))
+        candidate = conn.execute(
+            query.order_by(_table.c.priority, _table.c.id).limit(1).with_for_update(skip_locked=True)
+        ).scalar()
+        if candidate is None:
+            return None
+        # The status guard makes the claim safe on databases without SKIP LOCKED
+        claimed = conn.execute(update(_table).where(_table.c.id == candidate, _table.c.status == 'queued').values(
+            status='running', worker_id=worker_id, attempts=_table.c.attempts + 1,
+            started_at=now, heartbeat_at=now, cancel_requested=False, error=None
+        )).rowcount
+        if not claimed:
+            return None
+        row = conn.execute(select(_table.c.job_type, _table.c.payload, _table.c.attempts)
+                           .where(_table.c.id == candidate)).first()
+    return candidate, row.job_type, row.payload, row.attempts
+
+
+def _heartbeats(app, context, stop, interval):
+    with app.app_context():
+        while not stop.wait(interval):
+            try:
+                context.heartbeat()
+            except Exception:  # the next beat will try again
+                app.logger.exception('Heartbeat of job %s failed', context.id)
+
+
+def execute(job_id, name, payload, attempt, worker_id):
+    """Run one claimed job to completion and record the outcome."""
+    app = current_app._get_current_object()
+    context = JobContext(job_id, payload, attempt, worker_id)
+    stop = threading.Event()
+    beat = threading.Thread(target=_heartbeats, name=f'job-{job_id}-heartbeat', daemon=True,
+                            args=(app, context, stop, max(app.config.get('JOB_STALE_SECONDS', 300) / 5, 1)))
+    beat.start()
+    started = time.perf_counter()
+    try:
+        kind = _job_types.get(name)
+        if kind is None:
+            raise LookupError(f'No handler registered for job type {name}')
+        result = kind.func(context)
+    except JobCancelled:
+        db.session.rollback()
+        _finish(context, status='cancelled')
+        app.logger.info('Job %s (%s) cancelled', job_id, name)
+    except Exception as exc:
+        db.session.rollback()
+        error = ''.join(traceback.format_exception(type(exc), exc, exc.__traceback__))[-4000:]
+        max_attempts = db.session.get(Job, job_id).max_attempts
+        if attempt < max_attempts and not isinstance(exc, LookupError):
+            delay = _backoff(attempt)
+            _finish(context, status='queued', worker_id=None, error=error, finished_at=None,
+                    run_after=datetime.utcnow() + timedelta(seconds=delay))
+            app.logger.warning('Job %s (%s) failed on attempt %s, retrying in %.0fs: %s',
+                               job_id, name, attempt, delay, exc)
+        else:
+            _finish(context, status='failed', error=error)
+            app.logger.error('Job %s (%s) failed after %s attempts: %s', job_id, name, attempt, exc)
+    else:
+        _finish(context, status='succeeded', result=result)
+        app.logger.info('Job %s (%s) succeeded in %.1fs', job_id, name, time.perf_counter() - started)
+    finally:
+        stop.set()
+        db.session.remove()
+
+
+def run_worker(app, worker_id=None, types=None, once=False, stop=None):
+    """Claim and execute jobs until ``stop`` is set; with ``once``, until the queue is empty."""
+    worker_id = worker_id or f'{socket.gethostname()}:{os.getpid()}'
+    stop = stop or threading.Event()
+    poll = app.config.get('JOB_POLL_SECONDS', 1.0)
+    last_reap = 0.0
+    with app.app_context():
+        while not stop.is_set():
+            if time.monotonic() - last_reap > poll * 30:
+                requeue_stale()
+                last_reap = time.monotonic()
+            claimed = claim(worker_id, types)
+            if claimed is None:
+                if once:
+                    return
+                stop.wait(poll)
+                continue
+            execute(*claimed, worker_id)
+
+
+def _worker_process(types, index):
+    from app import create_app
+
+    app = create_app()
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stop.set())
+    signal.signal(signal.SIGINT, lambda *_: stop.set())
+    run_worker(app, f'{socket.gethostname()}:{os.getpid()}:{index}', types, stop=stop)
+
+
+def run_workers(processes, types=None):
+    """Start ``processes`` worker processes and wait for them; SIGTERM stops them after their current job."""
+    context = multiprocessing.get_context('spawn')
+    children = [context.Process(target=_worker_process, args=(types, index), name=f'job-worker-{index}')
+                for index in range(processes)]
+    for child in children:
+        child.start()
+
+    def forward(signum, frame):
+        for child in children:
+            if child.is_alive():
+                os.kill(child.pid, signal.SIGTERM)
+
+    signal.signal(signal.SIGTERM, forward)
+    signal.signal(signal.SIGINT, forward)
+    for child in children:
+        child.join()
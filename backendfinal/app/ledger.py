@@ -0,0 +1,240 @@
+"""Client receivables ledger.
+
+Whenever a flush changes what an invoice contributes to receivables, the
+difference is posted as ``LedgerEntry`` rows. This covers new invoices,
+changed totals, payments, status changes, moves to another client and
+deletions. The same deltas are applied to the client's ``total_invoiced``,
+``total_paid`` and ``current_balance`` in that flush. Relative UPDATEs are
+used so concurrent transactions never lose an increment. Draft and
+cancelled invoices contribute nothing to the invoiced total.
+
+``check_credit`` compares a prospective amount against the stored balance
+and needs nothing beyond the client row. ``reconcile`` recomputes every
+figure from the invoices, reports drift and optionally repairs it with
+adjustment entries.
+"""
+from collections import defaultdict
+from decimal import Decimal
+
+from flask import has_request_context
+from sqlalchemy import event, func, update
+
+from app import db
+from app.models import Client, Invoice, LedgerEntry
+
+UNPOSTED_STATUSES = ('draft', 'cancelled')
+CENT = Decimal('0.01')
+ZERO = Decimal('0.00')
+
+_BALANCE_COLUMNS = ['total_invoiced', 'total_paid', 'current_balance']
+_TRACKED = ('total_amount', 'amount_paid', 'invoice_status', 'client_id')
+
+
+def _money(value):
+    if value is None:
+        return ZERO
+    return Decimal(str(value)).quantize(CENT)
+
+
+def target(invoice_status, total_amount, amount_paid):
+    """``(invoiced, paid)`` an invoice in this state contributes to its client."""
+    invoiced = ZERO if invoice_status in UNPOSTED_STATUSES else _money(total_amount)
+    return invoiced, _money(amount_paid)
+
+
+def _actor():
+    if not has_request_context():
+        return None
+    try:
+        from flask_jwt_extended import get_jwt_identity
+        return get_jwt_identity()
+    except Exception:
+        return None
+
+
+def _apply_to_client(session, client_id, invoiced, paid):
+    session.execute(
+        update(Client).where(Client.id == client_id).values(
+            total_invoiced=func.coalesce(Client.total_invoiced, 0) + invoiced,
+            total_paid=func.coalesce(Client.total_paid, 0) + paid,
+            current_balance=func.coalesce(Client.current_balance, 0) + invoiced - paid
+        ),
+        execution_options={'synchronize_session': False}
+    )
+    client = session.identity_map.get(session.identity_key(Client, client_id))
+    if client is not None:
+        session.expire(client, _BALANCE_COLUMNS)
+
+
+def post(session, client_id, invoiced=ZERO, paid=ZERO, entry_type='adjustment',
+         invoice=None, description=None):
+    """Record one entry and move the client's balance columns by the same amounts."""
+    if not invoiced and not paid:
+        return None
+    entry = LedgerEntry(
+        client_id=client_id,
+        entry_type=entry_type,
+        invoiced_delta=invoiced,
+        paid_delta=paid,
+        description=description,
+        created_by=_actor()
+    )
+    if invoice is not None:
+        entry.invoice = invoice
+    session.add(entry)
+    _apply_to_client(session, client_id, invoiced, paid)
+    return entry
+
+
+def _posted(session, invoice_id):
+    """What has been posted for an invoice so far, per client."""
+    rows = session.query(
+        LedgerEntry.client_id,
+        func.coalesce(func.sum(LedgerEntry.invoiced_delta), 0),
+        func.coalesce(func.sum(LedgerEntry.paid_delta), 0)
+    ).filter(LedgerEntry.invoice_id == invoice_id).group_by(LedgerEntry.client_id).all()
+    return {client_id: (_money(invoiced), _money(paid)) for client_id, invoiced, paid in rows}
+
+
+def _sync_invoice(session, invoice, deleted=False):
+    posted = _posted(session, invoice.id) if invoice.id is not None else {}
+
+    if deleted:
+        for client_id, (invoiced, paid) in posted.items():
+            post(session, client_id, -invoiced, -paid, 'reversal',
+                 description=f'Invoice {invoice.invoice_number} deleted')
+        return
+
+    invoiced, paid = target(invoice.invoice_status, invoice.total_amount, invoice.amount_paid)
+    for client_id, (old_invoiced, old_paid) in posted.items():
+        if client_id != invoice.client_id:
+            post(session, client_id, -old_invoiced, -old_paid, 'reversal', invoice,
+                 f'Invoice {invoice.invoice_number} moved to client {invoice.client_id}')
+    old_invoiced, old_paid = posted.get(invoice.client_id, (ZERO, ZERO))
+    post(session, invoice.client_id, invoiced - old_invoiced, ZERO, 'invoice', invoice,
+         f'Invoice {invoice.invoice_number}')
+    post(session, invoice.client_id, ZERO, paid - old_paid, 'payment', invoice,
+         f'Payment on invoice {invoice.invoice_number}')
+
+
+def _changed(invoice):
+    state = db.inspect(invoice)
+    return any(state.attrs[key].history.has_changes() for key in _TRACKED)
+
+
+def _before_flush(session, flush_context, instances):
+    for obj in list(session.new):
+        if isinstance(obj, Invoice):
+            _sync_invoice(session, obj)
+    for obj in list(session.dirty):
+        if isinstance(obj, Invoice) and _changed(obj):
+            _sync_invoice(session, obj)
+    for obj in list(session.deleted):
+        if isinstance(obj, Invoice):
+            _sync_invoice(session, obj, deleted=True)
+
+
+def check_credit(client, amount):
+    """Error message when ``amount`` would take the client past its credit limit, else None."""
+    limit = _money(client.credit_limit)
+    if limit <= 0:
+        return None
+    projected = _money(client.current_balance) + _money(amount)
+    if projected > limit:
+        return (f'Credit limit exceeded for {client.company_name}: balance '
+                f'{_money(client.current_balance)} + {_money(amount)} > limit {limit}')
+    return None
+
+
+def reconcile(repair=False, sample=100):
+    """Compare the ledger and client columns with the invoices, optionally fixing drift."""
+    session = db.session
+    expected = {}
+    client_expected = defaultdict(lambda: [ZERO, ZERO])
+    invoices = session.query(
+        Invoice.id, Invoice.client_id, Invoice.invoice_status, Invoice.total_amount, Invoice.amount_paid
+    ).execution_options(yield_per=1000)
+    for invoice_id, client_id, status, total_amount, amount_paid in invoices:
+        invoiced, paid = target(status, total_amount, amount_paid)
+        expected[(invoice_id, client_id)] = (invoiced, paid)
+        client_expected[client_id][0] += invoiced
+        client_expected[client_id][1] += paid
+
+    # Entries of invoices that no longer exist should net to zero per client
+    posted = defaultdict(lambda: [ZERO, ZERO])
+    known = {invoice_id for invoice_id, _ in expected}
+    rows = session.query(
+        LedgerEntry.invoice_id,
+        LedgerEntry.client_id,
+        func.coalesce(func.sum(LedgerEntry.invoiced_delta), 0),
+        func.coalesce(func.sum(LedgerEntry.paid_delta), 0)
+    ).group_by(LedgerEntry.invoice_id, LedgerEntry.client_id)
+    for invoice_id, client_id, invoiced, paid in rows:
+        key = (invoice_id if invoice_id in known else None, client_id)
+        posted[key][0] += _money(invoiced)
+        posted[key][1] += _money(paid)
+
+    invoice_drift = []
+    for key in set(expected) | set(posted):
+        want = expected.get(key, (ZERO, ZERO))
+        have = posted.get(key, (ZERO, ZERO))
+        invoiced, paid = want[0] - have[0], want[1] - have[1]
+        if invoiced or paid:
+            invoice_drift.append({
+                'invoice_id': key[0],
+                'client_id': key[1],
+                'invoiced_delta': invoiced,
+                'paid_delta': paid
+            })
+
+    client_drift = []
+    clients_checked = 0
+    for client_id, invoiced, paid, balance in session.query(
+            Client.id, Client.total_invoiced, Client.total_paid, Client.current_balance):
+        clients_checked += 1
+        want_invoiced, want_paid = client_expected.get(client_id, (ZERO, ZERO))
+        actual = (_money(invoiced), _money(paid), _money(balance))
+        wanted = (want_invoiced, want_paid, want_invoiced - want_paid)
+        if actual != wanted:
+            client_drift.append({
+                'client_id': client_id,
+                'expected': dict(zip(_BALANCE_COLUMNS, wanted)),
+                'actual': dict(zip(_BALANCE_COLUMNS, actual))
+            })
+
+    if repair and (invoice_drift or client_drift):
+        for drift in invoice_drift:
+            session.add(LedgerEntry(
+                client_id=drift['client_id'],
+                invoice_id=drift['invoice_id'],
+                entry_type='adjustment',
+                invoiced_delta=drift['invoiced_delta'],
+                paid_delta=drift['paid_delta'],
+                description='Reconciliation adjustment'
+            ))
+        for drift in client_drift:
+            session.execute(
+                update(Client).where(Client.id == drift['client_id']).values(**drift['expected']),
+                execution_options={'synchronize_session': False}
+            )
+        session.commit()
+
+    def jsonable(drift):
+        return {key: float(value) if isinstance(value, Decimal) else
+                (jsonable(value) if isinstance(value, dict) else value)
+                for key, value in drift.items()}
+
+    return {
+        'invoices_checked': len(expected),
+        'clients_checked': clients_checked,
+        'invoice_drift_count': len(invoice_drift),
+        'client_drift_count': len(client_drift),
+        'invoice_drift': [jsonable(drift) for drift in invoice_drift[:sample]],
+        'client_drift': [jsonable(drift) for drift in client_drift[:sample]],
+        'repaired': bool(repair and (invoice_drift or client_drift))
+    }
+
+
+def init_app(app):
+    if not event.contains(db.session, 'before_flush', _before_flush):
+        event.listen(db.session, 'before_flush', _before_flush)
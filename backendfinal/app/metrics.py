@@ -0,0 +1,181 @@
+"""Per-route request metrics in Prometheus text format.
+
+Request hooks time every call and SQLAlchemy engine events attribute SQL
+statements, DB time and ORM rows loaded to the request that issued them.
+Results are aggregated per route into counters and histograms kept in
+process memory and rendered by ``/api/_metrics``. Each worker process
+exposes its own series; scrape every worker or aggregate by ``instance``.
+
+A request that runs the same statement more than ``N_PLUS_ONE_THRESHOLD``
+times is logged as a likely N+1 pattern.
+"""
+import threading
+import time
+from collections import defaultdict
+
+from flask import current_app, g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from app import db, sql_timing
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 250, 1000)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names, values, extra=None):
+    pairs = list(zip(names, values)) + (list(extra.items()) if extra else [])
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help = help_text
+        self.label_names = labels
+        self._values = defaultdict(float)
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] += amount
+
+    def samples(self):
+        with self._lock:
+            items = list(self._values.items())
+        for labels, value in items:
+            yield f'{self.name}{_labels(self.label_names, labels)} {value:g}'
+
+
+class Histogram:
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, labels=(), buckets=DURATION_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.label_names = labels
+        self.buckets = tuple(buckets)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        with self._lock:
+            entry = self._values.get(labels)
+            if entry is None:
+                entry = self._values[labels] = [[0] * len(self.buckets), 0.0, 0]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[0][index] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def samples(self):
+        with self._lock:
+            items = [(labels, (list(counts), total, count)) for labels, (counts, total, count) in self._values.items()]
+        for labels, (counts, total, count) in items:
+            for bound, bucket_count in zip(self.buckets, counts):
+                yield f'{self.name}_bucket{_labels(self.label_names, labels, {"le": f"{bound:g}"})} {bucket_count}'
+            yield f'{self.name}_bucket{_labels(self.label_names, labels, {"le": "+Inf"})} {count}'
+            yield f'{self.name}_sum{_labels(self.label_names, labels)} {total:g}'
+            yield f'{self.name}_count{_labels(self.label_names, labels)} {count}'
+
+
+ROUTE_LABELS = ('method', 'route')
+
+REQUESTS = Counter('http_requests_total', 'HTTP requests handled.', ('method', 'route', 'status'))
+LATENCY = Histogram('http_request_duration_seconds', 'Wall time spent handling a request.', ROUTE_LABELS)
+DB_TIME = Histogram('http_request_db_seconds', 'Time spent executing SQL per request.', ROUTE_LABELS)
+STATEMENTS = Histogram('http_request_sql_statements', 'SQL statements issued per request.',
+                       ROUTE_LABELS, buckets=COUNT_BUCKETS)
+ROWS = Histogram('http_request_orm_rows', 'ORM rows loaded per request.', ROUTE_LABELS, buckets=COUNT_BUCKETS)
+RESPONSE_SIZE = Histogram('http_response_size_bytes', 'Response body size.', ROUTE_LABELS, buckets=SIZE_BUCKETS)
+N_PLUS_ONE = Counter('http_n_plus_one_warnings_total',
+                     'Requests that repeated one SQL statement past the threshold.', ROUTE_LABELS)
+
+REGISTRY = [REQUESTS, LATENCY, DB_TIME, STATEMENTS, ROWS, RESPONSE_SIZE, N_PLUS_ONE]
+
+
+def render():
+    lines = []
+    for metric in REGISTRY:
+        lines.append(f'# HELP {metric.name} {metric.help}')
+        lines.append(f'# TYPE {metric.name} {metric.kind}')
+        lines.extend(metric.samples())
+    return '\n'.join(lines) + '\n'
+
+
+def _request_stats():
+    """Per-request accumulator, or None outside of a request."""
+    if not has_request_context():
+        return None
+    return g.get('_sql_stats')
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = sql_timing.elapsed(context)
+    stats = _request_stats()
+    if elapsed is None or stats is None:
+        return
+    stats['statements'] += 1
+    stats['db_seconds'] += elapsed
+    stats['repeats'][statement] += 1
+
+
+def _on_load(target, context):
+    stats = _request_stats()
+    if stats is not None:
+        stats['rows'] += 1
+
+
+def _route():
+    return request.url_rule.rule if request.url_rule else 'unmatched'
+
+
+def _start_request():
+    g._request_started = time.perf_counter()
+    g._sql_stats = {'statements': 0, 'db_seconds': 0.0, 'rows': 0, 'repeats': defaultdict(int)}
+
+
+def _finish_request(response):
+    started = g.pop('_request_started', None)
+    stats = g.pop('_sql_stats', None)
+    if started is None or stats is None:
+        return response
+
+    labels = (request.method, _route())
+    REQUESTS.inc(request.method, labels[1], str(response.status_code))
+    LATENCY.observe(time.perf_counter() - started, *labels)
+    DB_TIME.observe(stats['db_seconds'], *labels)
+    STATEMENTS.observe(stats['statements'], *labels)
+    ROWS.observe(stats['rows'], *labels)
+    if response.content_length is not None:
+        RESPONSE_SIZE.observe(response.content_length, *labels)
+
+    threshold = current_app.config.get('N_PLUS_ONE_THRESHOLD', 10)
+    statement, repeats = max(stats['repeats'].items(), key=lambda item: item[1], default=(None, 0))
+    if threshold and repeats > threshold:
+        N_PLUS_ONE.inc(*labels)
+        current_app.logger.warning(
+            'Possible N+1 on %s %s: statement ran %s times (%s statements total): %s',
+            labels[0], labels[1], repeats, stats['statements'], ' '.join(statement.split())[:300]
+        )
+    return response
+
+
+def init_app(app):
+    sql_timing.install()
+    if not event.contains(Engine, 'after_cursor_execute', _after_cursor_execute):
+        event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+    if not event.contains(db.Model, 'load', _on_load):
+        event.listen(db.Model, 'load', _on_load, propagate=True)
+    app.before_request(_start_request)
+    app.after_request(_finish_request)
@@ -1,5 +1,5 @@
 from datetime import datetime
-from decimal import Decimal
+from decimal import Decimal, ROUND_HALF_UP
 
 from werkzeug.security import generate_password_hash, check_password_hash
 
@@ -19,10 +19,37 @@ def decimal_to_float(value, allow_none=False):
     return value
 
 
+def to_decimal(value):
+    if value is None:
+        return Decimal('0')
+    if isinstance(value, Decimal):
+        return value
+    return Decimal(str(value))
+
+
+def to_money(value):
+    """``value`` as a Decimal rounded half-up to cents."""
+    return to_decimal(value).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
+
+
 def to_iso(value):
     return value.isoformat() if value else None
 
 
+def derivative_url(file_url, variant='thumb'):
+    """URL of an image derivative for files held in storage, else None."""
+    if isinstance(file_url, str) and file_url.startswith('/api/files/'):
+        return f'{file_url}/{variant}'
+    return None
+
+
+def embed(obj, expanded=False):
+    """Full ``to_dict()`` of a related row when expanded, else its ``to_summary()``."""
+    if obj is None:
+        return None
+    return obj.to_dict() if expanded else obj.to_summary()
+
+
 class User(db.Model):
     """System users (admin, operators, HR, finance, etc.)."""
     __tablename__ = 'users'
@@ -136,6 +163,9 @@ class Agent(db.Model):
     def full_name(self):
         return f'{self.first_name} {self.last_name}'
 
+    def to_summary(self):
+        return {'id': self.id, 'name': self.full_name}
+
     def to_dict(self):
         return {
             'id': self.id,
@@ -374,6 +404,10 @@ class Site(db.Model):
 class Shift(db.Model):
     """Scheduled shifts (planning)."""
     __tablename__ = 'shifts'
+    __table_args__ = (
+        db.Index('ix_shifts_agent_date', 'agent_id', 'shift_date'),
+        db.Index('ix_shifts_site_date', 'site_id', 'shift_date'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     site_id = db.Column(db.Integer, db.ForeignKey('sites.id'), nullable=False, index=True)
@@ -393,7 +427,7 @@ class Shift(db.Model):
     operator_last_change_at = db.Column(db.DateTime)
     operator_last_change_reason = db.Column(db.Text)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
-    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, index=True)
 
     attendance = db.relationship('Attendance', backref='shift', uselist=False, lazy=True)
 
@@ -433,6 +467,10 @@ class Shift(db.Model):
 class Attendance(db.Model):
     """Actual attendance records."""
     __tablename__ = 'attendances'
+    __table_args__ = (
+        db.Index('ix_attendances_agent_date', 'agent_id', 'attendance_date'),
+        db.Index('ix_attendances_site_date', 'site_id', 'attendance_date'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     shift_id = db.Column(db.Integer, db.ForeignKey('shifts.id'), index=True)
@@ -476,7 +514,7 @@ class Attendance(db.Model):
     attendance_signature = db.Column(db.String(255))
     weather_condition = db.Column(db.String(50))
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
-    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, index=True)
 
     corrections = db.relationship('Correction', backref='attendance', lazy='dynamic')
 
@@ -501,12 +539,14 @@ class Attendance(db.Model):
             'clock_in_gps_lat': decimal_to_float(self.clock_in_gps_lat, allow_none=True),
             'clock_in_gps_lng': decimal_to_float(self.clock_in_gps_lng, allow_none=True),
             'clock_in_photo': self.clock_in_photo,
+            'clock_in_photo_thumb': derivative_url(self.clock_in_photo),
             'clock_in_verified': self.clock_in_verified,
             'clock_out_time': to_iso(self.clock_out_time),
             'clock_out_method': self.clock_out_method,
             'clock_out_gps_lat': decimal_to_float(self.clock_out_gps_lat, allow_none=True),
             'clock_out_gps_lng': decimal_to_float(self.clock_out_gps_lng, allow_none=True),
             'clock_out_photo': self.clock_out_photo,
+            'clock_out_photo_thumb': derivative_url(self.clock_out_photo),
             'clock_out_verified': self.clock_out_verified,
             'total_hours': decimal_to_float(self.total_hours),
             'regular_hours': decimal_to_float(self.regular_hours),
@@ -652,7 +692,7 @@ class Payroll(db.Model):
     payslip_url = db.Column(db.String(255))
     notes = db.Column(db.Text)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
-    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, index=True)
 
     def calculate_gross_pay(self):
         self.gross_regular_pay = decimal_to_float(self.total_regular_hours) * decimal_to_float(self.hourly_rate)
@@ -863,6 +903,7 @@ class Incident(db.Model):
             'client_notified_at': to_iso(self.client_notified_at),
             'witnesses': self.witnesses,
             'evidence_photos': self.evidence_photos,
+            'evidence_photo_thumbs': [derivative_url(url) for url in self.evidence_photos or []],
             'incident_status': self.incident_status,
             'resolved_by': self.resolved_by,
             'resolved_at': to_iso(self.resolved_at),
@@ -875,6 +916,14 @@ class Incident(db.Model):
 class Invoice(db.Model):
     """Client invoices."""
     __tablename__ = 'invoices'
+    __table_args__ = (
+        # Covers the AR aging report; only invoices with money outstanding are indexed
+        db.Index(
+            'ix_invoices_open_aging', 'client_id', 'due_date', 'balance_due', 'invoice_date', 'invoice_status',
+            postgresql_where=db.text('balance_due > 0'),
+            sqlite_where=db.text('balance_due > 0')
+        ),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     client_id = db.Column(db.Integer, db.ForeignKey('clients.id'), nullable=False, index=True)
@@ -903,22 +952,27 @@ class Invoice(db.Model):
 
     line_items = db.relationship('InvoiceLineItem', backref='invoice', lazy='dynamic', cascade='all, delete-orphan')
 
-    def calculate_totals(self):
-        self.subtotal = sum(decimal_to_float(item.line_total) for item in self.line_items)
-        self.tax_amount = decimal_to_float(self.subtotal) * (decimal_to_float(self.tax_rate) / 100)
-        self.discount_amount = decimal_to_float(self.subtotal) * (decimal_to_float(self.discount_percentage) / 100)
-        self.total_amount = decimal_to_float(self.subtotal) + decimal_to_float(self.tax_amount) - decimal_to_float(self.discount_amount)
-        self.balance_due = decimal_to_float(self.total_amount) - decimal_to_float(self.amount_paid)
+    def calculate_totals(self, items=None):
+        """Recompute totals in Decimal from ``items``, or from the stored line items if not given."""
+        if items is None:
+            items = list(self.line_items)
+        subtotal = to_money(sum((to_decimal(item.line_total) for item in items), Decimal('0')))
+        self.subtotal = subtotal
+        self.tax_amount = to_money(subtotal * to_decimal(self.tax_rate) / 100)
+        self.discount_amount = to_money(subtotal * to_decimal(self.discount_percentage) / 100)
+        self.total_amount = subtotal + self.tax_amount - self.discount_amount
+        self.balance_due = self.total_amount - to_money(self.amount_paid)
         return self.total_amount
 
     def mark_as_sent(self):
         self.invoice_status = 'sent'
         self.sent_at = datetime.utcnow()
+        self.invoice_pdf_url = f'/api/invoices/{self.id}/pdf'
         return True
 
     def record_payment(self, amount):
-        self.amount_paid = decimal_to_float(self.amount_paid) + float(amount)
-        self.balance_due = decimal_to_float(self.total_amount) - decimal_to_float(self.amount_paid)
+        self.amount_paid = to_money(self.amount_paid) + to_money(amount)
+        self.balance_due = to_money(self.total_amount) - self.amount_paid
         if self.balance_due <= 0:
             self.invoice_status = 'paid'
             self.paid_at = datetime.utcnow()
@@ -993,6 +1047,9 @@ class Training(db.Model):
     description = db.Column(db.Text)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
+    def to_summary(self):
+        return {'id': self.id, 'name': self.training_name}
+
     def to_dict(self):
         return {
             'id': self.id,
@@ -1019,8 +1076,9 @@ class AgentTraining(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
     training = db.relationship('Training')
+    agent = db.relationship('Agent')
 
-    def to_dict(self):
+    def to_dict(self, expand=()):
         return {
             'id': self.id,
             'agent_id': self.agent_id,
@@ -1030,7 +1088,8 @@ class AgentTraining(db.Model):
             'score': decimal_to_float(self.score),
             'certificate_url': self.certificate_url,
             'created_at': to_iso(self.created_at),
-            'training': self.training.to_dict() if self.training else None
+            'training': embed(self.training, 'training' in expand),
+            'agent': embed(self.agent, 'agent' in expand)
         }
 
 
@@ -1051,6 +1110,9 @@ class Equipment(db.Model):
 
     assignments = db.relationship('EquipmentAssignment', backref='equipment', lazy='dynamic')
 
+    def to_summary(self):
+        return {'id': self.id, 'name': self.equipment_name}
+
     def to_dict(self):
         return {
             'id': self.id,
@@ -1082,7 +1144,7 @@ class EquipmentAssignment(db.Model):
 
     agent = db.relationship('Agent')
 
-    def to_dict(self):
+    def to_dict(self, expand=()):
         return {
             'id': self.id,
             'equipment_id': self.equipment_id,
@@ -1093,8 +1155,8 @@ class EquipmentAssignment(db.Model):
             'return_condition': self.return_condition,
             'assigned_by': self.assigned_by,
             'created_at': to_iso(self.created_at),
-            'equipment': self.equipment.to_dict() if self.equipment else None,
-            'agent': self.agent.to_dict() if self.agent else None
+            'equipment': embed(self.equipment, 'equipment' in expand),
+            'agent': embed(self.agent, 'agent' in expand)
         }
 
 
@@ -1143,6 +1205,9 @@ class Document(db.Model):
 class Notification(db.Model):
     """System notifications."""
     __tablename__ = 'notifications'
+    __table_args__ = (
+        db.Index('ix_notifications_user_expires', 'user_id', 'expires_at'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'))
@@ -1155,9 +1220,15 @@ class Notification(db.Model):
     read_at = db.Column(db.DateTime)
     action_url = db.Column(db.String(255))
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
-    expires_at = db.Column(db.DateTime)
+    expires_at = db.Column(db.DateTime, index=True)
 
-    def to_dict(self):
+    @classmethod
+    def active_clause(cls, now=None):
+        """SQL condition excluding notifications past their ``expires_at``."""
+        now = now or datetime.utcnow()
+        return db.or_(cls.expires_at.is_(None), cls.expires_at > now)
+
+    def to_dict(self, is_read=None):
         return {
             'id': self.id,
             'user_id': self.user_id,
@@ -1166,9 +1237,408 @@ class Notification(db.Model):
             'title': self.title,
             'message': self.message,
             'priority': self.priority,
-            'is_read': self.is_read,
+            'is_read': self.is_read if is_read is None else is_read,
             'read_at': to_iso(self.read_at),
             'action_url': self.action_url,
             'created_at': to_iso(self.created_at),
             'expires_at': to_iso(self.expires_at)
         }
+
+
+class NotificationReceipt(db.Model):
+    """Per-user read receipts for broadcast notifications."""
+    __tablename__ = 'notification_receipts'
+    __table_args__ = (
+        db.UniqueConstraint('notification_id', 'user_id', name='uq_notification_receipt'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    notification_id = db.Column(db.Integer, db.ForeignKey('notifications.id', ondelete='CASCADE'), nullable=False, index=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False, index=True)
+    read_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+
+class NotificationState(db.Model):
+    """Per-user unread counter and broadcast read watermark.
+
+    Broadcasts with an id at or below ``read_watermark`` count as read for the
+    user. Rows are created lazily from a full count the first time a user's
+    badge is requested, then kept up to date by the notification routes.
+    """
+    __tablename__ = 'notification_states'
+
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), primary_key=True)
+    unread_count = db.Column(db.Integer, nullable=False, default=0)
+    read_watermark = db.Column(db.Integer, nullable=False, default=0)
+    counted_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    @staticmethod
+    def broadcast_read_clause(user_id, watermark=None):
+        """SQL condition that is true when a broadcast is read for ``user_id``."""
+        receipt = db.exists().where(
+            NotificationReceipt.notification_id == Notification.id,
+            NotificationReceipt.user_id == user_id
+        )
+        if watermark is None:
+            watermark = db.select(NotificationState.read_watermark).where(
+                NotificationState.user_id == user_id
+            ).scalar_subquery()
+        return db.or_(Notification.id <= db.func.coalesce(watermark, 0), receipt)
+
+    @classmethod
+    def unread_clause(cls, user_id, watermark=None):
+        """SQL condition selecting notifications still unread for ``user_id``."""
+        return db.or_(
+            db.and_(Notification.user_id == user_id, Notification.is_read.isnot(True)),
+            db.and_(Notification.user_id.is_(None), db.not_(cls.broadcast_read_clause(user_id, watermark)))
+        )
+
+    @classmethod
+    def for_user(cls, user_id):
+        state = db.session.get(cls, user_id)
+        if state is None:
+            now = datetime.utcnow()
+            state = cls(user_id=user_id, read_watermark=0, counted_at=now)
+            state.unread_count = Notification.query.filter(
+                cls.unread_clause(user_id, watermark=0), Notification.active_clause(now)
+            ).count()
+            db.session.add(state)
+            db.session.flush()
+        return state
+
+    @classmethod
+    def adjust(cls, delta, user_id=None, *criteria):
+        """Shift the counter of one user, or of every tracked user when ``user_id`` is None."""
+        new_count = cls.unread_count + delta
+        stmt = db.update(cls).values(unread_count=db.case((new_count < 0, 0), else_=new_count))
+        if user_id is not None:
+            stmt = stmt.where(cls.user_id == user_id)
+        if criteria:
+            stmt = stmt.where(*criteria)
+        db.session.execute(stmt)
+
+
+class ArchivedRecord(db.Model):
+    """Rows moved out of operational tables by the retention job."""
+    __tablename__ = 'archived_records'
+    __table_args__ = (
+        db.Index('ix_archived_records_table_record', 'table_name', 'record_id'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    table_name = db.Column(db.String(100), nullable=False)
+    record_id = db.Column(db.Integer, nullable=False)
+    policy = db.Column(db.String(100))
+    payload = db.Column(JSON)
+    archived_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'table_name': self.table_name,
+            'record_id': self.record_id,
+            'policy': self.policy,
+            'payload': self.payload,
+            'archived_at': to_iso(self.archived_at)
+        }
+
+
+class StoredFile(db.Model):
+    """Content-addressed file kept by the storage backend."""
+    __tablename__ = 'stored_files'
+
+    id = db.Column(db.Integer, primary_key=True)
+    sha256 = db.Column(db.String(64), unique=True, nullable=False, index=True)
+    size_bytes = db.Column(db.BigInteger, nullable=False)
+    mime_type = db.Column(db.String(100))
+    original_name = db.Column(db.String(255))
+    storage_backend = db.Column(db.String(20), default='local')
+    created_by = db.Column(db.Integer, db.ForeignKey('users.id'))
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    @property
+    def url(self):
+        return f'/api/files/{self.sha256}'
+
+    @property
+    def size_kb(self):
+        return (self.size_bytes + 1023) // 1024
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'sha256': self.sha256,
+            'url': self.url,
+            'size_bytes': self.size_bytes,
+            'mime_type': self.mime_type,
+            'original_name': self.original_name,
+            'storage_backend': self.storage_backend,
+            'created_by': self.created_by,
+            'created_at': to_iso(self.created_at)
+        }
+
+
+class AuditLog(db.Model):
+    """Append-only column-level change history written by ``app.audit``."""
+    __tablename__ = 'audit_log'
+    __table_args__ = (
+        db.Index('ix_audit_log_entity', 'entity_type', 'entity_id', 'created_at'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    entity_type = db.Column(db.String(50), nullable=False)
+    entity_id = db.Column(db.Integer, nullable=False)
+    action = db.Column(db.String(10), nullable=False)
+    changes = db.Column(JSON)
+    user_id = db.Column(db.Integer, index=True)
+    endpoint = db.Column(db.String(255))
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'entity_type': self.entity_type,
+            'entity_id': self.entity_id,
+            'action': self.action,
+            'changes': self.changes,
+            'user_id': self.user_id,
+            'endpoint': self.endpoint,
+            'created_at': to_iso(self.created_at)
+        }
+
+
+class LedgerEntry(db.Model):
+    """Receivable postings per client, maintained by ``app.ledger``."""
+    __tablename__ = 'ledger_entries'
+    __table_args__ = (
+        db.Index('ix_ledger_entries_client', 'client_id', 'id'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    client_id = db.Column(db.Integer, db.ForeignKey('clients.id'), nullable=False)
+    invoice_id = db.Column(db.Integer, db.ForeignKey('invoices.id', ondelete='SET NULL'), index=True)
+    entry_type = db.Column(db.String(20), nullable=False)  # invoice, payment, adjustment
+    invoiced_delta = db.Column(db.Numeric(12, 2), nullable=False, default=0)
+    paid_delta = db.Column(db.Numeric(12, 2), nullable=False, default=0)
+    description = db.Column(db.String(255))
+    created_by = db.Column(db.Integer, db.ForeignKey('users.id'))
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    invoice = db.relationship('Invoice', backref=db.backref('ledger_entries', lazy='dynamic'))
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'client_id': self.client_id,
+            'invoice_id': self.invoice_id,
+            'entry_type': self.entry_type,
+            'invoiced_delta': decimal_to_float(self.invoiced_delta),
+            'paid_delta': decimal_to_float(self.paid_delta),
+            'balance_delta': decimal_to_float(self.invoiced_delta) - decimal_to_float(self.paid_delta),
+            'description': self.description,
+            'created_by': self.created_by,
+            'created_at': to_iso(self.created_at)
+        }
+
+
+class PunctualityRollup(db.Model):
+    """Attendance lateness totals per day, site and clock-in hour, maintained by ``app.analytics``."""
+    __tablename__ = 'punctuality_rollups'
+    __table_args__ = (
+        db.Index('ix_punctuality_rollups_date_site', 'attendance_date', 'site_id'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    attendance_date = db.Column(db.Date, nullable=False)
+    site_id = db.Column(db.Integer, db.ForeignKey('sites.id', ondelete='CASCADE'), nullable=False, index=True)
+    weekday = db.Column(db.SmallInteger, nullable=False)  # 0 = Sunday
+    hour = db.Column(db.SmallInteger)  # hour of clock-in, else of the scheduled start
+    attendances = db.Column(db.Integer, nullable=False, default=0)
+    absent_count = db.Column(db.Integer, nullable=False, default=0)
+    late_count = db.Column(db.Integer, nullable=False, default=0)
+    late_minutes = db.Column(db.Integer, nullable=False, default=0)
+    early_departure_count = db.Column(db.Integer, nullable=False, default=0)
+    early_departure_minutes = db.Column(db.Integer, nullable=False, default=0)
+
+
+class PunctualityDirtyDay(db.Model):
+    """A day and site whose rollup must be recomputed; written in the same flush as the attendance."""
+    __tablename__ = 'punctuality_dirty_days'
+
+    id = db.Column(db.Integer, primary_key=True)
+    attendance_date = db.Column(db.Date, nullable=False)
+    site_id = db.Column(db.Integer, nullable=False)
+
+
+class IdempotencyKey(db.Model):
+    """Stored outcome of a mutating request sent with an ``Idempotency-Key`` header."""
+    __tablename__ = 'idempotency_keys'
+    __table_args__ = (
+        db.UniqueConstraint('scope', 'key', name='uq_idempotency_keys_scope_key'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    scope = db.Column(db.String(64), nullable=False)  # user:<id> or anonymous
+    key = db.Column(db.String(255), nullable=False)
+    fingerprint = db.Column(db.String(64), nullable=False)
+    method = db.Column(db.String(10), nullable=False)
+    path = db.Column(db.String(255), nullable=False)
+    status = db.Column(db.String(20), nullable=False, default='processing')  # processing, completed
+    response_status = db.Column(db.Integer)
+    response_headers = db.Column(JSON)
+    response_body = db.Column(db.LargeBinary)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'scope': self.scope,
+            'key': self.key,
+            'method': self.method,
+            'path': self.path,
+            'status': self.status,
+            'response_status': self.response_status,
+            'created_at': to_iso(self.created_at),
+            'expires_at': to_iso(self.expires_at)
+        }
+
+
+class Job(db.Model):
+    """Background job run by ``flask jobs worker`` processes, see ``app.jobs``."""
+    __tablename__ = 'jobs'
+    __table_args__ = (
+        db.Index('ix_jobs_queue', 'status', 'run_after', 'priority'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    job_type = db.Column(db.String(100), nullable=False, index=True)
+    payload = db.Column(JSON)
+    status = db.Column(db.String(20), nullable=False, default='queued')  # queued, running, succeeded, failed, cancelled
+    priority = db.Column(db.Integer, nullable=False, default=0)  # lower runs first
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    max_attempts = db.Column(db.Integer, nullable=False, default=3)
+    run_after = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    cancel_requested = db.Column(db.Boolean, nullable=False, default=False)
+    progress_current = db.Column(db.Integer)
+    progress_total = db.Column(db.Integer)
+    progress_message = db.Column(db.String(255))
+    result = db.Column(JSON)
+    error = db.Column(db.Text)
+    worker_id = db.Column(db.String(100))
+    heartbeat_at = db.Column(db.DateTime)
+    created_by = db.Column(db.Integer, db.ForeignKey('users.id'))
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+
+    def to_dict(self):
+        progress = None
+        if self.progress_total:
+            progress = round(min((self.progress_current or 0) / self.progress_total, 1.0), 4)
+        return {
+            'id': self.id,
+            'job_type': self.job_type,
+            'payload': self.payload,
+            'status': self.status,
+            'priority': self.priority,
+            'attempts': self.attempts,
+            'max_attempts': self.max_attempts,
+            'run_after': to_iso(self.run_after),
+            'cancel_requested': self.cancel_requested,
+            'progress': progress,
+            'progress_current': self.progress_current,
+            'progress_total': self.progress_total,
+            'progress_message': self.progress_message,
+            'result': self.result,
+            'error': self.error,
+            'worker_id': self.worker_id,
+            'created_by': self.created_by,
+            'created_at': to_iso(self.created_at),
+            'started_at': to_iso(self.started_at),
+            'finished_at': to_iso(self.finished_at)
+        }
+
+
+class ScheduledTask(db.Model):
+    """Schedule state of a periodic task registered with ``app.scheduler``."""
+    __tablename__ = 'scheduled_tasks'
+
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(100), unique=True, nullable=False)
+    cron = db.Column(db.String(100), nullable=False)
+    next_run_at = db.Column(db.DateTime, nullable=False)
+    covered_until = db.Column(db.DateTime)  # scheduled time of the last successful run
+    last_run_at = db.Column(db.DateTime)
+    last_status = db.Column(db.String(20))
+    last_duration_ms = db.Column(db.Float)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'name': self.name,
+            'cron': self.cron,
+            'next_run_at': to_iso(self.next_run_at),
+            'covered_until': to_iso(self.covered_until),
+            'last_run_at': to_iso(self.last_run_at),
+            'last_status': self.last_status,
+            'last_duration_ms': self.last_duration_ms,
+            'updated_at': to_iso(self.updated_at)
+        }
+
+
+class ScheduledRun(db.Model):
+    """One run, or one alert about missed ticks, of a periodic task."""
+    __tablename__ = 'scheduled_runs'
+    __table_args__ = (
+        db.Index('ix_scheduled_runs_task_started', 'task_name', 'started_at'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    task_name = db.Column(db.String(100), nullable=False)
+    scheduled_for = db.Column(db.DateTime, nullable=False)
+    status = db.Column(db.String(20), nullable=False, default='running')  # running, succeeded, failed, missed
+    missed_ticks = db.Column(db.Integer, nullable=False, default=0)
+    trigger = db.Column(db.String(20), nullable=False, default='schedule')  # schedule, manual
+    runner = db.Column(db.String(100))
+    result = db.Column(JSON)
+    error = db.Column(db.Text)
+    started_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+    finished_at = db.Column(db.DateTime)
+    duration_ms = db.Column(db.Float)
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'task_name': self.task_name,
+            'scheduled_for': to_iso(self.scheduled_for),
+            'status': self.status,
+            'missed_ticks': self.missed_ticks,
+            'trigger': self.trigger,
+            'runner': self.runner,
+            'result': self.result,
+            'error': self.error,
+            'started_at': to_iso(self.started_at),
+            'finished_at': to_iso(self.finished_at),
+            'duration_ms': self.duration_ms
+        }
+
+
+class SchedulerLease(db.Model):
+    """Time-limited lease naming the one process that runs scheduled ticks."""
+    __tablename__ = 'scheduler_leases'
+
+    name = db.Column(db.String(50), primary_key=True)
+    holder = db.Column(db.String(100), nullable=False)
+    acquired_at = db.Column(db.DateTime, nullable=False)
+    expires_at = db.Column(db.DateTime, nullable=False)
+
+    def to_dict(self):
+        return {
+            'name': self.name,
+            'holder': self.holder,
+            'acquired_at': to_iso(self.acquired_at),
+            'expires_at': to_iso(self.expires_at)
+        }
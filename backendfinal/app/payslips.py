@@ -0,0 +1,223 @@
+"""Batch payslip generation.
+
+``generate`` renders a PDF payslip for every approved or paid ``Payroll`` in
+a period that does not have one yet. Payrolls are read in keyset chunks,
+joined with just the agent columns printed on the slip. Each chunk is
+rendered in a process pool while the previous chunk is being stored, so
+rendering and I/O overlap. Files go through ``app.storage``, and the
+chunk's ``payslip_generated`` / ``payslip_url`` are set with one bulk UPDATE
+and committed. An interrupted run therefore loses at most one chunk, and
+running it again picks up where it stopped. The bulk UPDATEs skip the
+flush hooks, so their changes are handed to the audit trail directly.
+"""
+import io
+import os
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+from flask import current_app
+from sqlalchemy import or_, update
+
+from app import agent_overview, audit, db, pdf, storage
+from app.models import Agent, Payroll, to_iso, to_money
+from app.pdf import MARGIN
+
+PAYSLIP_STATUSES = ('approved', 'paid')
+
+_PAYROLL_COLUMNS = (
+    Payroll.id, Payroll.agent_id, Payroll.pay_period_start, Payroll.pay_period_end, Payroll.payment_date,
+    Payroll.total_regular_hours, Payroll.total_overtime_hours, Payroll.total_night_shift_hours,
+    Payroll.total_holiday_hours, Payroll.hourly_rate, Payroll.gross_regular_pay, Payroll.gross_overtime_pay,
+    Payroll.gross_night_shift_pay, Payroll.gross_holiday_pay, Payroll.gross_total, Payroll.bonus_amount,
+    Payroll.bonus_description, Payroll.allowances, Payroll.allowances_description, Payroll.deduction_tax,
+    Payroll.deduction_social_security, Payroll.deduction_insurance, Payroll.deduction_uniform,
+    Payroll.deduction_loan, Payroll.deduction_other, Payroll.deduction_other_description,
+    Payroll.total_deductions, Payroll.net_pay, Payroll.payment_method,
+)
+_AGENT_COLUMNS = (
+    Agent.employee_code, Agent.first_name, Agent.last_name, Agent.bank_name,
+    Agent.bank_account_number, Agent.tax_id,
+)
+
+
+def document(row, company):
+    """Everything printed on one payslip, from a row of ``_PAYROLL_COLUMNS + _AGENT_COLUMNS``."""
+    data = row._asdict()
+    money = {key: str(to_money(data[key])) for key in (
+        'hourly_rate', 'gross_regular_pay', 'gross_overtime_pay', 'gross_night_shift_pay', 'gross_holiday_pay',
+        'gross_total', 'bonus_amount', 'allowances', 'deduction_tax', 'deduction_social_security',
+        'deduction_insurance', 'deduction_uniform', 'deduction_loan', 'deduction_other', 'total_deductions',
+        'net_pay')}
+    hours = {key: str(to_money(data[key])) for key in (
+        'total_regular_hours', 'total_overtime_hours', 'total_night_shift_hours', 'total_holiday_hours')}
+    account = data['bank_account_number'] or ''
+    return {
+        'company': company,
+        'payroll_id': data['id'],
+        'agent_id': data['agent_id'],
+        'employee_code': data['employee_code'],
+        'agent_name': f"{data['first_name']} {data['last_name']}",
+        'tax_id': data['tax_id'],
+        'bank_name': data['bank_name'],
+        'bank_account': f'****{account[-4:]}' if account else None,
+        'pay_period_start': to_iso(data['pay_period_start']),
+        'pay_period_end': to_iso(data['pay_period_end']),
+        'payment_date': to_iso(data['payment_date']),
+        'payment_method': data['payment_method'],
+        'bonus_description': data['bonus_description'],
+        'allowances_description': data['allowances_description'],
+        'deduction_other_description': data['deduction_other_description'],
+        **money,
+        **hours,
+    }
+
+
+def _lines(doc):
+    rows = [('F2', 18, MARGIN, doc['company']), None,
+            ('F2', 14, MARGIN, 'Payslip'),
+            ('F1', 10, MARGIN, f"Period: {doc['pay_period_start']} - {doc['pay_period_end']}")]
+    if doc['payment_date']:
+        rows.append(('F1', 10, MARGIN, f"Payment date: {doc['payment_date']}"))
+    rows.append(None)
+
+    rows.append(('F2', 11, MARGIN, doc['agent_name']))
+    rows.append(('F1', 10, MARGIN, f"Employee code: {doc['employee_code']}"))
+    if doc['tax_id']:
+        rows.append(('F1', 10, MARGIN, f"Tax ID: {doc['tax_id']}"))
+    if doc['payment_method'] or doc['bank_account']:
+        bank = ' '.join(part for part in (doc['bank_name'], doc['bank_account']) if part)
+        rows.append(('F1', 10, MARGIN, f"Paid by: {' / '.join(p for p in (doc['payment_method'], bank) if p)}"))
+    rows.append(None)
+
+    rows.append(('F4', 9, MARGIN, f"{'Earnings':<40}{'Hours':>12}{'Rate':>12}{'Amount':>14}"))
+    for label, hours_key, amount_key in (('Regular', 'total_regular_hours', 'gross_regular_pay'),
+                                         ('Overtime', 'total_overtime_hours', 'gross_overtime_pay'),
+                                         ('Night shift', 'total_night_shift_hours', 'gross_night_shift_pay'),
+                                         ('Holiday', 'total_holiday_hours', 'gross_holiday_pay')):
+        rate = doc['hourly_rate'] if label == 'Regular' else ''
+        rows.append(('F3', 9, MARGIN, f"{label:<40}{doc[hours_key]:>12}{rate:>12}{doc[amount_key]:>14}"))
+    for label, key, note in (('Bonus', 'bonus_amount', 'bonus_description'),
+                             ('Allowances', 'allowances', 'allowances_description')):
+        if to_money(doc[key]):
+            text = f'{label} ({doc[note]})' if doc[note] else label
+            rows.append(('F3', 9, MARGIN, f"{text[:40]:<40}{'':>24}{doc[key]:>14}"))
+    rows.append(('F4', 9, MARGIN, f"{'Gross pay':<64}{doc['gross_total']:>14}"))
+    rows.append(None)
+
+    rows.append(('F4', 9, MARGIN, f"{'Deductions':<64}{'Amount':>14}"))
+    for label, key in (('Tax', 'deduction_tax'), ('Social security', 'deduction_social_security'),
+                       ('Insurance', 'deduction_insurance'), ('Uniform', 'deduction_uniform'),
+                       ('Loan', 'deduction_loan'), ('Other', 'deduction_other')):
+        if to_money(doc[key]):
+            if key == 'deduction_other' and doc['deduction_other_description']:
+                label = f"Other ({doc['deduction_other_description']})"
+            rows.append(('F3', 9, MARGIN, f'{label[:64]:<64}{doc[key]:>14}'))
+    rows.append(('F4', 9, MARGIN, f"{'Total deductions':<64}{doc['total_deductions']:>14}"))
+    rows.append(None)
+    rows.append(('F4', 11, MARGIN, f"{'Net pay':<56}{doc['net_pay']:>14}"))
+    return rows
+
+
+def render(doc):
+    """PDF bytes of one payslip; runs inside a pool worker."""
+    return pdf.build(_lines(doc))
+
+
+def _filename(doc):
+    return f"payslip-{doc['employee_code']}-{doc['pay_period_start']}-{doc['pay_period_end']}.pdf"
+
+
+def _period_filter(query, period_start, period_end):
+    return query.filter(
+        Payroll.payment_status.in_(PAYSLIP_STATUSES),
+        Payroll.pay_period_start >= period_start,
+        Payroll.pay_period_end <= period_end
+    )
+
+
+def _chunks(period_start, period_end, chunk_size):
+    """Pending payrolls in id order, ``chunk_size`` rows per query."""
+    last_id = 0
+    while True:
+        rows = _period_filter(
+            db.session.query(*_PAYROLL_COLUMNS, *_AGENT_COLUMNS).join(Agent, Agent.id == Payroll.agent_id),
+            period_start, period_end
+        ).filter(
+            Payroll.id > last_id,
+            or_(Payroll.payslip_generated.is_(None), Payroll.payslip_generated.is_(False))
+        ).order_by(Payroll.id).limit(chunk_size).all()
+        if not rows:
+            return
+        last_id = rows[-1].id
+        yield rows
+
+
+def _flags(query):
+    return query.with_entities(Payroll.id, Payroll.payslip_generated, Payroll.payslip_url).all()
+
+
+def _audit(before, new_values):
+    """Record payslip flag changes of ``before`` rows when payrolls are audited."""
+    audit.record_updates(db.session, 'payrolls', {
+        payroll_id: {
+            name: (old, new_values[payroll_id][name])
+            for name, old in (('payslip_generated', generated), ('payslip_url', url))
+            if old != new_values[payroll_id][name]
+        }
+        for payroll_id, generated, url in before
+    })
+
+
+def _store(docs, futures):
+    """Store one rendered chunk and mark its payrolls in a single UPDATE."""
+    values = []
+    now = datetime.utcnow()
+    for doc, future in zip(docs, futures):
+        stored = storage.save_stream(io.BytesIO(future.result()), filename=_filename(doc),
+                                     declared_type='application/pdf')
+        values.append({'id': doc['payroll_id'], 'payslip_generated': True,
+                       'payslip_url': stored.url, 'updated_at': now})
+    if audit.is_audited('payrolls'):
+        _audit(_flags(Payroll.query.filter(Payroll.id.in_([value['id'] for value in values]))),
+               {value['id']: value for value in values})
+    db.session.execute(update(Payroll), values)
+    db.session.commit()
+    # The bulk UPDATE skips flush hooks, so drop cached overviews here
+    agent_overview.invalidate(*{doc['agent_id'] for doc in docs})
+    return len(values)
+
+
+def generate(period_start, period_end, chunk_size=200, workers=None, force=False, progress=None):
+    """Render and store missing payslips for the period; returns how many were written.
+
+    ``force`` clears the flags of the period first so every payslip is
+    rendered again. ``progress`` is called with the running count after
+    each chunk.
+    """
+    if force:
+        if audit.is_audited('payrolls'):
+            cleared = {'payslip_generated': False, 'payslip_url': None}
+            before = _flags(_period_filter(Payroll.query, period_start, period_end))
+            _audit(before, {payroll_id: cleared for payroll_id, _, _ in before})
+        _period_filter(Payroll.query, period_start, period_end).update(
+            {'payslip_generated': False, 'payslip_url': None}, synchronize_session=False
+        )
+        db.session.commit()
+
+    company = current_app.config.get('COMPANY_NAME', 'Dashflow')
+    written = 0
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count()) as pool:
+        pending = None
+        for rows in _chunks(period_start, period_end, chunk_size):
+            docs = [document(row, company) for row in rows]
+            futures = [pool.submit(render, doc) for doc in docs]
+            if pending is not None:
+                written += _store(*pending)
+                if progress:
+                    progress(written)
+            pending = (docs, futures)
+        if pending is not None:
+            written += _store(*pending)
+            if progress:
+                progress(written)
+    return written
@@ -0,0 +1,65 @@
+"""Minimal PDF writer for text documents.
+
+Writes PDF 1.4 with the standard base-14 fonts, so it needs no font files
+and no third-party dependency. It only handles lines of text, which is all
+invoices and payslips need. Rows are plain tuples so documents can be built
+in a pool worker.
+"""
+PAGE_WIDTH, PAGE_HEIGHT = 595, 842  # A4 in points
+MARGIN = 50
+LINE_HEIGHT = 14
+
+# Proportional regular/bold for headings, monospaced for aligned tables
+FONTS = {'F1': 'Helvetica', 'F2': 'Helvetica-Bold', 'F3': 'Courier', 'F4': 'Courier-Bold'}
+
+
+def _escape(text):
+    text = str(text).replace('\\', '\\\\').replace('(', '\\(').replace(')', '\\)')
+    return text.encode('cp1252', errors='replace').decode('latin-1')
+
+
+def build(rows):
+    """Lay ``rows`` out top to bottom over as many pages as needed and return the PDF bytes.
+
+    Each row is ``(font, size, x, text)`` with font one of ``FONTS``, or None
+    for a blank line.
+    """
+    per_page = (PAGE_HEIGHT - 2 * MARGIN) // LINE_HEIGHT
+    pages = [rows[i:i + per_page] for i in range(0, len(rows), per_page)] or [[]]
+
+    objects = [b'<< /Type /Catalog /Pages 2 0 R >>', None]
+    font_ids = {}
+    for name, base in FONTS.items():
+        objects.append(f'<< /Type /Font /Subtype /Type1 /BaseFont /{base} /Encoding /WinAnsiEncoding >>'.encode())
+        font_ids[name] = len(objects)
+    resources = ' '.join(f'/{name} {object_id} 0 R' for name, object_id in font_ids.items())
+
+    page_ids = []
+    for number, page in enumerate(pages, start=1):
+        commands = []
+        y = PAGE_HEIGHT - MARGIN
+        for row in page:
+            if row is not None:
+                font, size, x, text = row
+                commands.append(f'BT /{font} {size} Tf {x} {y} Td ({_escape(text)}) Tj ET')
+            y -= LINE_HEIGHT
+        commands.append(f'BT /F1 8 Tf {PAGE_WIDTH - MARGIN - 60} {MARGIN / 2} Td '
+                        f'(Page {number} of {len(pages)}) Tj ET')
+        stream = '\n'.join(commands).encode('latin-1')
+        objects.append(b'<< /Length %d >>\nstream\n' % len(stream) + stream + b'\nendstream')
+        objects.append((f'<< /Type /Page /Parent 2 0 R /MediaBox [0 0 {PAGE_WIDTH} {PAGE_HEIGHT}] '
+                        f'/Resources << /Font << {resources} >> >> /Contents {len(objects)} 0 R >>').encode())
+        page_ids.append(len(objects))
+    kids = ' '.join(f'{page_id} 0 R' for page_id in page_ids)
+    objects[1] = f'<< /Type /Pages /Kids [{kids}] /Count {len(page_ids)} >>'.encode()
+
+    out = bytearray(b'%PDF-1.4\n%\xe2\xe3\xcf\xd3\n')
+    offsets = []
+    for object_id, body in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += b'%d 0 obj\n' % object_id + body + b'\nendobj\n'
+    xref = len(out)
+    out += b'xref\n0 %d\n0000000000 65535 f \n' % (len(objects) + 1)
+    out += b''.join(b'%010d 00000 n \n' % offset for offset in offsets)
+    out += b'trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n' % (len(objects) + 1, xref)
+    return bytes(out)
@@ -0,0 +1,194 @@
+"""On-demand request profiling.
+
+Disabled unless ``PROFILING_ENABLED`` is set, in which case no hook is even
+registered. When enabled, a request is profiled if an admin sends an
+``X-Profile`` header or if it falls within ``PROFILE_SAMPLE_RATE``.
+
+- ``X-Profile: cprofile`` (or any truthy value) runs the deterministic
+  profiler and writes a ``.pstats`` file.
+- ``X-Profile: sample`` runs a wall-clock stack sampler and writes a
+  speedscope JSON file.
+- ``X-Profile-Memory: 1`` adds a ``tracemalloc`` allocation diff.
+
+The file name is returned in the ``X-Profile-Id`` response header and the
+files are listed by ``/api/admin/profiles``.
+"""
+import cProfile
+import json
+import os
+import random
+import re
+import sys
+import threading
+import time
+import tracemalloc
+import uuid
+from datetime import datetime
+
+from flask import current_app, g, request
+from flask_jwt_extended import get_jwt_identity, verify_jwt_in_request
+
+from app import db
+
+_SLUG = re.compile(r'[^a-zA-Z0-9]+')
+
+
+class StackSampler:
+    """Samples one thread's Python stack on a timer, speedscope style."""
+
+    def __init__(self, thread_id, interval):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.frames = []
+        self._frame_index = {}
+        self.samples = []
+        self.weights = []
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='profile-sampler', daemon=True)
+
+    def _index(self, code, line):
+        key = (code.co_name, code.co_filename, line)
+        index = self._frame_index.get(key)
+        if index is None:
+            index = self._frame_index[key] = len(self.frames)
+            self.frames.append({'name': code.co_name, 'file': code.co_filename, 'line': line})
+        return index
+
+    def _run(self):
+        last = time.perf_counter()
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            now = time.perf_counter()
+            stack = []
+            while frame is not None:
+                stack.append(self._index(frame.f_code, frame.f_lineno))
+                frame = frame.f_back
+            if stack:
+                self.samples.append(stack[::-1])
+                self.weights.append(now - last)
+            last = now
+
+    def start(self):
+        self.started = time.perf_counter()
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        self.duration = time.perf_counter() - self.started
+
+    def to_speedscope(self, name):
+        return {
+            '$schema': 'https://www.speedscope.app/file-format-schema.json',
+            'name': name,
+            'exporter': 'ccss-ops',
+            'shared': {'frames': self.frames},
+            'profiles': [{
+                'type': 'sampled',
+                'name': name,
+                'unit': 'seconds',
+                'startValue': 0,
+                'endValue': self.duration,
+                'samples': self.samples,
+                'weights': self.weights,
+            }],
+        }
+
+
+def _requested_mode():
+    """Profiler to run for this request, or None."""
+    header = request.headers.get('X-Profile')
+    if header:
+        try:
+            verify_jwt_in_request(optional=True)
+        except Exception:
+            return None
+        from app.models import User
+        user_id = get_jwt_identity()
+        user = db.session.get(User, user_id) if user_id else None
+        if not user or user.role != 'admin':
+            return None
+        return 'sample' if header.lower() == 'sample' else 'cprofile'
+
+    rate = current_app.config.get('PROFILE_SAMPLE_RATE', 0)
+    if rate and random.random() < rate:
+        return 'cprofile'
+    return None
+
+
+def _start():
+    mode = _requested_mode()
+    if mode is None:
+        return
+
+    session = {'mode': mode, 'started_at': datetime.utcnow()}
+    if request.headers.get('X-Profile-Memory') and request.headers.get('X-Profile'):
+        session['tracemalloc_owner'] = not tracemalloc.is_tracing()
+        if session['tracemalloc_owner']:
+            tracemalloc.start(25)
+        session['snapshot'] = tracemalloc.take_snapshot()
+
+    if mode == 'sample':
+        sampler = StackSampler(threading.get_ident(), current_app.config.get('PROFILE_SAMPLE_INTERVAL', 0.001))
+        sampler.start()
+        session['profiler'] = sampler
+    else:
+        profiler = cProfile.Profile()
+        profiler.enable()
+        session['profiler'] = profiler
+    g._profile = session
+
+
+def _prune(directory, keep):
+    entries = sorted(
+        (entry for entry in os.scandir(directory) if entry.is_file()),
+        key=lambda entry: entry.stat().st_mtime
+    )
+    for entry in entries[:max(len(entries) - keep, 0)]:
+        os.remove(entry.path)
+
+
+def _finish(response):
+    session = g.pop('_profile', None)
+    if session is None:
+        return response
+
+    profiler = session['profiler']
+    if session['mode'] == 'sample':
+        profiler.stop()
+    else:
+        profiler.disable()
+
+    directory = current_app.config['PROFILE_DIR']
+    os.makedirs(directory, exist_ok=True)
+    rule = request.url_rule.rule if request.url_rule else request.path
+    profile_id = '{}-{}-{}-{}'.format(
+        session['started_at'].strftime('%Y%m%dT%H%M%S'),
+        request.method.lower(),
+        _SLUG.sub('_', rule).strip('_')[:60],
+        uuid.uuid4().hex[:8]
+    )
+
+    if session['mode'] == 'sample':
+        with open(os.path.join(directory, f'{profile_id}.speedscope.json'), 'w') as handle:
+            json.dump(profiler.to_speedscope(f'{request.method} {rule}'), handle)
+    else:
+        profiler.dump_stats(os.path.join(directory, f'{profile_id}.pstats'))
+
+    if 'snapshot' in session:
+        stats = tracemalloc.take_snapshot().compare_to(session['snapshot'], 'lineno')
+        if session['tracemalloc_owner']:
+            tracemalloc.stop()
+        with open(os.path.join(directory, f'{profile_id}.tracemalloc.txt'), 'w') as handle:
+            handle.write('\n'.join(str(stat) for stat in stats[:100]))
+
+    _prune(directory, current_app.config.get('PROFILE_MAX_FILES', 200))
+    response.headers['X-Profile-Id'] = profile_id
+    return response
+
+
+def init_app(app):
+    if not app.config.get('PROFILING_ENABLED'):
+        return
+    app.before_request(_start)
+    app.after_request(_finish)
@@ -0,0 +1,98 @@
+"""Aggregate finance and operations reports.
+
+Each report is a single grouped query that returns one row per group, not
+one per record. ``cached`` keeps results in process for dashboards that
+poll the same report; entries expire after ``REPORT_CACHE_SECONDS``.
+"""
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import case, func
+
+from app import db
+from app.models import Client, Invoice, decimal_to_float
+
+AGING_BUCKETS = ('not_due', 'days_0_30', 'days_31_60', 'days_61_90', 'days_over_90')
+CLOSED_INVOICE_STATUSES = ('draft', 'cancelled', 'paid')
+
+_lock = threading.Lock()
+_cache = {}
+
+
+def cached(key, compute):
+    """Return ``(value, generated_at, hit)``, recomputing once the entry has expired."""
+    ttl = current_app.config.get('REPORT_CACHE_SECONDS', 300)
+    now = time.monotonic()
+    with _lock:
+        entry = _cache.get(key)
+        if entry and entry[0] > now:
+            return entry[1], entry[2], True
+    value = compute()
+    generated_at = datetime.utcnow()
+    with _lock:
+        _cache[key] = (now + ttl, value, generated_at)
+    return value, generated_at, False
+
+
+def ar_aging(as_of, client_id=None):
+    """Outstanding balances per client and currency, bucketed by days past due at ``as_of``.
+
+    Invoices issued after ``as_of`` are left out; balances are the current
+    ``balance_due`` of each invoice.
+    """
+    cutoffs = [as_of - timedelta(days=days) for days in (30, 60, 90)]
+    due = Invoice.due_date
+    balance = Invoice.balance_due
+    buckets = (
+        due > as_of,
+        (due <= as_of) & (due >= cutoffs[0]),
+        (due < cutoffs[0]) & (due >= cutoffs[1]),
+        (due < cutoffs[1]) & (due >= cutoffs[2]),
+        due < cutoffs[2],
+    )
+
+    query = db.session.query(
+        Invoice.client_id,
+        Client.company_name,
+        Client.currency,
+        func.count(Invoice.id),
+        func.min(due),
+        *[func.coalesce(func.sum(case((condition, balance), else_=0)), 0) for condition in buckets]
+    ).join(Client, Client.id == Invoice.client_id).filter(
+        balance > 0,
+        Invoice.invoice_date <= as_of,
+        Invoice.invoice_status.notin_(CLOSED_INVOICE_STATUSES)
+    )
+    if client_id:
+        query = query.filter(Invoice.client_id == client_id)
+    rows = query.group_by(Invoice.client_id, Client.company_name, Client.currency).all()
+
+    clients = []
+    totals = defaultdict(lambda: dict.fromkeys(AGING_BUCKETS + ('total',), 0.0))
+    for client_id, name, currency, count, oldest_due, *amounts in rows:
+        amounts = [decimal_to_float(amount) for amount in amounts]
+        entry = {
+            'client_id': client_id,
+            'company_name': name,
+            'currency': currency,
+            'open_invoices': count,
+            'oldest_due_date': oldest_due.isoformat() if oldest_due else None,
+            'total': round(sum(amounts), 2),
+        }
+        entry.update(zip(AGING_BUCKETS, (round(amount, 2) for amount in amounts)))
+        clients.append(entry)
+        currency_totals = totals[currency]
+        for bucket, amount in zip(AGING_BUCKETS, amounts):
+            currency_totals[bucket] = round(currency_totals[bucket] + amount, 2)
+        currency_totals['total'] = round(currency_totals['total'] + sum(amounts), 2)
+
+    clients.sort(key=lambda entry: entry['total'], reverse=True)
+    return {
+        'as_of': as_of.isoformat(),
+        'buckets': list(AGING_BUCKETS),
+        'clients': clients,
+        'totals_by_currency': dict(totals),
+    }
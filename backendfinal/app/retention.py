@@ -0,0 +1,201 @@
+"""Retention policies for expired and stale rows.
+
+Each policy selects rows of one model that are safe to remove and purges
+them in small batches, committing after every batch so the job never holds
+a long write lock. Policies can archive rows into ``archived_records``
+instead of deleting them, and per-policy overrides come from
+``app.config['RETENTION_POLICIES']``::
+
+    RETENTION_POLICIES = {
+        'read_notifications': {'max_age_days': 90, 'action': 'archive'},
+        'expired_notifications': {'enabled': False},
+    }
+"""
+import threading
+import time
+from datetime import datetime, timedelta
+
+from flask import current_app
+
+from app import db
+from app.models import ArchivedRecord, Notification, NotificationReceipt, NotificationState
+
+_lock = threading.Lock()
+_stats = {}
+_policies = {}
+
+
+class RetentionPolicy:
+    """Describes which rows of ``model`` are stale and what to do with them."""
+
+    def __init__(self, name, model, criteria, max_age_days=None, action='delete',
+                 batch_size=None, on_purge=None, description=None):
+        self.name = name
+        self.model = model
+        self.criteria = criteria
+        self.max_age_days = max_age_days
+        self.action = action
+        self.batch_size = batch_size
+        self.on_purge = on_purge
+        self.description = description
+
+    def settings(self):
+        overrides = current_app.config.get('RETENTION_POLICIES', {}).get(self.name, {})
+        return {
+            'enabled': overrides.get('enabled', True),
+            'max_age_days': overrides.get('max_age_days', self.max_age_days),
+            'action': overrides.get('action', self.action),
+            'batch_size': overrides.get('batch_size') or self.batch_size
+            or current_app.config.get('RETENTION_BATCH_SIZE', 500),
+        }
+
+    def condition(self, now, settings):
+        cutoff = None
+        if settings['max_age_days'] is not None:
+            cutoff = now - timedelta(days=settings['max_age_days'])
+        return self.criteria(now, cutoff)
+
+    def to_dict(self):
+        settings = self.settings()
+        return {
+            'name': self.name,
+            'table': self.model.__tablename__,
+            'description': self.description,
+            **settings
+        }
+
+
+def register_policy(policy):
+    _policies[policy.name] = policy
+    return policy
+
+
+def get_policies():
+    return dict(_policies)
+
+
+def get_stats():
+    with _lock:
+        return {name: dict(values) for name, values in _stats.items()}
+
+
+def _record(name, purged, started):
+    duration_ms = round((time.perf_counter() - started) * 1000, 2)
+    with _lock:
+        entry = _stats.setdefault(name, {'runs': 0, 'rows_purged': 0})
+        entry['runs'] += 1
+        entry['rows_purged'] += purged
+        entry['last_rows_purged'] = purged
+        entry['last_duration_ms'] = duration_ms
+        entry['last_run_at'] = datetime.utcnow().isoformat()
+
+
+def purge(policy, now=None):
+    """Apply one policy batch by batch and return the number of rows removed."""
+    settings = policy.settings()
+    if not settings['enabled']:
+        return 0
+
+    now = now or datetime.utcnow()
+    model = policy.model
+    condition = policy.condition(now, settings)
+    batch_size = settings['batch_size']
+    pause = current_app.config.get('RETENTION_BATCH_PAUSE_SECONDS', 0)
+
+    started = time.perf_counter()
+    purged = 0
+    while True:
+        rows = model.query.filter(condition).order_by(model.id).limit(batch_size).all()
+        if not rows:
+            break
+        ids = [row.id for row in rows]
+
+        if settings['action'] == 'archive':
+            db.session.add_all([
+                ArchivedRecord(
+                    table_name=model.__tablename__,
+                    record_id=row.id,
+                    policy=policy.name,
+                    payload=row.to_dict()
+                )
+                for row in rows
+            ])
+        if policy.on_purge:
+            policy.on_purge(rows)
+
+        db.session.execute(db.delete(model).where(model.id.in_(ids)))
+        db.session.commit()
+        purged += len(ids)
+
+        if len(ids) < batch_size:
+            break
+        if pause:
+            time.sleep(pause)
+
+    _record(policy.name, purged, started)
+    if purged:
+        current_app.logger.info('Retention policy %s purged %s rows from %s',
+                                policy.name, purged, model.__tablename__)
+    return purged
+
+
+def run_all(now=None):
+    return {name: purge(policy, now=now) for name, policy in _policies.items()}
+
+
+def _counted(expires_at):
+    """Criteria matching the counters that were built before ``expires_at``."""
+    return [NotificationState.counted_at < expires_at] if expires_at else []
+
+
+def _forget_notifications(rows):
+    """Take purged notifications off the unread counters and drop their receipts.
+
+    Counters are adjusted the same way ``delete_notification`` does it, so
+    watermarks and the counts of unaffected users are left alone. A counter
+    built after a notification expired never included it and is skipped.
+    """
+    unread = {}
+    for row in rows:
+        if row.user_id is None:
+            readers = db.select(NotificationReceipt.user_id).where(
+                NotificationReceipt.notification_id == row.id
+            )
+            NotificationState.adjust(
+                -1, None,
+                NotificationState.read_watermark < row.id,
+                NotificationState.user_id.not_in(readers),
+                *_counted(row.expires_at)
+            )
+        elif not row.is_read:
+            key = (row.user_id, row.expires_at)
+            unread[key] = unread.get(key, 0) + 1
+    for (user_id, expires_at), count in unread.items():
+        NotificationState.adjust(-count, user_id, *_counted(expires_at))
+
+    NotificationReceipt.query.filter(
+        NotificationReceipt.notification_id.in_([row.id for row in rows])
+    ).delete(synchronize_session=False)
+
+
+register_policy(RetentionPolicy(
+    'expired_notifications',
+    Notification,
+    lambda now, cutoff: Notification.expires_at <= now,
+    on_purge=_forget_notifications,
+    description='Notifications past their expires_at'
+))
+
+register_policy(RetentionPolicy(
+    'read_notifications',
+    Notification,
+    lambda now, cutoff: db.and_(
+        Notification.user_id.isnot(None),
+        Notification.is_read.is_(True),
+        Notification.read_at < cutoff
+    ),
+    max_age_days=90,
+    on_purge=_forget_notifications,
+    description='Direct notifications read more than max_age_days ago'
+))
+
@@ -1,10 +1,13 @@
+import shutil
+import tempfile
 from datetime import datetime, date
 
+import click
 from flask import Blueprint, request, jsonify
-from flask_jwt_extended import jwt_required
+from flask_jwt_extended import jwt_required, get_jwt_identity
 
-from app import db
-from app.models import Agent
+from app import db, agent_import, agent_overview, bulk
+from app.models import Agent, User
 
 bp = Blueprint('agents', __name__, url_prefix='/api/agents')
 
@@ -52,6 +55,19 @@ def get_agent(agent_id):
     agent = Agent.query.get_or_404(agent_id)
     return jsonify(agent.to_dict()), 200
 
+@bp.route('/<int:agent_id>/overview', methods=['GET'])
+@jwt_required()
+def get_agent_overview(agent_id):
+    agent = Agent.query.get_or_404(agent_id)
+    payload, etag = agent_overview.get(agent)
+
+    response = jsonify(payload)
+    response.set_etag(etag)
+    # Clients must revalidate; a matching ETag costs one lookup and no body
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
+
 @bp.route('', methods=['POST'])
 @jwt_required()
 def create_agent():
@@ -228,3 +244,72 @@ def delete_agent(agent_id):
     db.session.commit()
     return jsonify({'message': 'Agent deactivated'}), 200
 
+@bp.route('/bulk', methods=['PATCH'])
+@jwt_required()
+def bulk_update_agents():
+    """Apply ``patch`` to the agents picked by ``ids`` and/or ``filter`` with a single UPDATE."""
+    user = db.session.get(User, get_jwt_identity())
+    if not user or user.role not in ('admin', 'manager'):
+        return jsonify({'error': 'Only admins/managers can bulk update agents'}), 403
+
+    data = request.get_json() or {}
+    try:
+        ids = bulk.run(Agent, data.get('patch'), ids=data.get('ids'), filters=data.get('filter'))
+    except ValueError as exc:
+        return jsonify({'error': str(exc)}), 400
+
+    result = {'updated': len(ids)}
+    if data.get('return_ids'):
+        result['ids'] = ids
+    return jsonify(result), 200
+
+@bp.route('/import', methods=['POST'])
+@jwt_required()
+def import_agents():
+    """Create agents from a CSV or XLSX file, sent as the ``file`` form field or as the raw body."""
+    dry_run = request.args.get('dry_run', 'false').lower() == 'true'
+    skip_invalid = request.args.get('skip_invalid', 'false').lower() == 'true'
+
+    upload = request.files.get('file')
+    if upload is not None:
+        fileobj, filename = upload.stream, upload.filename
+    elif request.content_length and request.mimetype != 'multipart/form-data':
+        # The XLSX reader needs a seekable file
+        fileobj = tempfile.SpooledTemporaryFile(max_size=8 * 1024 * 1024)
+        shutil.copyfileobj(request.stream, fileobj)
+        fileobj.seek(0)
+        filename = request.headers.get('X-Filename')
+    else:
+        return jsonify({'error': 'A CSV or XLSX file is required'}), 400
+
+    try:
+        report = agent_import.run(agent_import.records(fileobj, filename), dry_run=dry_run,
+                                  skip_invalid=skip_invalid, user_id=get_jwt_identity())
+    except ValueError as exc:
+        return jsonify({'error': str(exc)}), 400
+    finally:
+        fileobj.close()
+
+    if dry_run:
+        return jsonify(report), 200
+    if report['invalid'] and not skip_invalid:
+        return jsonify(dict(report, error='No agents were imported, the file has invalid rows')), 422
+    return jsonify(report), 201
+
+
+@bp.cli.command('import')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--dry-run', is_flag=True, help='Only validate the file.')
+@click.option('--skip-invalid', is_flag=True, help='Import the valid rows even if some are invalid.')
+def import_agents_command(path, dry_run, skip_invalid):
+    """Create agents from a CSV or XLSX file."""
+    with open(path, 'rb') as handle:
+        try:
+            report = agent_import.run(agent_import.records(handle, path), dry_run=dry_run,
+                                      skip_invalid=skip_invalid)
+        except ValueError as exc:
+            raise click.ClickException(str(exc))
+    print(f"{report['rows']} rows: {report['valid']} valid, {report['invalid']} invalid, "
+          f"{report['inserted']} imported")
+    for error in report['errors'][:50]:
+        print(f"Row {error['row']}, {error['field']}: {error['error']}")
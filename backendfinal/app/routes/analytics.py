@@ -0,0 +1,68 @@
+from datetime import date, datetime
+
+from flask import Blueprint, request, jsonify
+from flask_jwt_extended import jwt_required
+
+from app import analytics, jobs, reports, scheduler
+
+bp = Blueprint('analytics', __name__, url_prefix='/api/analytics')
+
+
+def _date(value, field):
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(value).date()
+    except ValueError as exc:
+        raise ValueError(f'Invalid date for {field}') from exc
+
+
+def _quarter_start(day):
+    return date(day.year, 3 * ((day.month - 1) // 3) + 1, 1)
+
+
+@bp.route('/punctuality', methods=['GET'])
+@jwt_required()
+def punctuality():
+    try:
+        end = _date(request.args.get('end_date'), 'end_date') or date.today()
+        start = _date(request.args.get('start_date'), 'start_date') or _quarter_start(end)
+    except ValueError as exc:
+        return jsonify({'error': str(exc)}), 400
+    if start > end:
+        return jsonify({'error': 'start_date must not be after end_date'}), 400
+    group_by = request.args.get('group_by', 'site')
+    if group_by not in analytics.GROUPINGS:
+        return jsonify({'error': f"group_by must be one of: {', '.join(analytics.GROUPINGS)}"}), 400
+    site_id = request.args.get('site_id', type=int)
+    agent_id = request.args.get('agent_id', type=int)
+    limit = request.args.get('limit', type=int)
+
+    def compute():
+        return analytics.punctuality(start, end, group_by, site_id, agent_id, limit)
+
+    if request.args.get('cached', 'true').lower() == 'false':
+        return jsonify(compute()), 200
+
+    report, generated_at, hit = reports.cached(
+        ('punctuality', start, end, group_by, site_id, agent_id, limit), compute
+    )
+    return jsonify(dict(report, generated_at=generated_at.isoformat(), cached=hit)), 200
+
+
+@bp.cli.command('rebuild-punctuality')
+def rebuild_punctuality_command():
+    """Recompute the punctuality rollup from every attendance."""
+    print(f'{analytics.rebuild()} rollup rows written')
+
+
+@jobs.job_type('analytics.rebuild_punctuality', max_attempts=2)
+def rebuild_punctuality_job(job):
+    """Recompute the punctuality rollup from every attendance."""
+    return {'rollup_rows': analytics.rebuild()}
+
+
+@scheduler.periodic('analytics.nightly_rebuild', '30 2 * * *')
+def nightly_rebuild_task(run):
+    """Queue a full rebuild of the punctuality rollup."""
+    return {'job_id': jobs.enqueue('analytics.rebuild_punctuality').id}
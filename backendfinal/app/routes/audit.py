@@ -0,0 +1,59 @@
+from datetime import datetime
+
+from flask import Blueprint, request, jsonify
+from flask_jwt_extended import jwt_required
+
+from app import audit
+from app.models import AuditLog
+from app.routes.helpers import admin_required
+
+bp = Blueprint('audit', __name__, url_prefix='/api/audit')
+
+
+def _dt(value, field):
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError as exc:
+        raise ValueError(f'Invalid datetime format for {field}') from exc
+
+
+@bp.route('', methods=['GET'])
+@jwt_required()
+@admin_required
+def list_audit_entries():
+    try:
+        start = _dt(request.args.get('start'), 'start')
+        end = _dt(request.args.get('end'), 'end')
+        limit = min(int(request.args.get('limit', 100)), 1000)
+        before_id = request.args.get('before_id', type=int)
+    except ValueError as exc:
+        return jsonify({'error': str(exc)}), 400
+
+    query = AuditLog.query
+    if request.args.get('entity_type'):
+        query = query.filter_by(entity_type=request.args['entity_type'])
+    if request.args.get('entity_id'):
+        query = query.filter_by(entity_id=request.args.get('entity_id', type=int))
+    if request.args.get('user_id'):
+        query = query.filter_by(user_id=request.args.get('user_id', type=int))
+    if start:
+        query = query.filter(AuditLog.created_at >= start)
+    if end:
+        query = query.filter(AuditLog.created_at <= end)
+    if before_id:
+        query = query.filter(AuditLog.id < before_id)
+
+    entries = query.order_by(AuditLog.id.desc()).limit(limit).all()
+    return jsonify({
+        'entries': [entry.to_dict() for entry in entries],
+        'next_before_id': entries[-1].id if len(entries) == limit else None
+    }), 200
+
+
+@bp.route('/stats', methods=['GET'])
+@jwt_required()
+@admin_required
+def audit_stats():
+    return jsonify(audit.get_stats()), 200
@@ -86,9 +86,6 @@ def create_client():
         billing_day=data.get('billing_day'),
         currency=data.get('currency', 'HTG'),
         credit_limit=data.get('credit_limit', 0),
-        current_balance=data.get('current_balance', 0),
-        total_invoiced=data.get('total_invoiced', 0),
-        total_paid=data.get('total_paid', 0),
         discount_percentage=data.get('discount_percentage', 0),
         service_level_agreement=data.get('service_level_agreement'),
         special_requirements=data.get('special_requirements'),
@@ -127,8 +124,7 @@ def update_client(client_id):
         'primary_contact_email', 'billing_contact_name', 'billing_contact_phone',
         'billing_contact_email', 'address', 'city', 'postal_code', 'country',
         'contract_status', 'payment_terms', 'billing_frequency', 'billing_day', 'currency',
-        'credit_limit', 'current_balance', 'total_invoiced', 'total_paid',
-        'discount_percentage', 'service_level_agreement', 'special_requirements',
+        'credit_limit', 'discount_percentage', 'service_level_agreement', 'special_requirements',
         'requires_background_check', 'requires_drug_testing', 'insurance_certificate_required',
         'preferred_communication_method', 'logo_url', 'website', 'notes', 'is_active'
     ]
@@ -1,10 +1,12 @@
 from datetime import datetime
 
 from flask import Blueprint, request, jsonify
-from flask_jwt_extended import jwt_required
+from flask_jwt_extended import jwt_required, get_jwt_identity
 
-from app import db
-from app.models import Document
+from app import db, expiry, scheduler
+from app.models import Document, StoredFile
+from app.routes.files import send_stored_file
+from app.storage import receive_uploads
 
 bp = Blueprint('documents', __name__, url_prefix='/api/documents')
 
@@ -20,6 +22,14 @@ def _date(value, field):
         raise ValueError(f'Invalid date for {field}') from exc
 
 
+def _stored_file(file_url):
+    """Return the ``StoredFile`` behind an ``/api/files/<sha256>`` URL, if any."""
+    prefix = '/api/files/'
+    if not file_url or not file_url.startswith(prefix):
+        return None
+    return StoredFile.query.filter_by(sha256=file_url[len(prefix):]).first()
+
+
 @bp.route('', methods=['GET'])
 @jwt_required()
 def list_documents():
@@ -52,14 +62,15 @@ def create_document():
     if missing:
         return jsonify({'error': f"Missing required fields: {', '.join(missing)}"}), 400
 
+    stored = _stored_file(data['file_url'])
     doc = Document(
         document_type=data['document_type'],
         entity_type=data['entity_type'],
         entity_id=data['entity_id'],
         document_name=data.get('document_name'),
         file_url=data['file_url'],
-        file_size_kb=data.get('file_size_kb'),
-        mime_type=data.get('mime_type'),
+        file_size_kb=data.get('file_size_kb') or (stored.size_kb if stored else None),
+        mime_type=data.get('mime_type') or (stored.mime_type if stored else None),
         issue_date=_date(data.get('issue_date'), 'issue_date'),
         expiry_date=_date(data.get('expiry_date'), 'expiry_date'),
         is_verified=data.get('is_verified', False),
@@ -74,6 +85,67 @@ def create_document():
     return jsonify(doc.to_dict()), 201
 
 
+def _upload_fields(form):
+    """Typed upload form fields; raises ``ValueError`` before the file is kept."""
+    required = ['document_type', 'entity_type', 'entity_id']
+    missing = [f for f in required if not form.get(f)]
+    if missing:
+        raise ValueError(f"Missing required fields: {', '.join(missing)}")
+    try:
+        entity_id = int(form['entity_id'])
+    except ValueError as exc:
+        raise ValueError('entity_id must be an integer') from exc
+    return {
+        'entity_id': entity_id,
+        'issue_date': _date(form.get('issue_date'), 'issue_date'),
+        'expiry_date': _date(form.get('expiry_date'), 'expiry_date'),
+    }
+
+
+@bp.route('/upload', methods=['POST'])
+@jwt_required()
+def upload_document():
+    """Stream a multipart upload into storage and create its document record."""
+    try:
+        form, stored = receive_uploads(user_id=get_jwt_identity(), validate=_upload_fields)
+    except ValueError as exc:
+        return jsonify({'error': str(exc)}), 400
+
+    stored_file = stored.get('file')
+    if stored_file is None:
+        db.session.commit()
+        return jsonify({'error': 'Missing required fields: file'}), 400
+    fields = _upload_fields(form)
+
+    doc = Document(
+        document_type=form['document_type'],
+        entity_type=form['entity_type'],
+        entity_id=fields['entity_id'],
+        document_name=form.get('document_name') or stored_file.original_name,
+        file_url=stored_file.url,
+        file_size_kb=stored_file.size_kb,
+        mime_type=stored_file.mime_type,
+        issue_date=fields['issue_date'],
+        expiry_date=fields['expiry_date'],
+        uploaded_by=get_jwt_identity()
+    )
+
+    db.session.add(doc)
+    db.session.commit()
+
+    return jsonify(doc.to_dict()), 201
+
+
+@bp.route('/<int:document_id>/download', methods=['GET'])
+@jwt_required()
+def download_document(document_id):
+    doc = Document.query.get_or_404(document_id)
+    stored = _stored_file(doc.file_url)
+    if stored is None:
+        return jsonify({'error': 'Document file is not held in storage', 'file_url': doc.file_url}), 404
+    return send_stored_file(stored, download_name=doc.document_name, as_attachment=True)
+
+
 @bp.route('/<int:document_id>', methods=['PUT'])
 @jwt_required()
 def update_document(document_id):
@@ -107,3 +179,8 @@ def delete_document(document_id):
     db.session.commit()
     return jsonify({'message': 'Document deleted'}), 200
 
+
+@scheduler.periodic('documents.expiry_alerts', '0 6 * * *')
+def expiry_alerts_task(run):
+    """Alert on documents about to expire."""
+    return {'alerts': expiry.document_alerts(run)}
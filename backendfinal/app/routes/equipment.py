@@ -2,12 +2,16 @@ from datetime import datetime
 
 from flask import Blueprint, request, jsonify
 from flask_jwt_extended import jwt_required
+from sqlalchemy.orm import joinedload
 
 from app import db
 from app.models import Equipment, EquipmentAssignment, Agent
+from app.routes.helpers import parse_expand
 
 bp = Blueprint('equipment', __name__, url_prefix='/api/equipment')
 
+ASSIGNMENT_EXPANSIONS = ('agent', 'equipment')
+
 
 def _date(value, field):
     if not value:
@@ -20,6 +24,20 @@ def _date(value, field):
         raise ValueError(f'Invalid date for {field}') from exc
 
 
+def _assignment_options(expand, with_equipment=True):
+    """Join what ``EquipmentAssignment.to_dict`` embeds, only the summary columns unless expanded."""
+    agent = joinedload(EquipmentAssignment.agent)
+    if 'agent' not in expand:
+        agent = agent.load_only(Agent.id, Agent.first_name, Agent.last_name)
+    options = [agent]
+    if with_equipment:
+        equipment = joinedload(EquipmentAssignment.equipment)
+        if 'equipment' not in expand:
+            equipment = equipment.load_only(Equipment.id, Equipment.equipment_name)
+        options.append(equipment)
+    return options
+
+
 @bp.route('', methods=['GET'])
 @jwt_required()
 def list_equipment():
@@ -39,9 +57,19 @@ def list_equipment():
 @bp.route('/<int:equipment_id>', methods=['GET'])
 @jwt_required()
 def get_equipment(equipment_id):
+    try:
+        expand = parse_expand(ASSIGNMENT_EXPANSIONS)
+    except ValueError as exc:
+        return jsonify({'error': str(exc)}), 400
+
     equipment = Equipment.query.get_or_404(equipment_id)
+    # The parent equipment is already in the identity map, so only agents need joining
+    assignments = EquipmentAssignment.query.filter_by(equipment_id=equipment.id).options(
+        *_assignment_options(expand, with_equipment=False)
+    ).order_by(EquipmentAssignment.id).all()
+
     data = equipment.to_dict()
-    data['assignments'] = [assignment.to_dict() for assignment in equipment.assignments]
+    data['assignments'] = [assignment.to_dict(expand) for assignment in assignments]
     return jsonify(data), 200
 
 
@@ -102,6 +130,27 @@ def delete_equipment(equipment_id):
     return jsonify({'message': 'Equipment deleted'}), 200
 
 
+@bp.route('/assignments', methods=['GET'])
+@jwt_required()
+def list_assignments():
+    try:
+        expand = parse_expand(ASSIGNMENT_EXPANSIONS)
+    except ValueError as exc:
+        return jsonify({'error': str(exc)}), 400
+
+    query = EquipmentAssignment.query.options(*_assignment_options(expand))
+    for field in ('equipment_id', 'agent_id'):
+        value = request.args.get(field, type=int)
+        if value:
+            query = query.filter(getattr(EquipmentAssignment, field) == value)
+    status = request.args.get('status')
+    if status:
+        query = query.filter_by(assignment_status=status)
+
+    assignments = query.order_by(EquipmentAssignment.assigned_date.desc()).all()
+    return jsonify([assignment.to_dict(expand) for assignment in assignments]), 200
+
+
 @bp.route('/assignments', methods=['POST'])
 @jwt_required()
 def assign_equipment():
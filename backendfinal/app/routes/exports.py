@@ -0,0 +1,130 @@
+from datetime import date, datetime
+
+import click
+from flask import Blueprint, Response, request, jsonify, stream_with_context
+from flask_jwt_extended import jwt_required
+
+from app import columnar, exports
+
+bp = Blueprint('exports', __name__, url_prefix='/api/exports')
+
+FORMATS = {
+    'csv': 'text/csv; charset=utf-8',
+    'xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+}
+COLUMNAR_FORMATS = {
+    'parquet': 'application/vnd.apache.parquet',
+    'arrow': 'application/vnd.apache.arrow.stream',
+}
+
+
+def _flag(name):
+    value = request.args.get(name, '').strip().lower()
+    if value in ('1', 'true', 'yes', 'on'):
+        return True
+    if value in ('', '0', 'false', 'no', 'off'):
+        return False
+    raise ValueError(f'{name} must be true or false')
+
+
+def _datetime(value, field):
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError as exc:
+        raise ValueError(f'Invalid date for {field}') from exc
+
+
+@bp.route('/<dataset>', methods=['GET'])
+@jwt_required()
+def export(dataset):
+    if dataset not in exports.DATASETS:
+        return jsonify({'error': f'Unknown export: {dataset}'}), 404
+    export_format = request.args.get('format', 'csv').lower()
+    if export_format not in FORMATS:
+        return jsonify({'error': f"format must be one of: {', '.join(FORMATS)}"}), 400
+    try:
+        compress = _flag('gzip')
+    except ValueError as exc:
+        return jsonify({'error': str(exc)}), 400
+    if compress and export_format != 'csv':
+        return jsonify({'error': 'gzip is only available for CSV exports'}), 400
+
+    try:
+        header, statement = exports.query(dataset, request.args)
+    except ValueError as exc:
+        return jsonify({'error': str(exc)}), 400
+
+    if export_format == 'xlsx':
+        chunks = exports.xlsx_chunks(header, exports.rows(statement), sheet_name=dataset)
+    else:
+        chunks = exports.csv_chunks(header, exports.rows(statement))
+    filename = f'{dataset}-{date.today().isoformat()}.{export_format}'
+    mimetype = FORMATS[export_format]
+    if compress:
+        chunks = exports.gzipped(chunks)
+        filename += '.gz'
+        mimetype = 'application/gzip'
+
+    response = Response(stream_with_context(chunks), mimetype=mimetype)
+    response.headers['Content-Disposition'] = f'attachment; filename="{filename}"'
+    response.headers['Cache-Control'] = 'no-store'
+    return response
+
+
+@bp.route('/<dataset>/columnar', methods=['GET'])
+@jwt_required()
+def export_columnar(dataset):
+    if dataset not in exports.DATASETS:
+        return jsonify({'error': f'Unknown export: {dataset}'}), 404
+    if not columnar.available():
+        return jsonify({'error': 'Columnar exports need pyarrow installed'}), 503
+    export_format = request.args.get('format', 'parquet').lower()
+    if export_format not in COLUMNAR_FORMATS:
+        return jsonify({'error': f"format must be one of: {', '.join(COLUMNAR_FORMATS)}"}), 400
+    decimals = request.args.get('decimals', 'decimal').lower()
+    if decimals not in ('decimal', 'float'):
+        return jsonify({'error': 'decimals must be decimal or float'}), 400
+    try:
+        since = _datetime(request.args.get('since'), 'since')
+        start = _datetime(request.args.get('start_date'), 'start_date')
+        end = _datetime(request.args.get('end_date'), 'end_date')
+    except ValueError as exc:
+        return jsonify({'error': str(exc)}), 400
+
+    until = columnar.watermark(dataset, since)
+    sink = exports.Sink()
+
+    def chunks():
+        for _ in columnar.stream(dataset, sink, export_format, since, until,
+                                 start and start.date(), end and end.date(), decimals):
+            data = sink.drain()
+            if data:
+                yield data
+
+    filename = f'{dataset}-{date.today().isoformat()}.{export_format}'
+    response = Response(stream_with_context(chunks()), mimetype=COLUMNAR_FORMATS[export_format])
+    response.headers['Content-Disposition'] = f'attachment; filename="{filename}"'
+    response.headers['Cache-Control'] = 'no-store'
+    # Pass back as ``since`` to fetch only what changed after this export
+    response.headers['X-Export-Watermark'] = until.isoformat() if until else ''
+    return response
+
+
+@bp.cli.command('parquet')
+@click.argument('directory')
+@click.option('--table', 'tables', multiple=True, type=click.Choice(sorted(exports.DATASETS)),
+              help='Table to export; repeat for several. Defaults to all.')
+@click.option('--partition', type=click.Choice(sorted(columnar.PARTITIONS)), default=None,
+              help='Split files by month or day of the table\'s date column.')
+@click.option('--decimals', type=click.Choice(['decimal', 'float']), default='decimal', show_default=True)
+@click.option('--full', is_flag=True, help='Ignore the stored watermark and export every row.')
+def parquet_command(directory, tables, partition, decimals, full):
+    """Export tables to Parquet under DIRECTORY, incrementally by updated_at."""
+    if not columnar.available():
+        raise click.ClickException('pyarrow is not installed')
+    summary = columnar.export_directory(directory, list(tables) or None, partition, full, decimals)
+    for name, result in summary.items():
+        print(f"{name}: {result['rows']} rows in {len(result['files'])} files, "
+              f"watermark {result['watermark']}")
@@ -0,0 +1,87 @@
+from flask import Blueprint, jsonify, send_file, current_app
+from flask_jwt_extended import jwt_required, get_jwt_identity
+
+from app import db, imaging
+from app.models import StoredFile
+from app.storage import get_storage, receive_uploads
+
+bp = Blueprint('files', __name__, url_prefix='/api/files')
+
+# Stored files never change once written, so clients may cache them for a year
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+
+
+def send_stored_file(stored, download_name=None, as_attachment=False):
+    storage = get_storage()
+    path = storage.local_path(stored.sha256)
+    response = send_file(
+        path or storage.open(stored.sha256),
+        mimetype=stored.mime_type,
+        as_attachment=as_attachment,
+        download_name=download_name or stored.original_name or stored.sha256,
+        conditional=True,
+        etag=stored.sha256,
+        max_age=IMMUTABLE_MAX_AGE,
+        last_modified=stored.created_at
+    )
+    response.cache_control.immutable = True
+    response.cache_control.public = False
+    response.cache_control.private = True
+    return response
+
+
+@bp.route('', methods=['POST'])
+@jwt_required()
+def upload_files():
+    try:
+        _, stored = receive_uploads(user_id=get_jwt_identity())
+    except ValueError as exc:
+        return jsonify({'error': str(exc)}), 400
+    if not stored:
+        return jsonify({'error': 'No file uploaded'}), 400
+    db.session.commit()
+    return jsonify({field: item.to_dict() for field, item in stored.items()}), 201
+
+
+@bp.route('/<string:sha256>', methods=['GET'])
+@jwt_required()
+def download_file(sha256):
+    stored = StoredFile.query.filter_by(sha256=sha256.lower()).first_or_404()
+    if not get_storage().exists(stored.sha256):
+        current_app.logger.error('Stored file %s is missing from the backend', stored.sha256)
+        return jsonify({'error': 'File content is missing'}), 410
+    return send_stored_file(stored)
+
+
+@bp.route('/<string:sha256>/meta', methods=['GET'])
+@jwt_required()
+def file_metadata(sha256):
+    stored = StoredFile.query.filter_by(sha256=sha256.lower()).first_or_404()
+    return jsonify(stored.to_dict()), 200
+
+
+@bp.route('/<string:sha256>/<string:variant>', methods=['GET'])
+@jwt_required()
+def download_derivative(sha256, variant):
+    if variant not in imaging.VARIANTS:
+        return jsonify({'error': f'Unknown image variant: {variant}'}), 404
+    stored = StoredFile.query.filter_by(sha256=sha256.lower()).first_or_404()
+    if not (stored.mime_type or '').startswith('image/'):
+        return jsonify({'error': 'File is not an image'}), 415
+
+    path = imaging.get_derivative(stored, variant)
+    if path is None:
+        # Pillow missing or remote backend: fall back to the original bytes
+        return send_stored_file(stored)
+
+    response = send_file(
+        path,
+        mimetype='image/jpeg',
+        conditional=True,
+        etag=f'{stored.sha256}-{variant}',
+        max_age=IMMUTABLE_MAX_AGE
+    )
+    response.cache_control.immutable = True
+    response.cache_control.public = False
+    response.cache_control.private = True
+    return response
@@ -0,0 +1,29 @@
+"""Request helpers shared by several blueprints."""
+from functools import wraps
+
+from flask import request, jsonify
+from flask_jwt_extended import get_jwt_identity
+
+from app import db
+from app.models import User
+
+
+def admin_required(view):
+    """Answer 403 unless the JWT belongs to an admin; goes below ``@jwt_required()``."""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        user = db.session.get(User, get_jwt_identity())
+        if not user or user.role != 'admin':
+            return jsonify({'error': 'Admin access required'}), 403
+        return view(*args, **kwargs)
+    return wrapper
+
+
+def parse_expand(allowed):
+    """Names in the ``expand`` query parameter; raises ``ValueError`` for names not in ``allowed``."""
+    requested = {name.strip() for name in request.args.get('expand', '').split(',') if name.strip()}
+    unknown = requested - set(allowed)
+    if unknown:
+        raise ValueError(f"Unknown expand value(s): {', '.join(sorted(unknown))}. "
+                         f"Allowed: {', '.join(allowed)}")
+    return requested
@@ -1,13 +1,18 @@
-from datetime import datetime
+from datetime import datetime, timedelta
+from decimal import Decimal, InvalidOperation
 
-from flask import Blueprint, request, jsonify
+import click
+from flask import Blueprint, request, jsonify, send_file
 from flask_jwt_extended import jwt_required
+from sqlalchemy import func, or_, update
 
-from app import db
-from app.models import Invoice, InvoiceLineItem, Client, Site
+from app import billing, db, invoice_pdf, jobs, ledger, scheduler, tracing
+from app.models import Invoice, InvoiceLineItem, Client, Site, to_decimal, to_money
 
 bp = Blueprint('invoices', __name__, url_prefix='/api/invoices')
 
+LINE_ITEM_STEP = Decimal('0.01')
+
 
 def _date(value, field):
     if not value:
@@ -20,6 +25,26 @@ def _date(value, field):
         raise ValueError(f'Invalid date for {field}') from exc
 
 
+def _decimal(value, field):
+    """``value`` as a Decimal that fits the two-decimal line-item columns exactly."""
+    try:
+        number = to_decimal(value)
+    except (InvalidOperation, TypeError, ValueError) as exc:
+        raise ValueError(f'Invalid number for {field}') from exc
+    if not number.is_finite():
+        raise ValueError(f'Invalid number for {field}')
+    # Extra places would be rounded away on save, leaving line_total based on another value
+    if number != number.quantize(LINE_ITEM_STEP):
+        raise ValueError(f'{field} must have at most 2 decimal places')
+    return number
+
+
+def _line_total(item):
+    if item.get('line_total'):
+        return to_money(_decimal(item['line_total'], 'line_total'))
+    return to_money(_decimal(item['quantity'], 'quantity') * _decimal(item['unit_price'], 'unit_price'))
+
+
 def _load_items(items):
     line_items = []
     for item in items or []:
@@ -29,14 +54,66 @@ def _load_items(items):
             InvoiceLineItem(
                 site_id=item.get('site_id'),
                 description=item['description'],
-                quantity=item['quantity'],
-                unit_price=item['unit_price'],
-                line_total=item.get('line_total') or (float(item['quantity']) * float(item['unit_price']))
+                quantity=_decimal(item['quantity'], 'quantity'),
+                unit_price=_decimal(item['unit_price'], 'unit_price'),
+                line_total=_line_total(item)
             )
         )
     return line_items
 
 
+def _diff_items(invoice, items):
+    """Apply a full line-item list to ``invoice`` by id and return the resulting items.
+
+    Entries with an ``id`` update that item in place (only changed fields),
+    entries without one are inserted and stored items missing from the list
+    are deleted.
+    """
+    existing = {item.id: item for item in invoice.line_items}
+    ids = [item['id'] for item in items if item.get('id')]
+    unknown = [item_id for item_id in ids if item_id not in existing]
+    if unknown:
+        raise ValueError(f"Line items not on this invoice: {', '.join(str(item_id) for item_id in unknown)}")
+    repeated = sorted({item_id for item_id in ids if ids.count(item_id) > 1})
+    if repeated:
+        raise ValueError(f"Line items listed more than once: {', '.join(str(item_id) for item_id in repeated)}")
+
+    result = []
+    for payload in items:
+        item = existing.pop(payload['id'], None) if payload.get('id') else None
+        if item is None:
+            new_item = _load_items([payload])[0]
+            invoice.line_items.append(new_item)
+            result.append(new_item)
+            continue
+
+        merged = {
+            'description': payload.get('description', item.description),
+            'quantity': payload.get('quantity', item.quantity),
+            'unit_price': payload.get('unit_price', item.unit_price),
+            'line_total': payload.get('line_total'),
+        }
+        if 'site_id' in payload and payload['site_id'] != item.site_id:
+            item.site_id = payload['site_id']
+        if merged['description'] != item.description:
+            item.description = merged['description']
+        for field in ('quantity', 'unit_price'):
+            if field in payload:
+                value = _decimal(payload[field], field)
+                if value != to_decimal(getattr(item, field)):
+                    setattr(item, field, value)
+        # A stored total is only recomputed when something it depends on was sent
+        if any(field in payload for field in ('quantity', 'unit_price', 'line_total')):
+            line_total = _line_total(merged)
+            if line_total != to_money(item.line_total):
+                item.line_total = line_total
+        result.append(item)
+
+    for item in existing.values():
+        db.session.delete(item)
+    return result
+
+
 @bp.route('', methods=['GET'])
 @jwt_required()
 def list_invoices():
@@ -72,7 +149,7 @@ def create_invoice():
     if missing:
         return jsonify({'error': f"Missing required fields: {', '.join(missing)}"}), 400
 
-    Client.query.get_or_404(data['client_id'])
+    client = Client.query.get_or_404(data['client_id'])
     for item in data['line_items']:
         if item.get('site_id'):
             Site.query.get_or_404(item['site_id'])
@@ -99,9 +176,16 @@ def create_invoice():
         invoice_status=data.get('invoice_status', 'draft')
     )
 
-    line_items = _load_items(data.get('line_items'))
+    try:
+        line_items = _load_items(data.get('line_items'))
+    except ValueError as exc:
+        return jsonify({'error': str(exc)}), 400
     invoice.line_items = line_items
-    invoice.calculate_totals()
+    invoice.calculate_totals(line_items)
+
+    credit_error = ledger.check_credit(client, invoice.total_amount)
+    if credit_error:
+        return jsonify({'error': credit_error}), 400
 
     db.session.add(invoice)
     db.session.commit()
@@ -138,12 +222,17 @@ def update_invoice(invoice_id):
         if field in data:
             setattr(invoice, field, data[field])
 
+    items = None
     if 'line_items' in data:
-        invoice.line_items.delete()  # type: ignore
-        new_items = _load_items(data['line_items'])
-        invoice.line_items = new_items
-
-    invoice.calculate_totals()
+        with tracing.span('invoice.diff_line_items', count=len(data['line_items'] or [])):
+            try:
+                items = _diff_items(invoice, data['line_items'] or [])
+            except ValueError as exc:
+                db.session.rollback()
+                return jsonify({'error': str(exc)}), 400
+
+    with tracing.span('invoice.calculate_totals'):
+        invoice.calculate_totals(items)
     db.session.commit()
 
     return jsonify(invoice.to_dict()), 200
@@ -155,9 +244,52 @@ def mark_invoice_sent(invoice_id):
     invoice = Invoice.query.get_or_404(invoice_id)
     invoice.mark_as_sent()
     db.session.commit()
+    invoice_pdf.schedule(invoice)
     return jsonify(invoice.to_dict()), 200
 
 
+@bp.route('/send-batch', methods=['POST'])
+@jwt_required()
+def send_invoices():
+    invoice_ids = (request.get_json() or {}).get('invoice_ids') or []
+    if not isinstance(invoice_ids, list) or not invoice_ids:
+        return jsonify({'error': 'invoice_ids must be a non-empty list'}), 400
+
+    invoices = Invoice.query.filter(Invoice.id.in_(invoice_ids)).all()
+    missing = set(invoice_ids) - {invoice.id for invoice in invoices}
+    if missing:
+        return jsonify({'error': f"Invoices not found: {', '.join(str(i) for i in sorted(missing))}"}), 404
+
+    for invoice in invoices:
+        invoice.mark_as_sent()
+    db.session.commit()
+
+    # Renders run in the pool; the response does not wait for them
+    for invoice in invoices:
+        invoice_pdf.schedule(invoice)
+    return jsonify({'sent': len(invoices), 'invoices': [invoice.to_dict() for invoice in invoices]}), 200
+
+
+@bp.route('/<int:invoice_id>/pdf', methods=['GET'])
+@jwt_required()
+def invoice_pdf_download(invoice_id):
+    invoice = Invoice.query.get_or_404(invoice_id)
+    path, content_hash = invoice_pdf.get_pdf(invoice)
+    if path is None:
+        return jsonify({'error': 'Invoice PDF could not be rendered, try again shortly'}), 503
+
+    response = send_file(
+        path,
+        mimetype='application/pdf',
+        download_name=f'{invoice.invoice_number}.pdf',
+        conditional=True,
+        etag=content_hash
+    )
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
+
+
 @bp.route('/<int:invoice_id>/record-payment', methods=['POST'])
 @jwt_required()
 def record_payment(invoice_id):
@@ -179,3 +311,79 @@ def delete_invoice(invoice_id):
     db.session.commit()
     return jsonify({'message': 'Invoice deleted'}), 200
 
+
+def _recalculate():
+    """Recompute totals of every open invoice from its line items in one UPDATE."""
+    subtotal = db.select(
+        func.coalesce(func.sum(InvoiceLineItem.line_total), 0)
+    ).where(InvoiceLineItem.invoice_id == Invoice.id).scalar_subquery()
+    tax = func.round(subtotal * func.coalesce(Invoice.tax_rate, 0) / 100, 2)
+    discount = func.round(subtotal * func.coalesce(Invoice.discount_percentage, 0) / 100, 2)
+    total = subtotal + tax - discount
+
+    result = db.session.execute(
+        update(Invoice).where(
+            Invoice.invoice_status.notin_(('paid', 'cancelled')),
+            or_(Invoice.subtotal.is_(None), Invoice.subtotal != subtotal, Invoice.total_amount != total)
+        ).values(
+            subtotal=subtotal,
+            tax_amount=tax,
+            discount_amount=discount,
+            total_amount=total,
+            balance_due=total - func.coalesce(Invoice.amount_paid, 0),
+            updated_at=datetime.utcnow()
+        ).execution_options(synchronize_session=False)
+    )
+    db.session.commit()
+
+    # The bulk UPDATE bypasses the flush hooks that post to the ledger
+    report = ledger.reconcile(repair=True)
+    return result.rowcount, report
+
+
+@bp.cli.command('recalculate')
+def recalculate_command():
+    """Recompute totals of every open invoice from its line items in one UPDATE."""
+    recalculated, report = _recalculate()
+    print(f'{recalculated} open invoices recalculated')
+    print(f"Ledger: {report['invoice_drift_count']} invoice and {report['client_drift_count']} client drifts repaired")
+
+
+@jobs.job_type('invoices.recalculate', max_attempts=1)
+def recalculate_job(job):
+    """Recompute open invoice totals and repair the ledger."""
+    recalculated, report = _recalculate()
+    return {
+        'recalculated': recalculated,
+        'invoice_drift_count': report['invoice_drift_count'],
+        'client_drift_count': report['client_drift_count'],
+    }
+
+
+@bp.cli.command('billing-run')
+@click.option('--date', 'day', required=True, help='Billing date (YYYY-MM-DD).')
+def billing_run_command(day):
+    """Create the draft invoices of clients whose billing day is DATE."""
+    day = datetime.fromisoformat(day).date()
+    created = billing.generate(day)
+    print(f'{len(created)} draft invoices created for {day.isoformat()}')
+
+
+@jobs.job_type('invoices.billing_run', max_attempts=3)
+def billing_run_job(job):
+    """Create draft invoices for the billing dates in (since, until]."""
+    since = datetime.fromisoformat(job.payload['since']).date()
+    until = datetime.fromisoformat(job.payload['until']).date()
+    created = billing.run(since, until)
+    return {'created': len(created), 'invoice_numbers': created}
+
+
+@scheduler.periodic('invoices.billing_day', '0 1 * * *')
+def billing_day_task(run):
+    """Queue the billing run for the days since the last one."""
+    until = run.scheduled_for.date()
+    since = run.previous.date() if run.previous else until - timedelta(days=1)
+    if since >= until:
+        return {'job_id': None}
+    job = jobs.enqueue('invoices.billing_run', {'since': since.isoformat(), 'until': until.isoformat()})
+    return {'job_id': job.id}
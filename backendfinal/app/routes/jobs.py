@@ -0,0 +1,104 @@
+import signal
+import threading
+from datetime import datetime
+
+import click
+from flask import Blueprint, current_app, request, jsonify
+from flask_jwt_extended import jwt_required, get_jwt_identity
+
+from app import db, jobs
+from app.models import Job, User
+
+bp = Blueprint('jobs', __name__, url_prefix='/api/jobs')
+
+
+def _current_user():
+    return db.session.get(User, get_jwt_identity())
+
+
+def _visible(job, user):
+    return user is not None and (user.role == 'admin' or job.created_by == user.id)
+
+
+@bp.route('/types', methods=['GET'])
+@jwt_required()
+def list_job_types():
+    return jsonify([kind.to_dict() for kind in jobs.get_job_types().values()]), 200
+
+
+@bp.route('', methods=['GET'])
+@jwt_required()
+def list_jobs():
+    user = _current_user()
+    limit = min(request.args.get('limit', 50, type=int), 500)
+    before_id = request.args.get('before_id', type=int)
+
+    query = Job.query
+    if not user or user.role != 'admin':
+        query = query.filter(Job.created_by == get_jwt_identity())
+    if request.args.get('status'):
+        query = query.filter(Job.status == request.args.get('status'))
+    if request.args.get('job_type'):
+        query = query.filter(Job.job_type == request.args.get('job_type'))
+    if before_id:
+        query = query.filter(Job.id < before_id)
+
+    items = query.order_by(Job.id.desc()).limit(limit).all()
+    return jsonify({
+        'jobs': [job.to_dict() for job in items],
+        'next_before_id': items[-1].id if len(items) == limit else None
+    }), 200
+
+
+@bp.route('', methods=['POST'])
+@jwt_required()
+def create_job():
+    user = _current_user()
+    if not user or user.role != 'admin':
+        return jsonify({'error': 'Admin access required'}), 403
+    data = request.get_json() or {}
+    if not data.get('job_type'):
+        return jsonify({'error': 'job_type is required'}), 400
+    try:
+        run_after = datetime.fromisoformat(data['run_after']) if data.get('run_after') else None
+        job = jobs.enqueue(data['job_type'], data.get('payload'), user.id, run_after,
+                           data.get('max_attempts'), data.get('priority'))
+    except ValueError as exc:
+        return jsonify({'error': str(exc)}), 400
+    return jsonify(job.to_dict()), 202
+
+
+@bp.route('/<int:job_id>', methods=['GET'])
+@jwt_required()
+def get_job(job_id):
+    job = Job.query.get_or_404(job_id)
+    if not _visible(job, _current_user()):
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(job.to_dict()), 200
+
+
+@bp.route('/<int:job_id>/cancel', methods=['POST'])
+@jwt_required()
+def cancel_job(job_id):
+    job = Job.query.get_or_404(job_id)
+    if not _visible(job, _current_user()):
+        return jsonify({'error': 'Job not found'}), 404
+    if not jobs.cancel(job):
+        return jsonify({'error': f'Job is already {job.status}'}), 409
+    return jsonify(job.to_dict()), 200
+
+
+@bp.cli.command('worker')
+@click.option('--processes', type=int, default=1, show_default=True, help='Worker processes to start.')
+@click.option('--type', 'types', multiple=True, help='Only run jobs of this type; repeat for several.')
+@click.option('--once', is_flag=True, help='Exit when the queue is empty (single process).')
+def worker_command(processes, types, once):
+    """Run background jobs until stopped with SIGTERM or Ctrl-C."""
+    if processes > 1 and not once:
+        jobs.run_workers(processes, list(types) or None)
+        return
+    stop = threading.Event()
+    # Finish the current job before exiting
+    signal.signal(signal.SIGTERM, lambda *_: stop.set())
+    signal.signal(signal.SIGINT, lambda *_: stop.set())
+    jobs.run_worker(current_app._get_current_object(), types=list(types) or None, once=once, stop=stop)
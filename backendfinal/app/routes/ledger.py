@@ -0,0 +1,60 @@
+import click
+from flask import Blueprint, request, jsonify
+from flask_jwt_extended import jwt_required
+
+from app import jobs, ledger
+from app.models import Client, LedgerEntry, decimal_to_float
+from app.routes.helpers import admin_required
+
+bp = Blueprint('ledger', __name__, url_prefix='/api/ledger')
+
+
+@bp.route('/clients/<int:client_id>', methods=['GET'])
+@jwt_required()
+def client_ledger(client_id):
+    client = Client.query.get_or_404(client_id)
+    limit = min(request.args.get('limit', 100, type=int), 1000)
+    before_id = request.args.get('before_id', type=int)
+
+    query = LedgerEntry.query.filter_by(client_id=client.id)
+    if request.args.get('invoice_id'):
+        query = query.filter_by(invoice_id=request.args.get('invoice_id', type=int))
+    if before_id:
+        query = query.filter(LedgerEntry.id < before_id)
+
+    entries = query.order_by(LedgerEntry.id.desc()).limit(limit).all()
+    return jsonify({
+        'client_id': client.id,
+        'credit_limit': decimal_to_float(client.credit_limit),
+        'total_invoiced': decimal_to_float(client.total_invoiced),
+        'total_paid': decimal_to_float(client.total_paid),
+        'current_balance': decimal_to_float(client.current_balance),
+        'entries': [entry.to_dict() for entry in entries],
+        'next_before_id': entries[-1].id if len(entries) == limit else None
+    }), 200
+
+
+@bp.route('/reconcile', methods=['POST'])
+@jwt_required()
+@admin_required
+def reconcile_ledger():
+    repair = bool((request.get_json(silent=True) or {}).get('repair'))
+    return jsonify(ledger.reconcile(repair=repair)), 200
+
+
+@bp.cli.command('reconcile')
+@click.option('--repair', is_flag=True, help='Post adjustment entries and fix client balances.')
+def reconcile_command(repair):
+    """Check client balances and ledger entries against the invoices."""
+    report = ledger.reconcile(repair=repair)
+    print(f"{report['invoices_checked']} invoices, {report['clients_checked']} clients checked")
+    print(f"{report['invoice_drift_count']} invoice drifts, {report['client_drift_count']} client drifts")
+    if report['repaired']:
+        print('Drift repaired')
+
+
+@jobs.job_type('ledger.reconcile', max_attempts=1)
+def reconcile_job(job):
+    """Check, and with payload repair=true fix, client balances against the invoices."""
+    report = ledger.reconcile(repair=bool(job.payload.get('repair')))
+    return {key: value for key, value in report.items() if not key.endswith('_drift')}
@@ -0,0 +1,31 @@
+import hmac
+
+from flask import Blueprint, Response, current_app, request, jsonify
+from flask_jwt_extended import get_jwt_identity, verify_jwt_in_request
+
+from app import db, metrics
+from app.models import User
+
+bp = Blueprint('metrics', __name__, url_prefix='/api')
+
+
+def _authorized():
+    """True for the METRICS_TOKEN bearer token or an admin's JWT."""
+    supplied = request.headers.get('Authorization', '').removeprefix('Bearer ').strip()
+    token = current_app.config.get('METRICS_TOKEN')
+    if token and hmac.compare_digest(supplied.encode(), token.encode()):
+        return True
+    try:
+        verify_jwt_in_request()
+    except Exception:
+        return False
+    user = db.session.get(User, get_jwt_identity())
+    return user is not None and user.role == 'admin'
+
+
+@bp.route('/_metrics', methods=['GET'])
+def prometheus_metrics():
+    """Prometheus scrape target for METRICS_TOKEN or an admin JWT, open only when METRICS_PUBLIC is set."""
+    if not current_app.config.get('METRICS_PUBLIC') and not _authorized():
+        return jsonify({'error': 'A metrics token or admin access is required'}), 401
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
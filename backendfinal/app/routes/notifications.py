@@ -4,7 +4,7 @@ from flask import Blueprint, request, jsonify
 from flask_jwt_extended import jwt_required, get_jwt_identity
 
 from app import db
-from app.models import Notification
+from app.models import Notification, NotificationReceipt, NotificationState
 
 bp = Blueprint('notifications', __name__, url_prefix='/api/notifications')
 
@@ -26,14 +26,27 @@ def list_notifications():
     current_user = get_jwt_identity()
     status = request.args.get('status')
 
-    query = Notification.query.filter(
-        (Notification.user_id == current_user) | (Notification.user_id.is_(None))
+    state = NotificationState.for_user(current_user)
+    unread = NotificationState.unread_clause(current_user, state.read_watermark)
+
+    query = db.session.query(Notification, unread.label('unread')).filter(
+        (Notification.user_id == current_user) | (Notification.user_id.is_(None)),
+        Notification.active_clause()
     )
     if status == 'unread':
-        query = query.filter_by(is_read=False)
+        query = query.filter(unread)
+
+    rows = query.order_by(Notification.created_at.desc()).all()
+    db.session.commit()
+    return jsonify([n.to_dict(is_read=not is_unread) for n, is_unread in rows]), 200
 
-    notifications = query.order_by(Notification.created_at.desc()).all()
-    return jsonify([n.to_dict() for n in notifications]), 200
+
+@bp.route('/unread-count', methods=['GET'])
+@jwt_required()
+def unread_count():
+    state = NotificationState.for_user(get_jwt_identity())
+    db.session.commit()
+    return jsonify({'unread_count': state.unread_count}), 200
 
 
 @bp.route('', methods=['POST'])
@@ -55,6 +68,7 @@ def create_notification():
     )
 
     db.session.add(notification)
+    NotificationState.adjust(1, notification.user_id)
     db.session.commit()
 
     return jsonify(notification.to_dict()), 201
@@ -63,18 +77,75 @@ def create_notification():
 @bp.route('/<int:notification_id>/read', methods=['POST'])
 @jwt_required()
 def mark_read(notification_id):
+    current_user = get_jwt_identity()
     notification = Notification.query.get_or_404(notification_id)
-    notification.is_read = True
-    notification.read_at = datetime.utcnow()
+
+    if notification.user_id is None:
+        state = NotificationState.for_user(current_user)
+        receipt = NotificationReceipt.query.filter_by(
+            notification_id=notification.id, user_id=current_user
+        ).first()
+        if notification.id > state.read_watermark and not receipt:
+            db.session.add(NotificationReceipt(notification_id=notification.id, user_id=current_user))
+            NotificationState.adjust(-1, current_user)
+        db.session.commit()
+        return jsonify(notification.to_dict(is_read=True)), 200
+
+    if not notification.is_read:
+        notification.is_read = True
+        notification.read_at = datetime.utcnow()
+        NotificationState.adjust(-1, notification.user_id)
     db.session.commit()
     return jsonify(notification.to_dict()), 200
 
 
+@bp.route('/read-all', methods=['POST'])
+@jwt_required()
+def mark_all_read():
+    current_user = get_jwt_identity()
+    now = datetime.utcnow()
+
+    db.session.execute(
+        db.update(Notification)
+        .where(Notification.user_id == current_user, Notification.is_read.isnot(True))
+        .values(is_read=True, read_at=now)
+    )
+    # Broadcasts are covered by moving the watermark, no per-row receipts needed
+    latest_broadcast = db.select(db.func.max(Notification.id)).where(
+        Notification.user_id.is_(None)
+    ).scalar_subquery()
+    NotificationState.for_user(current_user)
+    db.session.execute(
+        db.update(NotificationState)
+        .where(NotificationState.user_id == current_user)
+        .values(
+            unread_count=0,
+            read_watermark=db.func.coalesce(latest_broadcast, NotificationState.read_watermark),
+            updated_at=now
+        )
+    )
+    db.session.commit()
+    return jsonify({'unread_count': 0}), 200
+
+
 @bp.route('/<int:notification_id>', methods=['DELETE'])
 @jwt_required()
 def delete_notification(notification_id):
     notification = Notification.query.get_or_404(notification_id)
+
+    if notification.user_id is None:
+        readers = db.select(NotificationReceipt.user_id).where(
+            NotificationReceipt.notification_id == notification.id
+        )
+        NotificationState.adjust(
+            -1, None,
+            NotificationState.read_watermark < notification.id,
+            NotificationState.user_id.not_in(readers)
+        )
+        NotificationReceipt.query.filter_by(notification_id=notification.id).delete()
+    elif not notification.is_read:
+        NotificationState.adjust(-1, notification.user_id)
+
     db.session.delete(notification)
     db.session.commit()
     return jsonify({'message': 'Notification deleted'}), 200
-
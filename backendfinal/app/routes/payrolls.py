@@ -1,9 +1,10 @@
 from datetime import datetime
 
+import click
 from flask import Blueprint, request, jsonify
-from flask_jwt_extended import jwt_required
+from flask_jwt_extended import jwt_required, get_jwt_identity
 
-from app import db
+from app import db, jobs, payslips, tracing
 from app.models import Payroll, Agent, Attendance
 
 bp = Blueprint('payrolls', __name__, url_prefix='/api/payrolls')
@@ -51,7 +52,8 @@ def create_payroll():
         Attendance.attendance_date <= end_date
     ).all()
 
-    total_hours = sum((att.total_hours or 0) for att in attendances)
+    with tracing.span('payroll.sum_hours', attendances=len(attendances)):
+        total_hours = sum((att.total_hours or 0) for att in attendances)
 
     payroll = Payroll(
         agent_id=data['agent_id'],
@@ -80,7 +82,8 @@ def create_payroll():
         notes=data.get('notes')
     )
 
-    payroll.calculate_net_pay()
+    with tracing.span('payroll.calculate_net_pay'):
+        payroll.calculate_net_pay()
 
     db.session.add(payroll)
     db.session.commit()
@@ -127,3 +130,57 @@ def delete_payroll(payroll_id):
     db.session.commit()
     return jsonify({'message': 'Payroll deleted'}), 200
 
+
+@bp.route('/payslips', methods=['POST'])
+@jwt_required()
+def generate_payslips():
+    """Queue payslip generation for a period; poll the returned job for progress."""
+    data = request.get_json() or {}
+    missing = [field for field in ('pay_period_start', 'pay_period_end') if not data.get(field)]
+    if missing:
+        return jsonify({'error': f"Missing required fields: {', '.join(missing)}"}), 400
+    try:
+        datetime.fromisoformat(data['pay_period_start'])
+        datetime.fromisoformat(data['pay_period_end'])
+    except ValueError:
+        return jsonify({'error': 'Invalid pay period dates'}), 400
+    job = jobs.enqueue('payrolls.payslips', {
+        'pay_period_start': data['pay_period_start'],
+        'pay_period_end': data['pay_period_end'],
+        'force': bool(data.get('force')),
+    }, user_id=get_jwt_identity())
+    return jsonify(job.to_dict()), 202
+
+
+@jobs.job_type('payrolls.payslips')
+def payslips_job(job):
+    """Generate payslips for approved payrolls in a period."""
+    written = payslips.generate(
+        datetime.fromisoformat(job.payload['pay_period_start']).date(),
+        datetime.fromisoformat(job.payload['pay_period_end']).date(),
+        # A retry picks up where the failed attempt stopped, so only the first one forces
+        force=job.payload.get('force', False) and job.attempt == 1,
+        progress=lambda count: job.progress(count, message=f'{count} payslips written', force=True)
+    )
+    return {'generated': written}
+
+
+@bp.cli.command('payslips')
+@click.option('--start', required=True, help='First day of the period (YYYY-MM-DD).')
+@click.option('--end', required=True, help='Last day of the period (YYYY-MM-DD).')
+@click.option('--workers', type=int, default=None, help='Render processes; defaults to the CPU count.')
+@click.option('--chunk-size', type=int, default=200, show_default=True)
+@click.option('--force', is_flag=True, help='Regenerate payslips that already exist.')
+def payslips_command(start, end, workers, chunk_size, force):
+    """Generate payslips for approved payrolls in a period; safe to re-run after an interruption."""
+    started = datetime.utcnow()
+    written = payslips.generate(
+        datetime.fromisoformat(start).date(),
+        datetime.fromisoformat(end).date(),
+        chunk_size=chunk_size,
+        workers=workers,
+        force=force,
+        progress=lambda count: print(f'{count} payslips written')
+    )
+    elapsed = (datetime.utcnow() - started).total_seconds()
+    print(f'{written} payslips generated in {elapsed:.1f}s')
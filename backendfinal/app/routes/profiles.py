@@ -0,0 +1,41 @@
+import os
+from datetime import datetime
+
+from flask import Blueprint, current_app, jsonify, send_from_directory
+from flask_jwt_extended import jwt_required
+
+from app.routes.helpers import admin_required
+
+bp = Blueprint('profiles', __name__, url_prefix='/api/admin/profiles')
+
+
+@bp.route('', methods=['GET'])
+@jwt_required()
+@admin_required
+def list_profiles():
+    directory = current_app.config['PROFILE_DIR']
+    profiles = []
+    if os.path.isdir(directory):
+        for entry in os.scandir(directory):
+            if not entry.is_file():
+                continue
+            stat = entry.stat()
+            profiles.append({
+                'name': entry.name,
+                'size_bytes': stat.st_size,
+                'created_at': datetime.utcfromtimestamp(stat.st_mtime).isoformat()
+            })
+    profiles.sort(key=lambda profile: profile['created_at'], reverse=True)
+
+    return jsonify({
+        'enabled': bool(current_app.config.get('PROFILING_ENABLED')),
+        'sample_rate': current_app.config.get('PROFILE_SAMPLE_RATE', 0),
+        'profiles': profiles
+    }), 200
+
+
+@bp.route('/<path:name>', methods=['GET'])
+@jwt_required()
+@admin_required
+def download_profile(name):
+    return send_from_directory(current_app.config['PROFILE_DIR'], name, as_attachment=True)
@@ -0,0 +1,35 @@
+from datetime import date, datetime
+
+from flask import Blueprint, request, jsonify
+from flask_jwt_extended import jwt_required
+
+from app import reports
+
+bp = Blueprint('reports', __name__, url_prefix='/api/reports')
+
+
+def _date(value, field):
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(value).date()
+    except ValueError as exc:
+        raise ValueError(f'Invalid date for {field}') from exc
+
+
+@bp.route('/ar-aging', methods=['GET'])
+@jwt_required()
+def ar_aging():
+    try:
+        as_of = _date(request.args.get('as_of'), 'as_of') or date.today()
+    except ValueError as exc:
+        return jsonify({'error': str(exc)}), 400
+    client_id = request.args.get('client_id', type=int)
+
+    if request.args.get('cached', '').lower() != 'true':
+        return jsonify(reports.ar_aging(as_of, client_id)), 200
+
+    report, generated_at, hit = reports.cached(
+        ('ar_aging', as_of, client_id), lambda: reports.ar_aging(as_of, client_id)
+    )
+    return jsonify(dict(report, generated_at=generated_at.isoformat(), cached=hit)), 200
@@ -0,0 +1,45 @@
+from flask import Blueprint, request, jsonify
+from flask_jwt_extended import jwt_required
+
+from app import retention, scheduler
+from app.routes.helpers import admin_required
+
+bp = Blueprint('retention', __name__, url_prefix='/api/retention')
+
+
+@bp.route('', methods=['GET'])
+@jwt_required()
+@admin_required
+def get_retention():
+    return jsonify({
+        'policies': [policy.to_dict() for policy in retention.get_policies().values()],
+        'stats': retention.get_stats()
+    }), 200
+
+
+@bp.route('/run', methods=['POST'])
+@jwt_required()
+@admin_required
+def run_retention():
+    name = (request.get_json(silent=True) or {}).get('policy')
+    policies = retention.get_policies()
+    if name:
+        if name not in policies:
+            return jsonify({'error': f'Unknown retention policy: {name}'}), 404
+        purged = {name: retention.purge(policies[name])}
+    else:
+        purged = retention.run_all()
+    return jsonify({'purged': purged, 'stats': retention.get_stats()}), 200
+
+
+@bp.cli.command('run')
+def run_retention_command():
+    """Apply every retention policy once."""
+    for name, purged in retention.run_all().items():
+        print(f'{name}: {purged} rows purged')
+
+
+@scheduler.periodic('retention.purge', '15 * * * *')
+def retention_task(run):
+    """Apply every retention policy, including notification expiry."""
+    return retention.run_all()
@@ -0,0 +1,102 @@
+import signal
+import threading
+from datetime import datetime
+
+import click
+from flask import Blueprint, current_app, request, jsonify
+from flask_jwt_extended import jwt_required, get_jwt_identity
+
+from app import db, scheduler
+from app.models import ScheduledRun, ScheduledTask, SchedulerLease
+from app.routes.helpers import admin_required
+
+bp = Blueprint('scheduler', __name__, url_prefix='/api/scheduler')
+
+
+@bp.route('', methods=['GET'])
+@jwt_required()
+@admin_required
+def get_scheduler():
+    now = datetime.utcnow()
+    rows = {row.name: row for row in ScheduledTask.query.all()}
+    tasks = []
+    for name, task in scheduler.get_tasks().items():
+        entry = task.to_dict()
+        row = rows.get(name)
+        entry.update(row.to_dict() if row else {'next_run_at': None, 'last_status': None})
+        entry['overdue'] = bool(row and entry['enabled'] and row.next_run_at < now)
+        tasks.append(entry)
+    lease = db.session.get(SchedulerLease, scheduler.LEASE_NAME)
+    return jsonify({
+        'enabled': current_app.config.get('SCHEDULER_ENABLED', False),
+        'leader': lease.to_dict() if lease and lease.expires_at > now else None,
+        'tasks': tasks
+    }), 200
+
+
+@bp.route('/runs', methods=['GET'])
+@jwt_required()
+@admin_required
+def list_runs():
+    limit = min(request.args.get('limit', 50, type=int), 500)
+    before_id = request.args.get('before_id', type=int)
+    query = ScheduledRun.query
+    if request.args.get('task'):
+        query = query.filter(ScheduledRun.task_name == request.args.get('task'))
+    if request.args.get('status'):
+        query = query.filter(ScheduledRun.status == request.args.get('status'))
+    if before_id:
+        query = query.filter(ScheduledRun.id < before_id)
+
+    items = query.order_by(ScheduledRun.id.desc()).limit(limit).all()
+    return jsonify({
+        'runs': [run.to_dict() for run in items],
+        'next_before_id': items[-1].id if len(items) == limit else None
+    }), 200
+
+
+@bp.route('/<name>/run', methods=['POST'])
+@jwt_required()
+@admin_required
+def run_task(name):
+    if name not in scheduler.get_tasks():
+        return jsonify({'error': f'Unknown scheduled task: {name}'}), 404
+
+    run_id = scheduler.run_now(name, runner=f'user:{get_jwt_identity()}')
+    return jsonify(db.session.get(ScheduledRun, run_id).to_dict()), 200
+
+
+@bp.cli.command('run')
+def run_command():
+    """Run the scheduler in the foreground until stopped with SIGTERM or Ctrl-C."""
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stop.set())
+    signal.signal(signal.SIGINT, lambda *_: stop.set())
+    scheduler.run(current_app._get_current_object(), stop=stop)
+
+
+@bp.cli.command('tick')
+def tick_command():
+    """Run the tasks that are due now, if no other process holds the lease."""
+    holder = scheduler.holder_id()
+    run_ids = scheduler.tick(holder)
+    if run_ids is None:
+        print('Another process holds the scheduler lease')
+        return
+    scheduler.release_lease(holder)
+    for run in ScheduledRun.query.filter(ScheduledRun.id.in_(run_ids)).order_by(ScheduledRun.id):
+        print(f'{run.task_name}: {run.status} in {run.duration_ms:.0f}ms')
+    if not run_ids:
+        print('No task was due')
+
+
+@bp.cli.command('run-task')
+@click.argument('name')
+def run_task_command(name):
+    """Run one scheduled task now, outside its schedule."""
+    if name not in scheduler.get_tasks():
+        raise click.BadParameter(f'Unknown scheduled task: {name}')
+    run = db.session.get(ScheduledRun, scheduler.run_now(name))
+    print(f'{run.task_name}: {run.status} in {run.duration_ms:.0f}ms')
+    if run.error:
+        print(run.error)
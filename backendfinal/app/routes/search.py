@@ -0,0 +1,30 @@
+from flask import Blueprint, request, jsonify
+from flask_jwt_extended import jwt_required
+
+from app import search as search_index
+
+bp = Blueprint('search', __name__, url_prefix='/api/search')
+
+
+@bp.route('', methods=['GET'])
+@jwt_required()
+def search():
+    query = (request.args.get('q') or '').strip()
+    if not query:
+        return jsonify({'error': 'q is required'}), 400
+
+    types = request.args.get('types')
+    types = [t.strip() for t in types.split(',') if t.strip()] if types else None
+    try:
+        limit = min(max(int(request.args.get('limit', 20)), 1), 100)
+    except ValueError:
+        return jsonify({'error': 'limit must be an integer'}), 400
+
+    results = search_index.search(query, types=types, limit=limit)
+    return jsonify({'query': query, 'results': results}), 200
+
+
+@bp.cli.command('reindex')
+def reindex_command():
+    """Rebuild the full-text search index from agents, clients and sites."""
+    print(f'{search_index.rebuild()} entities indexed')
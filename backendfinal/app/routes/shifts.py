@@ -3,7 +3,7 @@ from datetime import datetime, time, date
 from flask import Blueprint, request, jsonify
 from flask_jwt_extended import jwt_required, get_jwt_identity
 
-from app import db
+from app import db, bulk
 from app.models import Shift, Agent, Site, User
 
 bp = Blueprint('shifts', __name__, url_prefix='/api/shifts')
@@ -73,7 +73,7 @@ def get_shift(shift_id):
 def create_shift():
     user = _current_user()
     if user.role not in ('admin', 'manager', 'supervisor'):
-        return jsonify({'error': 'Only admins/managers can create shifts'}), 403
+        return jsonify({'error': 'Only admins, managers and supervisors can create shifts'}), 403
 
     data = request.get_json() or {}
     required = ['site_id', 'agent_id', 'shift_date', 'scheduled_start_time', 'scheduled_end_time']
@@ -165,6 +165,26 @@ def update_shift(shift_id):
     return jsonify(shift.to_dict()), 200
 
 
+@bp.route('/bulk', methods=['PATCH'])
+@jwt_required()
+def bulk_update_shifts():
+    """Apply ``patch`` to the shifts picked by ``ids`` and/or ``filter`` with a single UPDATE."""
+    user = _current_user()
+    if user.role not in ('admin', 'manager', 'supervisor'):
+        return jsonify({'error': 'Only admins, managers and supervisors can bulk update shifts'}), 403
+
+    data = request.get_json() or {}
+    try:
+        ids = bulk.run(Shift, data.get('patch'), ids=data.get('ids'), filters=data.get('filter'))
+    except ValueError as exc:
+        return jsonify({'error': str(exc)}), 400
+
+    result = {'updated': len(ids)}
+    if data.get('return_ids'):
+        result['ids'] = ids
+    return jsonify(result), 200
+
+
 @bp.route('/<int:shift_id>/reset-operator-lock', methods=['POST'])
 @jwt_required()
 def reset_operator_lock(shift_id):
@@ -1,10 +1,10 @@
 from datetime import datetime
 
 from flask import Blueprint, request, jsonify
-from flask_jwt_extended import jwt_required
+from flask_jwt_extended import jwt_required, get_jwt_identity
 
-from app import db
-from app.models import Site
+from app import db, bulk
+from app.models import Site, User
 
 bp = Blueprint('sites', __name__, url_prefix='/api/sites')
 
@@ -137,6 +137,25 @@ def update_site(site_id):
     db.session.commit()
     return jsonify(site.to_dict()), 200
 
+@bp.route('/bulk', methods=['PATCH'])
+@jwt_required()
+def bulk_update_sites():
+    """Apply ``patch`` to the sites picked by ``ids`` and/or ``filter`` with a single UPDATE."""
+    user = db.session.get(User, get_jwt_identity())
+    if not user or user.role not in ('admin', 'manager'):
+        return jsonify({'error': 'Only admins/managers can bulk update sites'}), 403
+
+    data = request.get_json() or {}
+    try:
+        ids = bulk.run(Site, data.get('patch'), ids=data.get('ids'), filters=data.get('filter'))
+    except ValueError as exc:
+        return jsonify({'error': str(exc)}), 400
+
+    result = {'updated': len(ids)}
+    if data.get('return_ids'):
+        result['ids'] = ids
+    return jsonify(result), 200
+
 @bp.route('/<int:site_id>', methods=['DELETE'])
 @jwt_required()
 def delete_site(site_id):
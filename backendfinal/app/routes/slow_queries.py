@@ -0,0 +1,30 @@
+from flask import Blueprint, request, jsonify
+from flask_jwt_extended import jwt_required
+
+from app import slow_queries
+from app.routes.helpers import admin_required
+
+bp = Blueprint('slow_queries', __name__, url_prefix='/api/admin/slow-queries')
+
+
+@bp.route('', methods=['GET'])
+@jwt_required()
+@admin_required
+def list_slow_queries():
+    order_by = request.args.get('order_by', 'total_ms')
+    if order_by not in ('total_ms', 'max_ms', 'count'):
+        return jsonify({'error': 'order_by must be total_ms, max_ms or count'}), 400
+    limit = min(request.args.get('limit', 20, type=int), 200)
+
+    return jsonify({
+        'top': slow_queries.top(limit=limit, order_by=order_by),
+        'recent': slow_queries.recent(limit=limit)
+    }), 200
+
+
+@bp.route('', methods=['DELETE'])
+@jwt_required()
+@admin_required
+def reset_slow_queries():
+    slow_queries.reset()
+    return jsonify({'message': 'Slow-query log cleared'}), 200
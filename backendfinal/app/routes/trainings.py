@@ -2,12 +2,16 @@ from datetime import datetime
 
 from flask import Blueprint, request, jsonify
 from flask_jwt_extended import jwt_required
+from sqlalchemy.orm import joinedload
 
-from app import db
+from app import db, expiry, scheduler
 from app.models import Training, AgentTraining, Agent
+from app.routes.helpers import parse_expand
 
 bp = Blueprint('trainings', __name__, url_prefix='/api/trainings')
 
+ASSIGNMENT_EXPANSIONS = ('agent', 'training')
+
 
 def _date(value, field):
     if not value:
@@ -20,6 +24,17 @@ def _date(value, field):
         raise ValueError(f'Invalid date for {field}') from exc
 
 
+def _assignment_options(expand):
+    """Join what ``AgentTraining.to_dict`` embeds, only the summary columns unless expanded."""
+    agent = joinedload(AgentTraining.agent)
+    if 'agent' not in expand:
+        agent = agent.load_only(Agent.id, Agent.first_name, Agent.last_name)
+    training = joinedload(AgentTraining.training)
+    if 'training' not in expand:
+        training = training.load_only(Training.id, Training.training_name)
+    return agent, training
+
+
 @bp.route('', methods=['GET'])
 @jwt_required()
 def list_trainings():
@@ -79,6 +94,24 @@ def delete_training(training_id):
     return jsonify({'message': 'Training deleted'}), 200
 
 
+@bp.route('/assign', methods=['GET'])
+@jwt_required()
+def list_assignments():
+    try:
+        expand = parse_expand(ASSIGNMENT_EXPANSIONS)
+    except ValueError as exc:
+        return jsonify({'error': str(exc)}), 400
+
+    query = AgentTraining.query.options(*_assignment_options(expand))
+    for field in ('agent_id', 'training_id'):
+        value = request.args.get(field, type=int)
+        if value:
+            query = query.filter(getattr(AgentTraining, field) == value)
+
+    assignments = query.order_by(AgentTraining.expiry_date.desc()).all()
+    return jsonify([assignment.to_dict(expand) for assignment in assignments]), 200
+
+
 @bp.route('/assign', methods=['POST'])
 @jwt_required()
 def assign_training():
@@ -125,3 +158,8 @@ def update_assignment(assignment_id):
     db.session.commit()
     return jsonify(assignment.to_dict()), 200
 
+
+@scheduler.periodic('trainings.expiry_alerts', '0 6 * * *')
+def expiry_alerts_task(run):
+    """Alert on agent trainings coming up for renewal."""
+    return {'alerts': expiry.training_alerts(run)}
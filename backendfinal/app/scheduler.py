@@ -0,0 +1,393 @@
+"""In-app periodic task scheduler.
+
+Modules register periodic tasks with a cron spec, in UTC::
+
+    @scheduler.periodic('trainings.expiry_alerts', '0 6 * * *')
+    def training_expiry_task(run):
+        ...
+        return {'alerts': count}
+
+The function receives a ``RunContext``. Its ``scheduled_for`` is the tick
+being run and its ``previous`` is the tick of the last successful run, so
+a task can cover exactly the window in between even after missed ticks.
+Heavy work should be handed to ``jobs.enqueue`` from the task.
+
+Every process started with ``SCHEDULER_ENABLED`` runs a scheduler thread,
+but only the holder of the ``scheduler_leases`` row runs ticks. The lease
+expires after ``SCHEDULER_LEASE_SECONDS`` and is renewed while its holder
+is alive, so another gunicorn worker or host takes over when it dies.
+Each due tick is also claimed with a conditional UPDATE of its
+``next_run_at``, so it runs once even when leadership changes hands mid-tick.
+
+Ticks overdue by more than ``SCHEDULER_MISSED_GRACE_SECONDS`` (no process
+was running, or the leader was stuck) are recorded as a ``missed`` run
+and announced with a high-priority broadcast notification. Missed ticks
+are then coalesced into a single run. Every run is recorded in
+``scheduled_runs`` with its duration and result. Per-task overrides come
+from ``app.config['SCHEDULES']``::
+
+    SCHEDULES = {
+        'invoices.billing_day': {'cron': '30 0 * * *'},
+        'analytics.nightly_rebuild': {'enabled': False},
+    }
+"""
+import atexit
+import calendar
+import os
+import socket
+import threading
+import time
+import traceback
+import uuid
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import case, insert, or_, select, update
+from sqlalchemy.exc import IntegrityError
+
+from app import db
+from app.models import Notification, NotificationState, ScheduledRun, ScheduledTask, SchedulerLease
+from app.retention import RetentionPolicy, register_policy
+
+LEASE_NAME = 'scheduler'
+MAX_CATCH_UP_TICKS = 1000
+
+_ALIASES = {
+    '@hourly': '0 * * * *',
+    '@daily': '0 0 * * *',
+    '@midnight': '0 0 * * *',
+    '@weekly': '0 0 * * 0',
+    '@monthly': '0 0 1 * *',
+    '@yearly': '0 0 1 1 *',
+}
+_FIELDS = (('minute', 0, 59), ('hour', 0, 23), ('day', 1, 31), ('month', 1, 12), ('weekday', 0, 7))
+
+_tasks = {}
+_tasks_table = ScheduledTask.__table__
+_runs_table = ScheduledRun.__table__
+_leases_table = SchedulerLease.__table__
+
+
+class CronSpec:
+    """Five-field cron expression: minute, hour, day of month, month, day of week.
+
+    Fields accept ``*``, numbers, ranges, lists and ``/step``; day of week
+    runs from 0 (Sunday) to 7 (Sunday again). As in cron, a tick matches
+    either day field when both are restricted.
+    """
+
+    def __init__(self, expression):
+        self.expression = expression
+        fields = _ALIASES.get(expression.strip(), expression).split()
+        if len(fields) != 5:
+            raise ValueError(f'Cron spec needs 5 fields: {expression}')
+        self.minutes, self.hours, self.days, self.months, weekdays = (
+            self._parse(field, name, low, high) for field, (name, low, high) in zip(fields, _FIELDS)
+        )
+        self.weekdays = {day % 7 for day in weekdays}
+        self.any_day = fields[2] == '*'
+        self.any_weekday = fields[4] == '*'
+
+    @staticmethod
+    def _parse(field, name, low, high):
+        values = set()
+        for part in field.split(','):
+            span, _, step = part.partition('/')
+            try:
+                step = int(step) if step else 1
+                if span == '*':
+                    start, end = low, high
+                elif '-' in span:
+                    start, end = (int(value) for value in span.split('-', 1))
+                else:
+                    start = int(span)
+                    end = high if step > 1 else start
+            except ValueError as exc:
+                raise ValueError(f'Invalid cron {name} field: {field}') from exc
+            if start < low or end > high or start > end or step < 1:
+                raise ValueError(f'Cron {name} field out of range: {field}')
+            values.update(range(start, end + 1, step))
+        return values
+
+    def _day_matches(self, moment):
+        in_month = moment.day in self.days
+        in_week = (moment.weekday() + 1) % 7 in self.weekdays
+        if self.any_day or self.any_weekday:
+            return in_month and in_week
+        return in_month or in_week
+
+    def next_after(self, moment):
+        """First matching minute strictly after ``moment``."""
+        candidate = moment.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        limit = candidate + timedelta(days=366 * 5)
+        while candidate < limit:
+            if candidate.month not in self.months:
+                days = calendar.monthrange(candidate.year, candidate.month)[1] - candidate.day + 1
+                candidate = candidate.replace(hour=0, minute=0) + timedelta(days=days)
+            elif not self._day_matches(candidate):
+                candidate = candidate.replace(hour=0, minute=0) + timedelta(days=1)
+            elif candidate.hour not in self.hours:
+                candidate = candidate.replace(minute=0) + timedelta(hours=1)
+            elif candidate.minute not in self.minutes:
+                candidate += timedelta(minutes=1)
+            else:
+                return candidate
+        raise ValueError(f'Cron spec never matches: {self.expression}')
+
+
+class PeriodicTask:
+    def __init__(self, name, cron, func, description=None):
+        self.name = name
+        self.cron = cron
+        self.func = func
+        self.description = description or (func.__doc__ or '').strip().split('\n')[0] or None
+        CronSpec(cron)
+
+    def settings(self):
+        overrides = current_app.config.get('SCHEDULES', {}).get(self.name, {})
+        return {
+            'enabled': overrides.get('enabled', True),
+            'cron': overrides.get('cron', self.cron),
+        }
+
+    def to_dict(self):
+        return {
+            'name': self.name,
+            'description': self.description,
+            **self.settings()
+        }
+
+
+class RunContext:
+    """What a task function sees of its run."""
+
+    def __init__(self, name, scheduled_for, previous, missed_ticks=0, trigger='schedule'):
+        self.name = name
+        self.scheduled_for = scheduled_for
+        self.previous = previous
+        self.missed_ticks = missed_ticks
+        self.trigger = trigger
+
+
+def periodic(name, cron):
+    """Register the decorated function as the periodic task ``name``."""
+    def decorator(func):
+        _tasks[name] = PeriodicTask(name, cron, func)
+        return func
+    return decorator
+
+
+def get_tasks():
+    return dict(_tasks)
+
+
+def holder_id():
+    return f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}'
+
+
+def acquire_lease(holder, now=None):
+    """Take or renew the scheduler lease; False while another live process holds it."""
+    now = now or datetime.utcnow()
+    expires_at = now + timedelta(seconds=current_app.config.get('SCHEDULER_LEASE_SECONDS', 90))
+    held = _leases_table.c.holder == holder
+    with db.engine.begin() as conn:
+        taken = conn.execute(update(_leases_table).where(
+            _leases_table.c.name == LEASE_NAME, or_(held, _leases_table.c.expires_at < now)
+        ).values(
+            holder=holder, expires_at=expires_at,
+            acquired_at=case((held, _leases_table.c.acquired_at), else_=now)
+        )).rowcount
+    if taken:
+        return True
+    try:
+        with db.engine.begin() as conn:
+            conn.execute(insert(_leases_table).values(
+                name=LEASE_NAME, holder=holder, acquired_at=now, expires_at=expires_at
+            ))
+        return True
+    except IntegrityError:
+        return False
+
+
+def release_lease(holder):
+    with db.engine.begin() as conn:
+        conn.execute(update(_leases_table).where(
+            _leases_table.c.name == LEASE_NAME, _leases_table.c.holder == holder
+        ).values(expires_at=datetime.utcnow()))
+
+
+def _sync(now):
+    """Schedule rows of the registered tasks by name, created or re-planned as needed."""
+    with db.engine.begin() as conn:
+        rows = {row.name: row for row in conn.execute(select(_tasks_table))}
+        for name, task in _tasks.items():
+            cron = task.settings()['cron']
+            row = rows.get(name)
+            if row is None:
+                conn.execute(insert(_tasks_table).values(
+                    name=name, cron=cron, next_run_at=CronSpec(cron).next_after(now), updated_at=now
+                ))
+            elif row.cron != cron:
+                conn.execute(update(_tasks_table).where(_tasks_table.c.id == row.id).values(
+                    cron=cron, next_run_at=CronSpec(cron).next_after(now), updated_at=now
+                ))
+        return {row.name: row for row in conn.execute(select(_tasks_table))}
+
+
+def _alert_missed(task, ticks, now):
+    first, last = ticks[0], ticks[-1]
+    current_app.logger.warning('Scheduled task %s missed %s tick(s) between %s and %s',
+                               task.name, len(ticks), first.isoformat(), last.isoformat())
+    with db.engine.begin() as conn:
+        conn.execute(insert(_runs_table).values(
+            task_name=task.name, scheduled_for=first, status='missed', missed_ticks=len(ticks),
+            trigger='schedule', started_at=now, finished_at=now, duration_ms=0
+        ))
+    db.session.add(Notification(
+        notification_type='scheduler_missed',
+        title=f'Scheduled task {task.name} missed {len(ticks)} run(s)',
+        message=f'Ticks from {first.isoformat()} to {last.isoformat()} UTC did not run on time. '
+                'They are being caught up in a single run.',
+        priority='high',
+        expires_at=now + timedelta(days=7)
+    ))
+    NotificationState.adjust(1)
+    db.session.commit()
+
+
+def execute(task, scheduled_for, previous, runner, missed_ticks=0, trigger='schedule'):
+    """Run ``task`` once, record the run and return its ``ScheduledRun`` id."""
+    started_at = datetime.utcnow()
+    with db.engine.begin() as conn:
+        run_id = conn.execute(insert(_runs_table).values(
+            task_name=task.name, scheduled_for=scheduled_for, status='running', missed_ticks=missed_ticks,
+            trigger=trigger, runner=runner, started_at=started_at
+        )).inserted_primary_key[0]
+
+    started = time.perf_counter()
+    try:
+        result = task.func(RunContext(task.name, scheduled_for, previous, missed_ticks, trigger))
+    except Exception as exc:
+        db.session.rollback()
+        values = {'status': 'failed',
+                  'error': ''.join(traceback.format_exception(type(exc), exc, exc.__traceback__))[-4000:]}
+        current_app.logger.error('Scheduled task %s failed: %s', task.name, exc)
+    else:
+        values = {'status': 'succeeded', 'result': result}
+    finally:
+        db.session.remove()
+
+    duration_ms = round((time.perf_counter() - started) * 1000, 2)
+    task_values = {'last_run_at': started_at, 'last_status': values['status'], 'last_duration_ms': duration_ms}
+    if values['status'] == 'succeeded':
+        # Manual runs can finish after a later scheduled one; the window only moves forward
+        covered = _tasks_table.c.covered_until
+        task_values['covered_until'] = case(
+            (or_(covered.is_(None), covered < scheduled_for), scheduled_for), else_=covered
+        )
+        current_app.logger.info('Scheduled task %s succeeded in %.0fms', task.name, duration_ms)
+    with db.engine.begin() as conn:
+        conn.execute(update(_runs_table).where(_runs_table.c.id == run_id).values(
+            finished_at=datetime.utcnow(), duration_ms=duration_ms, **values
+        ))
+        conn.execute(update(_tasks_table).where(_tasks_table.c.name == task.name).values(**task_values))
+    return run_id
+
+
+def _run_due(task, row, holder, now):
+    spec = CronSpec(row.cron)
+    ticks = []
+    tick = row.next_run_at
+    while tick <= now and len(ticks) < MAX_CATCH_UP_TICKS:
+        ticks.append(tick)
+        tick = spec.next_after(tick)
+    next_run_at = tick if tick > now else spec.next_after(now)
+
+    with db.engine.begin() as conn:
+        claimed = conn.execute(update(_tasks_table).where(
+            _tasks_table.c.id == row.id, _tasks_table.c.next_run_at == row.next_run_at
+        ).values(next_run_at=next_run_at, updated_at=now)).rowcount
+    if not claimed:
+        return None
+
+    grace = timedelta(seconds=current_app.config.get('SCHEDULER_MISSED_GRACE_SECONDS', 300))
+    missed = [tick for tick in ticks if now - tick > grace]
+    if missed:
+        _alert_missed(task, missed, now)
+    return execute(task, ticks[-1], row.covered_until, holder, len(missed))
+
+
+def tick(holder, now=None):
+    """Run every due task if this process holds the lease; returns the run ids, or None."""
+    now = now or datetime.utcnow()
+    if not acquire_lease(holder, now):
+        return None
+    rows = _sync(now)
+    run_ids = []
+    for name, task in _tasks.items():
+        row = rows[name]
+        if not task.settings()['enabled'] or row.next_run_at > now:
+            continue
+        run_id = _run_due(task, row, holder, now)
+        if run_id is not None:
+            run_ids.append(run_id)
+        # Tasks can be slow; renew before the next one and stop if another process took over
+        if not acquire_lease(holder):
+            break
+    return run_ids
+
+
+def run_now(name, runner=None):
+    """Run a task immediately, outside its schedule; returns the run id."""
+    task = _tasks[name]
+    row = db.session.execute(select(ScheduledTask).where(ScheduledTask.name == name)).scalar()
+    previous = row.covered_until if row else None
+    db.session.commit()
+    return execute(task, datetime.utcnow(), previous, runner or holder_id(), trigger='manual')
+
+
+def run(app, holder=None, stop=None):
+    """Run ticks every ``SCHEDULER_POLL_SECONDS`` until ``stop`` is set."""
+    holder = holder or holder_id()
+    stop = stop or threading.Event()
+    poll = app.config.get('SCHEDULER_POLL_SECONDS', 30)
+    atexit.register(_release_at_exit, app, holder)
+    while True:
+        with app.app_context():
+            try:
+                tick(holder)
+            except Exception:  # pragma: no cover - keep the scheduler alive
+                db.session.rollback()
+                app.logger.exception('Scheduler tick failed')
+            finally:
+                db.session.remove()
+        if stop.wait(poll):
+            break
+    _release_at_exit(app, holder)
+
+
+def _release_at_exit(app, holder):
+    try:
+        with app.app_context():
+            release_lease(holder)
+    except Exception:  # pragma: no cover - the lease will expire on its own
+        pass
+
+
+register_policy(RetentionPolicy(
+    'scheduled_runs',
+    ScheduledRun,
+    lambda now, cutoff: db.and_(ScheduledRun.started_at < cutoff, ScheduledRun.status != 'running'),
+    max_age_days=90,
+    batch_size=5000,
+    description='Scheduler run history older than max_age_days'
+))
+
+
+def init_app(app):
+    """Start the scheduler thread when ``SCHEDULER_ENABLED`` is set."""
+    if not app.config.get('SCHEDULER_ENABLED'):
+        return None
+    thread = threading.Thread(target=run, args=(app,), name='scheduler', daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,225 @@
+"""Full-text search index over agents, clients and sites.
+
+SQLite uses an FTS5 virtual table and PostgreSQL a ``tsvector`` column with
+a GIN index. Both store one row per entity keyed by ``entity_id * 4 + type``
+so upserts and deletes are primary-key operations. The index is kept in
+sync from an ``after_flush`` hook, inside the same transaction as the write
+that changed the entity.
+"""
+import re
+
+from sqlalchemy import event, text
+
+from app import db
+from app.models import Agent, Client, Site
+
+TABLE = 'search_index'
+
+_ENTITIES = {
+    'agent': {
+        'model': Agent,
+        'code': 1,
+        'title': lambda a: a.full_name,
+        'subtitle': lambda a: ' · '.join(filter(None, [a.employee_code, a.badge_number, a.employment_status])),
+        'fields': ['first_name', 'last_name', 'employee_code', 'badge_number', 'national_id',
+                   'phone_primary', 'phone_secondary', 'email', 'city'],
+        'extra': ['employment_status'],
+    },
+    'client': {
+        'model': Client,
+        'code': 2,
+        'title': lambda c: c.company_name,
+        'subtitle': lambda c: ' · '.join(filter(None, [c.primary_contact_name, c.city])),
+        'fields': ['company_name', 'company_registration_number', 'tax_id', 'primary_contact_name',
+                   'primary_contact_phone', 'primary_contact_email', 'billing_contact_name', 'city'],
+    },
+    'site': {
+        'model': Site,
+        'code': 3,
+        'title': lambda s: s.site_name,
+        'subtitle': lambda s: ' · '.join(filter(None, [s.site_code, s.city])),
+        'fields': ['site_name', 'site_code', 'address', 'city', 'site_contact_name',
+                   'site_contact_phone', 'site_contact_email'],
+    },
+}
+_BY_MODEL = {spec['model']: (name, spec) for name, spec in _ENTITIES.items()}
+_BY_CODE = {spec['code']: name for name, spec in _ENTITIES.items()}
+
+_TOKEN = re.compile(r'\w+', re.UNICODE)
+
+
+def _key(spec, entity_id):
+    return entity_id * 4 + spec['code']
+
+
+def _document(spec, obj):
+    content = ' '.join(str(getattr(obj, field)) for field in spec['fields'] if getattr(obj, field))
+    return {
+        'title': spec['title'](obj) or '',
+        'subtitle': spec['subtitle'](obj) or '',
+        'content': content,
+    }
+
+
+def _is_postgres(connection):
+    return connection.dialect.name == 'postgresql'
+
+
+def create_index(connection):
+    if _is_postgres(connection):
+        connection.execute(text(
+            f'CREATE TABLE IF NOT EXISTS {TABLE} ('
+            'id BIGINT PRIMARY KEY, title TEXT, subtitle TEXT, content TEXT, document TSVECTOR)'
+        ))
+        connection.execute(text(
+            f'CREATE INDEX IF NOT EXISTS ix_{TABLE}_document ON {TABLE} USING GIN (document)'
+        ))
+    else:
+        connection.execute(text(
+            f'CREATE VIRTUAL TABLE IF NOT EXISTS {TABLE} USING fts5('
+            "title, subtitle UNINDEXED, content, "
+            "tokenize='unicode61 remove_diacritics 2', prefix='2 3')"
+        ))
+
+
+def _upsert(connection, rows):
+    if not rows:
+        return
+    if _is_postgres(connection):
+        connection.execute(text(
+            f'INSERT INTO {TABLE} (id, title, subtitle, content, document) '
+            "VALUES (:id, :title, :subtitle, :content, "
+            "setweight(to_tsvector('simple', :title), 'A') || to_tsvector('simple', :content)) "
+            'ON CONFLICT (id) DO UPDATE SET title = EXCLUDED.title, subtitle = EXCLUDED.subtitle, '
+            'content = EXCLUDED.content, document = EXCLUDED.document'
+        ), rows)
+    else:
+        _delete(connection, [row['id'] for row in rows])
+        connection.execute(text(
+            f'INSERT INTO {TABLE} (rowid, title, subtitle, content) '
+            'VALUES (:id, :title, :subtitle, :content)'
+        ), rows)
+
+
+def _delete(connection, keys):
+    if not keys:
+        return
+    column = 'id' if _is_postgres(connection) else 'rowid'
+    connection.execute(text(f'DELETE FROM {TABLE} WHERE {column} = :id'), [{'id': key} for key in keys])
+
+
+def _indexed_fields_changed(spec, obj):
+    state = db.inspect(obj)
+    return any(state.attrs[field].history.has_changes() for field in spec['fields'] + spec.get('extra', []))
+
+
+def _after_flush(session, flush_context):
+    upserts, deletes = {}, set()
+    for obj in list(session.new) + list(session.dirty):
+        entry = _BY_MODEL.get(type(obj))
+        if not entry or obj.id is None:
+            continue
+        spec = entry[1]
+        if obj not in session.new and not _indexed_fields_changed(spec, obj):
+            continue
+        upserts[_key(spec, obj.id)] = {'id': _key(spec, obj.id), **_document(spec, obj)}
+    for obj in session.deleted:
+        entry = _BY_MODEL.get(type(obj))
+        if entry and obj.id is not None:
+            deletes.add(_key(entry[1], obj.id))
+
+    if upserts or deletes:
+        connection = session.connection()
+        _delete(connection, deletes)
+        _upsert(connection, list(upserts.values()))
+
+
+def rebuild(batch_size=1000):
+    """Recreate the whole index from the source tables."""
+    connection = db.session.connection()
+    connection.execute(text(f'DELETE FROM {TABLE}'))
+    total = 0
+    for spec in _ENTITIES.values():
+        model = spec['model']
+        last_id = 0
+        while True:
+            batch = model.query.filter(model.id > last_id).order_by(model.id).limit(batch_size).all()
+            if not batch:
+                break
+            _upsert(connection, [{'id': _key(spec, obj.id), **_document(spec, obj)} for obj in batch])
+            total += len(batch)
+            last_id = batch[-1].id
+    db.session.commit()
+    return total
+
+
+def indexed_fields(model):
+    """Columns of ``model`` that feed its search document; empty when it is not indexed."""
+    entry = _BY_MODEL.get(model)
+    return set(entry[1]['fields'] + entry[1].get('extra', [])) if entry else set()
+
+
+def reindex(model, ids, batch_size=1000):
+    """Re-index rows of ``model`` written with bulk SQL, which the flush hook never sees."""
+    spec = _BY_MODEL[model][1]
+    connection = db.session.connection()
+    ids = list(ids)
+    for index in range(0, len(ids), batch_size):
+        batch = model.query.filter(model.id.in_(ids[index:index + batch_size])).all()
+        _upsert(connection, [{'id': _key(spec, obj.id), **_document(spec, obj)} for obj in batch])
+    return len(ids)
+
+
+def _terms(query):
+    return _TOKEN.findall(query or '')[:8]
+
+
+def search(query, types=None, limit=20):
+    """Return ranked, typed matches for ``query``."""
+    terms = _terms(query)
+    if not terms:
+        return []
+
+    codes = [_ENTITIES[name]['code'] for name in (types or _ENTITIES) if name in _ENTITIES]
+    if not codes:
+        return []
+    connection = db.session.connection()
+    key_column = 'id' if _is_postgres(connection) else 'rowid'
+    type_filter = ' AND ({} % 4) IN ({})'.format(key_column, ', '.join(str(code) for code in codes))
+
+    if _is_postgres(connection):
+        tsquery = ' & '.join(f'{term}:*' for term in terms)
+        rows = connection.execute(text(
+            f'SELECT id, title, subtitle, ts_rank(document, q) AS score '
+            f"FROM {TABLE}, to_tsquery('simple', :q) AS q "
+            f'WHERE document @@ q{type_filter} ORDER BY score DESC LIMIT :limit'
+        ), {'q': tsquery, 'limit': limit}).all()
+    else:
+        match = ' '.join('"{}"*'.format(term.replace('"', '')) for term in terms)
+        rows = connection.execute(text(
+            f'SELECT rowid AS id, title, subtitle, -bm25({TABLE}, 10.0, 0.0, 1.0) AS score '
+            f'FROM {TABLE} WHERE {TABLE} MATCH :q{type_filter} '
+            'ORDER BY score DESC LIMIT :limit'
+        ), {'q': match, 'limit': limit}).all()
+
+    return [
+        {
+            'type': _BY_CODE[row.id % 4],
+            'id': row.id // 4,
+            'title': row.title,
+            'subtitle': row.subtitle,
+            'score': round(float(row.score), 4),
+        }
+        for row in rows
+    ]
+
+
+def init_app(app):
+    with app.app_context():
+        create_index(db.session.connection())
+        db.session.commit()
+        empty = db.session.execute(text(f'SELECT 1 FROM {TABLE} LIMIT 1')).first() is None
+        if empty and any(spec['model'].query.first() for spec in _ENTITIES.values()):
+            rebuild()
+    if not event.contains(db.session, 'after_flush', _after_flush):
+        event.listen(db.session, 'after_flush', _after_flush)
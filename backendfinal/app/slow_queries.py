@@ -0,0 +1,173 @@
+"""Slow-query log with query plans.
+
+Statements slower than ``SLOW_QUERY_THRESHOLD_MS`` are normalized into a
+fingerprint (literals and IN lists collapsed) and aggregated per
+fingerprint. The first time a fingerprint is seen, its plan is captured
+with ``EXPLAIN QUERY PLAN`` on SQLite or ``EXPLAIN`` on PostgreSQL. Recent
+occurrences are kept in a ring buffer; aggregates are capped at
+``SLOW_QUERY_MAX_FINGERPRINTS`` by dropping the cheapest entries.
+"""
+import hashlib
+import re
+import threading
+from collections import deque
+from datetime import datetime
+
+from flask import has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from app import sql_timing
+
+_lock = threading.Lock()
+_recent = deque(maxlen=200)
+_fingerprints = {}
+_settings = {'threshold_ms': 100.0, 'max_fingerprints': 500, 'explain': True, 'logger': None}
+
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r'\b\d+(?:\.\d+)?\b')
+_IN_LIST = re.compile(r'\bIN\s*\((?:\s*(?:\?|%\([^)]*\)s|:\w+|%s)\s*,?)+\)', re.IGNORECASE)
+_SPACE = re.compile(r'\s+')
+
+
+def normalize(statement):
+    sql = _STRING.sub('?', statement)
+    sql = _NUMBER.sub('?', sql)
+    sql = _IN_LIST.sub('IN (...)', sql)
+    return _SPACE.sub(' ', sql).strip()
+
+
+def _shape(parameters, executemany):
+    if executemany:
+        first = parameters[0] if parameters else None
+        return {'executemany': len(parameters), 'row': _shape(first, False)}
+    if isinstance(parameters, dict):
+        return {key: type(value).__name__ for key, value in parameters.items()}
+    if isinstance(parameters, (list, tuple)):
+        return [type(value).__name__ for value in parameters]
+    return None
+
+
+def _route():
+    if not has_request_context():
+        return None
+    rule = request.url_rule.rule if request.url_rule else request.path
+    return f'{request.method} {rule}'
+
+
+def _explain(cursor, dialect, statement, parameters):
+    if not statement.lstrip().upper().startswith(('SELECT', 'WITH')):
+        return None
+    prefix = 'EXPLAIN QUERY PLAN ' if dialect == 'sqlite' else 'EXPLAIN '
+    # EXPLAIN shares the caller's transaction. Outside SQLite a failed statement
+    # aborts it, so the plan runs inside a savepoint that is rolled back.
+    savepoint = dialect != 'sqlite'
+    try:
+        plan_cursor = cursor.connection.cursor()
+        try:
+            if savepoint:
+                plan_cursor.execute('SAVEPOINT slowlog_explain')
+            try:
+                plan_cursor.execute(prefix + statement, parameters)
+                rows = plan_cursor.fetchall()
+            except Exception:
+                if savepoint:
+                    plan_cursor.execute('ROLLBACK TO SAVEPOINT slowlog_explain')
+                raise
+            finally:
+                if savepoint:
+                    plan_cursor.execute('RELEASE SAVEPOINT slowlog_explain')
+        finally:
+            plan_cursor.close()
+    except Exception as exc:  # plans are best effort
+        return [f'EXPLAIN failed: {exc}']
+    if dialect == 'sqlite':
+        return [row[-1] for row in rows]
+    return [row[0] for row in rows]
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = sql_timing.elapsed(context)
+    if elapsed is None:
+        return
+    elapsed_ms = elapsed * 1000
+    if elapsed_ms < _settings['threshold_ms']:
+        return
+
+    normalized = normalize(statement)
+    fingerprint = hashlib.sha1(normalized.encode()).hexdigest()[:16]
+    route = _route()
+    now = datetime.utcnow().isoformat()
+
+    with _lock:
+        entry = _fingerprints.get(fingerprint)
+        needs_plan = entry is None
+    plan = None
+    if needs_plan and _settings['explain'] and not executemany:
+        plan = _explain(cursor, conn.dialect.name, statement, parameters)
+
+    with _lock:
+        entry = _fingerprints.get(fingerprint)
+        if entry is None:
+            if len(_fingerprints) >= _settings['max_fingerprints']:
+                cheapest = min(_fingerprints, key=lambda key: _fingerprints[key]['total_ms'])
+                del _fingerprints[cheapest]
+            entry = _fingerprints[fingerprint] = {
+                'fingerprint': fingerprint,
+                'sql': normalized,
+                'parameters': _shape(parameters, executemany),
+                'plan': plan,
+                'count': 0,
+                'total_ms': 0.0,
+                'max_ms': 0.0,
+                'routes': {},
+                'first_seen': now,
+            }
+        entry['count'] += 1
+        entry['total_ms'] += elapsed_ms
+        entry['max_ms'] = max(entry['max_ms'], elapsed_ms)
+        entry['last_seen'] = now
+        if route:
+            entry['routes'][route] = entry['routes'].get(route, 0) + 1
+        _recent.append({
+            'fingerprint': fingerprint,
+            'duration_ms': round(elapsed_ms, 3),
+            'route': route,
+            'at': now,
+        })
+
+    if _settings['logger'] is not None:
+        _settings['logger'].warning('Slow query %.1f ms [%s] on %s: %s',
+                                    elapsed_ms, fingerprint, route or '-', normalized[:300])
+
+
+def top(limit=20, order_by='total_ms'):
+    with _lock:
+        entries = [dict(entry, routes=dict(entry['routes'])) for entry in _fingerprints.values()]
+    entries.sort(key=lambda entry: entry[order_by], reverse=True)
+    for entry in entries:
+        entry['avg_ms'] = round(entry['total_ms'] / entry['count'], 3)
+        entry['total_ms'] = round(entry['total_ms'], 3)
+        entry['max_ms'] = round(entry['max_ms'], 3)
+    return entries[:limit]
+
+
+def recent(limit=50):
+    with _lock:
+        return list(_recent)[-limit:][::-1]
+
+
+def reset():
+    with _lock:
+        _recent.clear()
+        _fingerprints.clear()
+
+
+def init_app(app):
+    _settings['threshold_ms'] = app.config.get('SLOW_QUERY_THRESHOLD_MS', 100.0)
+    _settings['max_fingerprints'] = app.config.get('SLOW_QUERY_MAX_FINGERPRINTS', 500)
+    _settings['explain'] = app.config.get('SLOW_QUERY_EXPLAIN', True)
+    _settings['logger'] = app.logger
+    sql_timing.install()
+    if not event.contains(Engine, 'after_cursor_execute', _after_cursor_execute):
+        event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
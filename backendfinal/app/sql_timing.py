@@ -0,0 +1,30 @@
+"""Start times of SQL statements, shared by the engine listeners that time them.
+
+``metrics`` and ``slow_queries`` both measure each statement. One
+``before_cursor_execute`` listener stamps the statement's execution context,
+and their ``after_cursor_execute`` listeners read it with ``elapsed``. The
+stamp lives and dies with the context, so a statement that fails leaves
+nothing behind on the connection.
+"""
+import time
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if context is not None:
+        context._sql_started = time.perf_counter()
+
+
+def elapsed(context):
+    """Seconds since the statement of ``context`` started, or None when it was not timed."""
+    started = getattr(context, '_sql_started', None)
+    if started is None:
+        return None
+    return time.perf_counter() - started
+
+
+def install():
+    if not event.contains(Engine, 'before_cursor_execute', _before_cursor_execute):
+        event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
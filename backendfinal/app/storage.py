@@ -0,0 +1,266 @@
+"""Content-addressed file storage.
+
+Uploaded bytes are streamed chunk by chunk into a backend while their
+SHA-256 is computed, so no upload is ever held in memory. Files are stored
+under their digest, which deduplicates identical uploads and makes every
+stored file immutable. ``LocalStorage`` keeps files on disk; an object-store
+backend only needs to implement the ``StorageBackend`` methods.
+"""
+import hashlib
+import mimetypes
+import os
+import tempfile
+
+from flask import current_app, request
+from werkzeug.formparser import FormDataParser
+
+from app import db
+from app.models import StoredFile
+
+CHUNK_SIZE = 64 * 1024
+
+_SIGNATURES = [
+    (b'\xff\xd8\xff', 'image/jpeg'),
+    (b'\x89PNG\r\n\x1a\n', 'image/png'),
+    (b'GIF87a', 'image/gif'),
+    (b'GIF89a', 'image/gif'),
+    (b'%PDF-', 'application/pdf'),
+    (b'PK\x03\x04', 'application/zip'),
+]
+
+
+def sniff_mime_type(head, filename=None, declared=None):
+    """Guess a MIME type from the first bytes, then the filename, then the client."""
+    for signature, mime_type in _SIGNATURES:
+        if head.startswith(signature):
+            return mime_type
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return 'image/webp'
+    guessed = mimetypes.guess_type(filename)[0] if filename else None
+    return guessed or declared or 'application/octet-stream'
+
+
+class PendingUpload:
+    """Write-only sink that hashes bytes on their way to a temporary file."""
+
+    def __init__(self, fileobj):
+        self._file = fileobj
+        self._hash = hashlib.sha256()
+        self.name = fileobj.name
+        self.size = 0
+        self.head = b''
+        self.committed = False
+
+    def write(self, data):
+        self._hash.update(data)
+        self.size += len(data)
+        if len(self.head) < 16:
+            self.head += data[:16 - len(self.head)]
+        return self._file.write(data)
+
+    def seek(self, *args):
+        return self._file.seek(*args)
+
+    def tell(self):
+        return self._file.tell()
+
+    def read(self, *args):
+        return self._file.read(*args)
+
+    def close(self):
+        if not self._file.closed:
+            self._file.close()
+
+    @property
+    def sha256(self):
+        return self._hash.hexdigest()
+
+
+class StorageBackend:
+    """Interface implemented by every storage backend."""
+
+    name = None
+
+    def open_upload(self):
+        """Return a ``PendingUpload`` ready to receive bytes."""
+        raise NotImplementedError
+
+    def commit(self, upload):
+        """Persist a finished upload under its digest and return the digest."""
+        raise NotImplementedError
+
+    def discard(self, upload):
+        raise NotImplementedError
+
+    def open(self, sha256):
+        """Return a seekable binary file object for a stored digest."""
+        raise NotImplementedError
+
+    def local_path(self, sha256):
+        """Filesystem path usable with sendfile, or None for remote backends."""
+        return None
+
+    def exists(self, sha256):
+        raise NotImplementedError
+
+    def delete(self, sha256):
+        raise NotImplementedError
+
+
+class LocalStorage(StorageBackend):
+    """Stores files on disk as ``<root>/<ab>/<cd>/<sha256>``."""
+
+    name = 'local'
+
+    def __init__(self, root):
+        self.root = root
+        self.tmp_dir = os.path.join(root, 'tmp')
+        os.makedirs(self.tmp_dir, exist_ok=True)
+
+    def _path(self, sha256):
+        return os.path.join(self.root, sha256[:2], sha256[2:4], sha256)
+
+    def open_upload(self):
+        return PendingUpload(tempfile.NamedTemporaryFile(dir=self.tmp_dir, delete=False))
+
+    def commit(self, upload):
+        upload.close()
+        target = self._path(upload.sha256)
+        if os.path.exists(target):
+            os.remove(upload.name)
+        else:
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            os.replace(upload.name, target)
+        return upload.sha256
+
+    def discard(self, upload):
+        upload.close()
+        if os.path.exists(upload.name):
+            os.remove(upload.name)
+
+    def open(self, sha256):
+        return open(self._path(sha256), 'rb')
+
+    def local_path(self, sha256):
+        path = self._path(sha256)
+        return path if os.path.exists(path) else None
+
+    def exists(self, sha256):
+        return os.path.exists(self._path(sha256))
+
+    def delete(self, sha256):
+        if self.exists(sha256):
+            os.remove(self._path(sha256))
+
+
+BACKENDS = {'local': LocalStorage}
+
+_store_hooks = []
+
+
+def on_store(func):
+    """Register ``func(stored_file)`` to run whenever new content is stored."""
+    if func not in _store_hooks:
+        _store_hooks.append(func)
+    return func
+
+
+def init_app(app):
+    backend = BACKENDS[app.config.get('STORAGE_BACKEND', 'local')]
+    app.extensions['storage'] = backend(app.config['STORAGE_ROOT'])
+
+
+def get_storage():
+    return current_app.extensions['storage']
+
+
+def _register(upload, filename=None, declared_type=None, user_id=None):
+    """Commit an upload and return its ``StoredFile`` row, reusing duplicates."""
+    storage = get_storage()
+    sha256 = storage.commit(upload)
+    upload.committed = True
+    stored = StoredFile.query.filter_by(sha256=sha256).first()
+    if stored is None:
+        stored = StoredFile(
+            sha256=sha256,
+            size_bytes=upload.size,
+            mime_type=sniff_mime_type(upload.head, filename, declared_type),
+            original_name=filename,
+            storage_backend=storage.name,
+            created_by=user_id
+        )
+        db.session.add(stored)
+        db.session.flush()
+        for hook in _store_hooks:
+            hook(stored)
+    return stored
+
+
+def save_stream(stream, filename=None, declared_type=None, user_id=None):
+    """Copy a binary stream into storage chunk by chunk."""
+    storage = get_storage()
+    upload = storage.open_upload()
+    try:
+        while True:
+            chunk = stream.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            upload.write(chunk)
+    except Exception:
+        storage.discard(upload)
+        raise
+    return _register(upload, filename, declared_type, user_id)
+
+
+def receive_uploads(user_id=None, validate=None):
+    """Store the files of the current request.
+
+    Multipart bodies are parsed with a stream factory that writes each part
+    straight into storage; any other body is stored as a single file named
+    by the ``X-Filename`` header. Returns ``(form, {field: StoredFile})``.
+
+    ``validate(form)`` runs before any file is kept; a ``ValueError`` it
+    raises discards the uploads and propagates.
+    """
+    storage = get_storage()
+
+    if request.mimetype != 'multipart/form-data':
+        if validate is not None:
+            validate(request.args)
+        if not request.content_length:
+            return request.args, {}
+        stored = save_stream(
+            request.stream,
+            filename=request.headers.get('X-Filename'),
+            declared_type=request.mimetype,
+            user_id=user_id
+        )
+        return request.args, {'file': stored}
+
+    pending = []
+
+    def stream_factory(total_content_length, content_type, filename=None, content_length=None):
+        upload = storage.open_upload()
+        pending.append(upload)
+        return upload
+
+    parser = FormDataParser(
+        stream_factory=stream_factory,
+        max_content_length=current_app.config.get('MAX_CONTENT_LENGTH'),
+        silent=False
+    )
+    try:
+        _, form, files = parser.parse(
+            request.stream, request.mimetype, request.content_length, request.mimetype_params
+        )
+        if validate is not None:
+            validate(form)
+        stored = {
+            field: _register(item.stream, item.filename, item.mimetype, user_id)
+            for field, item in files.items()
+        }
+    finally:
+        for upload in pending:
+            if not upload.committed:
+                storage.discard(upload)
+    return form, stored
@@ -0,0 +1,301 @@
+"""Request tracing in Zipkin v2 JSON.
+
+Each traced request gets a root span with child spans for JWT verification,
+every SQL statement, model serialization (``to_dict``) and JSON encoding.
+Views can add their own spans with ``span(name)``. Incoming W3C
+``traceparent`` headers are honoured. The trace id goes back in
+``X-Trace-Id`` and ``traceparent`` response headers.
+
+Finished traces are queued and written by a background exporter, one JSON
+array per line to ``TRACE_EXPORT_PATH``. When ``TRACE_COLLECTOR_URL`` is
+set, they are also POSTed to it, e.g. a Zipkin or OpenTelemetry collector
+``/api/v2/spans`` endpoint. Nothing is registered unless
+``TRACING_ENABLED`` is set.
+"""
+import functools
+import json
+import os
+import queue
+import random
+import re
+import threading
+import time
+import urllib.request
+from contextlib import contextmanager
+
+from flask import g, has_request_context, request
+from flask.json.provider import DefaultJSONProvider
+from flask_jwt_extended.config import config as jwt_config
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from app import db, jwt
+
+SERVICE_NAME = 'ccss-ops'
+
+_TRACEPARENT = re.compile(r'^00-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$')
+
+_exporter = None
+_settings = {'sample_rate': 1.0, 'max_spans': 1000}
+
+
+def _new_id(size=8):
+    return os.urandom(size).hex()
+
+
+class Trace:
+    """Spans collected for a single request."""
+
+    def __init__(self, trace_id, parent_id=None, max_spans=1000):
+        self.trace_id = trace_id
+        self.max_spans = max_spans
+        self.spans = []
+        self.stack = []
+        self.dropped = 0
+        self.root = self.start('request', kind='SERVER', parent_id=parent_id)
+
+    def start(self, name, kind=None, parent_id=None, **tags):
+        span = {
+            'traceId': self.trace_id,
+            'id': _new_id(),
+            'name': name,
+            'timestamp': time.time_ns() // 1000,
+            'localEndpoint': {'serviceName': SERVICE_NAME},
+            'tags': {key: str(value) for key, value in tags.items()},
+            '_started': time.perf_counter(),
+        }
+        parent_id = parent_id or (self.stack[-1]['id'] if self.stack else None)
+        if parent_id:
+            span['parentId'] = parent_id
+        if kind:
+            span['kind'] = kind
+        self.stack.append(span)
+        return span
+
+    def end(self, span, **tags):
+        span['duration'] = max(int((time.perf_counter() - span.pop('_started')) * 1_000_000), 1)
+        span['tags'].update((key, str(value)) for key, value in tags.items())
+        if span in self.stack:
+            self.stack.remove(span)
+        if len(self.spans) < self.max_spans or span is self.root:
+            self.spans.append(span)
+        else:
+            self.dropped += 1
+
+    def close(self, **tags):
+        """End any span left open (e.g. by an exception), then the root."""
+        for span in list(reversed(self.stack)):
+            if span is not self.root:
+                self.end(span, error='unfinished')
+        if self.dropped:
+            tags['spans.dropped'] = self.dropped
+        self.end(self.root, **tags)
+        return self.spans
+
+
+def current_trace():
+    if not has_request_context():
+        return None
+    return g.get('_trace')
+
+
+@contextmanager
+def span(name, **tags):
+    """Time a block as a child of the current span; a no-op when untraced."""
+    trace = current_trace()
+    if trace is None:
+        yield None
+        return
+    current = trace.start(name, **tags)
+    try:
+        yield current
+    except Exception as exc:
+        trace.end(current, error=type(exc).__name__)
+        raise
+    trace.end(current)
+
+
+class TraceExporter:
+    """Background thread that writes finished traces to a file and/or collector."""
+
+    def __init__(self, app, path=None, collector_url=None, batch_size=50, interval=1.0):
+        self.app = app
+        self.path = path
+        self.collector_url = collector_url
+        self.batch_size = batch_size
+        self.interval = interval
+        self.queue = queue.Queue(maxsize=10000)
+        self._thread = threading.Thread(target=self._run, name='trace-exporter', daemon=True)
+        self._thread.start()
+
+    def enqueue(self, spans):
+        try:
+            self.queue.put_nowait(spans)
+        except queue.Full:
+            self.app.logger.warning('Trace queue full, dropping trace %s', spans[0]['traceId'])
+
+    def _drain(self, first):
+        batch = [first]
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _export(self, batch):
+        if self.path:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            with open(self.path, 'a') as handle:
+                for spans in batch:
+                    handle.write(json.dumps(spans) + '\n')
+        if self.collector_url:
+            body = json.dumps([span for spans in batch for span in spans]).encode()
+            post = urllib.request.Request(self.collector_url, data=body, method='POST',
+                                          headers={'Content-Type': 'application/json'})
+            with urllib.request.urlopen(post, timeout=5):
+                pass
+
+    def _run(self):
+        while True:
+            try:
+                first = self.queue.get(timeout=self.interval)
+            except queue.Empty:
+                continue
+            batch = self._drain(first)
+            try:
+                self._export(batch)
+            except Exception:  # pragma: no cover - never let the exporter die
+                self.app.logger.exception('Failed to export %s traces', len(batch))
+
+    def flush(self):
+        while not self.queue.empty():
+            self._export(self._drain(self.queue.get_nowait()))
+
+
+def _start_trace():
+    incoming = _TRACEPARENT.match(request.headers.get('traceparent', ''))
+    if incoming:
+        if incoming.group(3) == '00':
+            return
+        trace_id, parent_id = incoming.group(1), incoming.group(2)
+    elif random.random() < _settings['sample_rate']:
+        trace_id, parent_id = _new_id(16), None
+    else:
+        return
+    trace = Trace(trace_id, parent_id, _settings['max_spans'])
+    rule = request.url_rule.rule if request.url_rule else request.path
+    trace.root['name'] = f'{request.method} {rule}'
+    trace.root['tags'].update({'http.method': request.method, 'http.path': request.path})
+    g._trace = trace
+
+
+def _finish_trace(response):
+    trace = g.pop('_trace', None)
+    if trace is None:
+        return response
+    spans = trace.close(**{'http.status_code': response.status_code})
+    if _exporter is not None:
+        _exporter.enqueue(spans)
+    response.headers['X-Trace-Id'] = trace.trace_id
+    response.headers['traceparent'] = f'00-{trace.trace_id}-{trace.root["id"]}-01'
+    return response
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    trace = current_trace()
+    if trace is not None and context is not None:
+        context._trace_span = trace.start('sql', **{
+            'db.system': conn.dialect.name,
+            'db.statement': ' '.join(statement.split())[:500],
+        })
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    current = context.__dict__.pop('_trace_span', None) if context is not None else None
+    trace = current_trace()
+    if current is not None and trace is not None:
+        tags = {'db.rows': cursor.rowcount} if cursor.rowcount >= 0 else {}
+        trace.end(current, **tags)
+
+
+def _handle_error(exception_context):
+    # The span of a failed statement is ended here, with the error, rather than in after_cursor_execute
+    context = exception_context.execution_context
+    current = context.__dict__.pop('_trace_span', None) if context is not None else None
+    trace = current_trace()
+    if current is not None and trace is not None:
+        trace.end(current, error=type(exception_context.original_exception).__name__)
+
+
+def _jwt_decode_key(jwt_header, jwt_data):
+    trace = current_trace()
+    if trace is not None:
+        g._trace_jwt = trace.start('jwt.verify', alg=jwt_header.get('alg'))
+    return jwt_config.decode_key
+
+
+def _jwt_verified(jwt_header, jwt_data):
+    trace = current_trace()
+    current = g.pop('_trace_jwt', None) if has_request_context() else None
+    if trace is not None and current is not None:
+        trace.end(current, **{'enduser.id': jwt_data.get(jwt_config.identity_claim_key)})
+    return True
+
+
+def _traced_to_dict(func, model):
+    @functools.wraps(func)
+    def to_dict(self, *args, **kwargs):
+        trace = current_trace()
+        # Only the outermost to_dict gets a span; nested ones are part of it
+        if trace is None or (trace.stack and trace.stack[-1]['name'] == 'serialize'):
+            return func(self, *args, **kwargs)
+        with span('serialize', model=model):
+            return func(self, *args, **kwargs)
+    to_dict.__traced__ = True
+    return to_dict
+
+
+class TracingJSONProvider(DefaultJSONProvider):
+    """Default provider that times JSON encoding as its own span."""
+
+    def dumps(self, obj, **kwargs):
+        with span('json.encode'):
+            return super().dumps(obj, **kwargs)
+
+
+def flush():
+    if _exporter is not None:
+        _exporter.flush()
+
+
+def init_app(app):
+    global _exporter
+    if not app.config.get('TRACING_ENABLED'):
+        return
+    _settings['sample_rate'] = app.config.get('TRACE_SAMPLE_RATE', 1.0)
+    _settings['max_spans'] = app.config.get('TRACE_MAX_SPANS', 1000)
+
+    if _exporter is None:
+        _exporter = TraceExporter(app, app.config.get('TRACE_EXPORT_PATH'), app.config.get('TRACE_COLLECTOR_URL'))
+    else:
+        _exporter.app = app
+        _exporter.path = app.config.get('TRACE_EXPORT_PATH')
+        _exporter.collector_url = app.config.get('TRACE_COLLECTOR_URL')
+
+    if not event.contains(Engine, 'before_cursor_execute', _before_cursor_execute):
+        event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+        event.listen(Engine, 'handle_error', _handle_error)
+
+    for mapper in db.Model.registry.mappers:
+        model = mapper.class_
+        to_dict = model.__dict__.get('to_dict')
+        if to_dict is not None and not getattr(to_dict, '__traced__', False):
+            model.to_dict = _traced_to_dict(to_dict, model.__name__)
+
+    jwt.decode_key_loader(_jwt_decode_key)
+    jwt.token_verification_loader(_jwt_verified)
+    app.json = TracingJSONProvider(app)
+    app.before_request(_start_trace)
+    app.after_request(_finish_trace)